@@ -3,6 +3,12 @@
 echo "Starting message consumer"
 /opt/sfm-ui/sfm/manage.py startconsumer &
 
+echo "Starting mail sender"
+/opt/sfm-ui/sfm/manage.py startmailsender &
+
+echo "Starting message dispatcher"
+/opt/sfm-ui/sfm/manage.py startdispatcher &
+
 echo "Running server"
 export SFM_RUN_SCHEDULER=True
 /opt/sfm-ui/sfm/manage.py runserver 0.0.0.0:80
\ No newline at end of file
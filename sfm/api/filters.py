@@ -12,7 +12,7 @@ class ListFilter(Filter):
 class WarcFilter(FilterSet):
     # Allows queries like /api/v1/warcs/?collection=39c00280274a4db0b1cb5bfa4d527a1e
     collection = CharFilter(name="harvest__historical_collection__collection_id")
-    seed = ListFilter(name="harvest__historical_seeds__seed_id", distinct=True)
+    seed = ListFilter(name="harvest__seed_set__historical_seeds__seed_id", distinct=True)
     harvest_date_start = IsoDateTimeFilter(name="harvest__date_started", lookup_type='gte')
     harvest_date_end = IsoDateTimeFilter(name="harvest__date_started", lookup_type='lte')
     exclude_web = MethodFilter(action="web_filter")
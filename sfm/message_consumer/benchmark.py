@@ -0,0 +1,234 @@
+"""
+Throughput benchmark for SfmUiConsumer.
+
+Messages are generated synthetically and delivered to the consumer by an
+in-process stand-in for RabbitMQ, so consumer changes can be measured without
+a broker. See the benchmarkconsumer management command.
+"""
+import datetime
+import logging
+import random
+import time
+from collections import deque
+
+from django.contrib.auth.models import Group
+from django.db import connection
+from django.utils import timezone
+from message_consumer.metrics import ConsumerMetrics
+from message_consumer.sfm_ui_consumer import SfmUiConsumer
+from ui.models import User, CollectionSet, Credential, Collection, Seed, Harvest, Export, default_uuid
+
+log = logging.getLogger(__name__)
+
+
+class FakeBroker:
+    """
+    Stands in for RabbitMQ by delivering queued messages to a consumer's callback.
+    """
+    def __init__(self):
+        self.queue = deque()
+        self.delivery_tag = 0
+        self.acked = 0
+
+    def publish(self, routing_key, message):
+        self.queue.append((routing_key, message))
+
+    def drain(self, consumer, on_delivery=None):
+        """
+        Delivers all of the queued messages to the consumer.
+        """
+        while self.queue:
+            routing_key, message = self.queue.popleft()
+            self.delivery_tag += 1
+            consumer._callback(message, _FakeMessage(self, routing_key, self.delivery_tag))
+            consumer.on_iteration()
+            if on_delivery:
+                on_delivery()
+        if consumer.batch:
+            consumer.process_batch()
+        if on_delivery:
+            on_delivery()
+
+
+class _FakeMessage:
+    def __init__(self, broker, routing_key, delivery_tag):
+        self.broker = broker
+        self.delivery_info = {"routing_key": routing_key}
+        self.delivery_tag = delivery_tag
+
+    def ack(self):
+        self.broker.acked += 1
+
+
+def create_fixtures(harvest_count=10, seed_count=100):
+    """
+    Creates a collection with seed_count seeds, harvest_count harvests and an export.
+    :return: (list of harvest ids, list of seed ids, export id)
+    """
+    group = Group.objects.create(name="benchmark_group_{}".format(default_uuid()))
+    # No email, so that no notification emails are queued.
+    user = User.objects.create_user(username="benchmark_user_{}".format(default_uuid()), email="")
+    user.groups.add(group)
+    collection_set = CollectionSet.objects.create(group=group, name="benchmark_collection_set")
+    credential = Credential.objects.create(user=user, platform="twitter", token=default_uuid())
+    # Inactive, so that no harvests are scheduled.
+    collection = Collection.objects.create(collection_set=collection_set, credential=credential,
+                                           harvest_type=Collection.TWITTER_USER_TIMELINE,
+                                           name="benchmark_collection", harvest_options="{}")
+    seed_ids = []
+    for i in range(seed_count):
+        seed = Seed.objects.create(collection=collection, token="benchmark_user_{}".format(i))
+        seed_ids.append(seed.seed_id)
+    historical_collection = collection.history.all()[0]
+    historical_credential = credential.history.all()[0]
+    harvest_ids = []
+    for _ in range(harvest_count):
+        harvest = Harvest.objects.create(harvest_type=Collection.TWITTER_USER_TIMELINE,
+                                         collection=collection,
+                                         historical_collection=historical_collection,
+                                         historical_credential=historical_credential)
+        harvest_ids.append(harvest.harvest_id)
+    # No collection or seeds, so that the export is not requested.
+    export = Export.objects.create(user=user, export_type=Collection.TWITTER_USER_TIMELINE)
+    return harvest_ids, seed_ids, export.export_id
+
+
+def generate_messages(count, harvest_ids, seed_ids, export_id, stat_days=1, stat_items=1, seed_updates=0,
+                      rand=None):
+    """
+    Generates harvest.status, warc_created, export.status and harvest.start.web messages.
+
+    :param count: number of messages
+    :param stat_days: number of days of stats in each harvest status message
+    :param stat_items: number of items per day in each harvest status message
+    :param seed_updates: number of uid updates in each harvest status message
+    :return: generator of (routing key, message)
+    """
+    rand = rand or random.Random()
+    date_started = timezone.now() - datetime.timedelta(hours=1)
+    for i in range(count):
+        harvest_id = rand.choice(harvest_ids)
+        kind = rand.random()
+        now = timezone.now().isoformat()
+        if kind < 0.6:
+            stats = {}
+            for day in range(stat_days):
+                day_str = (date_started - datetime.timedelta(days=day)).date().isoformat()
+                stats[day_str] = dict(("item_{}".format(item), i + item) for item in range(stat_items))
+            uids = dict((seed_id, "uid_{}_{}".format(seed_id, i))
+                        for seed_id in rand.sample(seed_ids, min(seed_updates, len(seed_ids))))
+            yield "harvest.status.twitter.twitter_user_timeline", {
+                "id": harvest_id,
+                "status": Harvest.RUNNING,
+                "date_started": date_started.isoformat(),
+                "infos": [],
+                "warnings": [],
+                "errors": [],
+                "stats": stats,
+                "uids": uids,
+                "warcs": {
+                    "count": i,
+                    "bytes": i * 1000
+                }
+            }
+        elif kind < 0.9:
+            yield "warc_created", {
+                "warc": {
+                    "path": "/sfm-data/benchmark/{}.warc.gz".format(i),
+                    "sha1": "7512e1c227c29332172118f0b79b2ca75cbe8979",
+                    "bytes": 26146,
+                    "id": default_uuid(),
+                    "date_created": now
+                },
+                "collection_set": {
+                    "id": "benchmark_collection_set"
+                },
+                "harvest": {
+                    "id": harvest_id,
+                    "type": Collection.TWITTER_USER_TIMELINE
+                }
+            }
+        elif kind < 0.95:
+            yield "export.status.twitter.twitter_user_timeline", {
+                "id": export_id,
+                "status": Export.REQUESTED,
+                "date_started": date_started.isoformat(),
+                "date_ended": now,
+                "infos": [{"code": "benchmark", "message": "Message {}".format(i)}],
+                "warnings": [],
+                "errors": []
+            }
+        else:
+            yield "harvest.start.web", {
+                "id": default_uuid(),
+                "parent_id": harvest_id,
+                "type": "web",
+                "seeds": [
+                    {
+                        "token": "http://example.com/{}".format(i)
+                    }
+                ],
+                "collection_set": {
+                    "id": "benchmark_collection_set"
+                }
+            }
+
+
+def run_benchmark(message_count=1000, harvest_count=10, seed_count=100, stat_days=1, stat_items=1,
+                  seed_updates=0, batch_size=1, random_seed=None):
+    """
+    Runs the benchmark against the current database.
+
+    The consumer's own metrics are disabled so that they do not affect the results.
+    :return: map of results
+    """
+    harvest_ids, seed_ids, export_id = create_fixtures(harvest_count=harvest_count, seed_count=seed_count)
+    broker = FakeBroker()
+    for routing_key, message in generate_messages(message_count, harvest_ids, seed_ids, export_id,
+                                                  stat_days=stat_days, stat_items=stat_items,
+                                                  seed_updates=seed_updates, rand=random.Random(random_seed)):
+        broker.publish(routing_key, message)
+
+    consumer = SfmUiConsumer(batch_size=batch_size)
+    consumer.metrics = ConsumerMetrics(interval=0)
+    query_counter = _QueryCounter()
+    start = time.time()
+    with query_counter:
+        broker.drain(consumer, on_delivery=query_counter.collect)
+    elapsed = time.time() - start
+
+    return {
+        "messages": message_count,
+        "acked": broker.acked,
+        "seconds": elapsed,
+        "messages_per_second": message_count / elapsed if elapsed else 0,
+        "queries": query_counter.count,
+        "queries_per_message": float(query_counter.count) / message_count if message_count else 0
+    }
+
+
+class _QueryCounter:
+    """
+    Counts the queries executed on the default database connection.
+    """
+    def __init__(self):
+        self.count = 0
+        self.force_debug_cursor = None
+        self.queries_log = None
+
+    def __enter__(self):
+        self.force_debug_cursor = connection.force_debug_cursor
+        self.queries_log = connection.queries_log
+        connection.force_debug_cursor = True
+        # Unbounded, since a batch may execute more queries than the query log holds.
+        connection.queries_log = deque()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.collect()
+        connection.force_debug_cursor = self.force_debug_cursor
+        connection.queries_log = self.queries_log
+
+    def collect(self):
+        self.count += len(connection.queries_log)
+        connection.queries_log.clear()
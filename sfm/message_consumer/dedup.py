@@ -0,0 +1,85 @@
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from ui.models import ProcessedMessage
+
+log = logging.getLogger(__name__)
+
+# Number of fingerprints to record between pruning the oldest fingerprints
+PRUNE_INTERVAL = 1000
+
+
+def message_fingerprint(routing_key, message):
+    """
+    Returns a fingerprint of the routing key and content of a message.
+    """
+    return hashlib.sha1((routing_key + json.dumps(message, sort_keys=True)).encode("utf-8")).hexdigest()
+
+
+class ProcessedMessageIndex:
+    """
+    Bounded index of the fingerprints of processed messages.
+
+    Fingerprints are persisted as ProcessedMessages, in the caller's transaction,
+    and checked in memory. The persisted fingerprints are loaded on first use,
+    so that messages redelivered after a restart are recognized.
+    """
+    def __init__(self, size=None):
+        self.size = size if size is not None else settings.CONSUMER_DEDUP_SIZE
+        self.fingerprints = None
+        self.added_since_mark = []
+        self.added_count = 0
+
+    def _load(self):
+        self.fingerprints = OrderedDict()
+        if self.size:
+            for fingerprint in reversed(ProcessedMessage.objects.order_by("-id").values_list("fingerprint",
+                                                                                             flat=True)[:self.size]):
+                self.fingerprints[fingerprint] = True
+            log.debug("Loaded %s processed message fingerprints", len(self.fingerprints))
+
+    def __contains__(self, fingerprint):
+        if not self.size:
+            return False
+        if self.fingerprints is None:
+            self._load()
+        return fingerprint in self.fingerprints
+
+    def add(self, fingerprint):
+        if not self.size:
+            return
+        if self.fingerprints is None:
+            self._load()
+        try:
+            with transaction.atomic():
+                processed_message = ProcessedMessage.objects.create(fingerprint=fingerprint)
+        except IntegrityError:
+            # Already recorded, but no longer in memory.
+            return
+        self.fingerprints[fingerprint] = True
+        self.added_since_mark.append(fingerprint)
+        while len(self.fingerprints) > self.size:
+            self.fingerprints.popitem(last=False)
+
+        self.added_count += 1
+        if self.added_count % PRUNE_INTERVAL == 0:
+            ProcessedMessage.objects.filter(id__lte=processed_message.id - self.size).delete()
+
+    def mark(self):
+        """
+        Marks the start of a transaction.
+        """
+        self.added_since_mark = []
+
+    def rollback(self):
+        """
+        Forgets the fingerprints added since the mark, since the transaction they were
+        persisted in was rolled back.
+        """
+        for fingerprint in self.added_since_mark:
+            self.fingerprints.pop(fingerprint, None)
+        self.added_since_mark = []
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from message_consumer.benchmark import run_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the message consumer with synthetic messages and an in-process stand-in for RabbitMQ. ' \
+           'Runs against a test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=1000, help="Number of messages.")
+        parser.add_argument("--harvests", type=int, default=10, help="Number of harvests the messages are for.")
+        parser.add_argument("--seeds", type=int, default=100, help="Number of seeds in the collection.")
+        parser.add_argument("--stat-days", type=int, default=1,
+                            help="Number of days of stats in each harvest status message.")
+        parser.add_argument("--stat-items", type=int, default=1,
+                            help="Number of items per day in each harvest status message.")
+        parser.add_argument("--seed-updates", type=int, default=0,
+                            help="Number of seed uid updates in each harvest status message.")
+        parser.add_argument("--batch-size", type=int, default=1, help="Consumer batch size.")
+        parser.add_argument("--random-seed", type=int, help="Seed for generating messages.")
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = run_benchmark(message_count=options["messages"],
+                                    harvest_count=options["harvests"],
+                                    seed_count=options["seeds"],
+                                    stat_days=options["stat_days"],
+                                    stat_items=options["stat_items"],
+                                    seed_updates=options["seed_updates"],
+                                    batch_size=options["batch_size"],
+                                    random_seed=options["random_seed"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write("Messages: {messages} ({acked} acked)".format(**results))
+        self.stdout.write("Seconds: {seconds:.3f}".format(**results))
+        self.stdout.write("Messages/second: {messages_per_second:.1f}".format(**results))
+        self.stdout.write("Queries/message: {queries_per_message:.2f}".format(**results))
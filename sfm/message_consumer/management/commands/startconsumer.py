@@ -1,6 +1,7 @@
 from django.conf import settings
 from django.core.management.base import BaseCommand
 from message_consumer.sfm_ui_consumer import SfmUiConsumer
+from message_consumer.worker_pool import PartitionedConsumer
 from sfmutils.consumer import MqConfig, EXCHANGE
 
 QUEUE = "sfm_ui"
@@ -11,10 +12,20 @@ ROUTING_KEYS = ["harvest.status.*", "harvest.status.*.*", "warc_created", "expor
 class Command(BaseCommand):
     help = 'Starts the message consumer'
 
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int,
+                            help="Number of messages to prefetch and apply in a batch. Defaults to "
+                                 "CONSUMER_BATCH_SIZE.")
+        parser.add_argument("--workers", type=int,
+                            help="Number of consumer worker processes. Defaults to CONSUMER_WORKERS.")
+
     def handle(self, *args, **options):
         username = settings.RABBITMQ_USER
         password = settings.RABBITMQ_PASSWORD
-        consumer = SfmUiConsumer(mq_config=MqConfig(settings.RABBITMQ_HOST,
-                                 username, password, EXCHANGE,
-                                 {QUEUE: ROUTING_KEYS}))
+        mq_config = MqConfig(settings.RABBITMQ_HOST, username, password, EXCHANGE, {QUEUE: ROUTING_KEYS})
+        workers = options["workers"] or settings.CONSUMER_WORKERS
+        if workers > 1:
+            consumer = PartitionedConsumer(mq_config=mq_config, workers=workers, batch_size=options["batch_size"])
+        else:
+            consumer = SfmUiConsumer(mq_config=mq_config, batch_size=options["batch_size"])
         consumer.run()
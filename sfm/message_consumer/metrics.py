@@ -0,0 +1,169 @@
+import logging
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, connections, DEFAULT_DB_ALIAS
+from django.db.backends.utils import CursorWrapper
+from django.utils import timezone
+import iso8601
+
+log = logging.getLogger(__name__)
+
+
+class ConsumerMetrics:
+    """
+    Collects timings, database query counts and queue-to-commit lag for the
+    message consumer and periodically logs a summary.
+
+    Queries are counted by wrapping the database connection's cursors while
+    measuring, rather than by logging them, so that the query strings and
+    timings are not recorded.
+    """
+    def __init__(self, interval=None):
+        self.interval = interval if interval is not None else settings.CONSUMER_METRICS_INTERVAL
+        # Map of name to _Stat
+        self.stats = {}
+        # Map of routing key to _Stat of lag
+        self.lags = {}
+        self.started = time.time()
+        # Number of measure() blocks that are running
+        self._depth = 0
+        # Number of queries executed while measuring
+        self.query_count = 0
+
+    @property
+    def enabled(self):
+        return bool(self.interval)
+
+    @contextmanager
+    def measure(self, name):
+        """
+        Records the duration and number of queries of the enclosed block under name.
+
+        Blocks may be nested. The connection's cursors are wrapped only while the outermost block runs.
+        """
+        if not self.enabled:
+            yield
+            return
+        is_outermost = self._depth == 0
+        if is_outermost:
+            connection.cursor = self._counting_cursor_factory(connection.cursor)
+        self._depth += 1
+        query_count = self.query_count
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.stats.setdefault(name, _Stat()).add(time.time() - start, self.query_count - query_count)
+            self._depth -= 1
+            if is_outermost:
+                # Back to the DatabaseWrapper's method.
+                del connection.cursor
+
+    def _counting_cursor_factory(self, cursor_factory):
+        db = connections[DEFAULT_DB_ALIAS]
+
+        def cursor():
+            return _CountingCursorWrapper(cursor_factory(), db, self)
+        return cursor
+
+    def record_lag(self, routing_key, message, now=None):
+        """
+        Records the time from when the message was produced, based on its date fields, until now.
+        """
+        if not self.enabled:
+            return
+        date_str = message_date(routing_key, message)
+        if not date_str:
+            return
+        if now is None:
+            now = timezone.now()
+        lag = (now - iso8601.parse_date(date_str)).total_seconds()
+        self.lags.setdefault(_routing_key_name(routing_key), _Stat()).add(lag)
+
+    def summary(self):
+        """
+        Returns a map of name to summary of the stats collected since the last reset.
+        """
+        elapsed = max(time.time() - self.started, 0.001)
+        summary = {}
+        for name, stat in self.stats.items():
+            summary[name] = {
+                "count": stat.count,
+                "per_second": stat.count / elapsed,
+                "mean_ms": stat.total / stat.count * 1000,
+                "max_ms": stat.max * 1000,
+                "queries_per_message": float(stat.queries) / stat.count
+            }
+        for name, stat in self.lags.items():
+            summary.setdefault(name, {}).update({
+                "lag_mean_s": stat.total / stat.count,
+                "lag_max_s": stat.max
+            })
+        return summary
+
+    def reset(self):
+        self.stats = {}
+        self.lags = {}
+        self.started = time.time()
+
+    def log_summary(self, force=False):
+        """
+        Logs a summary of the stats and resets them if the interval has elapsed.
+        """
+        if not self.enabled or (not force and time.time() - self.started < self.interval):
+            return
+        for name, stat_summary in sorted(self.summary().items()):
+            log.info("Consumer metrics for %s: %s", name,
+                     ", ".join("{}={:.3f}".format(key, value) for key, value in sorted(stat_summary.items())))
+        self.reset()
+
+
+class _CountingCursorWrapper(CursorWrapper):
+    """
+    Counts the queries executed with a cursor in the metrics' query_count.
+    """
+    def __init__(self, cursor, db, metrics):
+        CursorWrapper.__init__(self, cursor, db)
+        self.metrics = metrics
+
+    def execute(self, sql, params=None):
+        self.metrics.query_count += 1
+        return CursorWrapper.execute(self, sql, params)
+
+    def executemany(self, sql, param_list):
+        self.metrics.query_count += 1
+        return CursorWrapper.executemany(self, sql, param_list)
+
+
+class _Stat:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.queries = 0
+
+    def add(self, value, queries=0):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.queries += queries
+
+
+def message_date(routing_key, message):
+    """
+    Returns the date (ISO8601 string) a message was produced based on its date fields or None.
+    """
+    if routing_key == "warc_created":
+        return message.get("warc", {}).get("date_created")
+    elif routing_key.startswith("harvest.status.") or routing_key.startswith("export.status."):
+        return message.get("date_ended")
+    return None
+
+
+def _routing_key_name(routing_key):
+    # harvest.status.twitter.twitter_search -> harvest.status
+    if routing_key.startswith("harvest.status.") or routing_key.startswith("export.status."):
+        return ".".join(routing_key.split(".")[:2])
+    return routing_key
@@ -1,39 +1,302 @@
 import logging
 from sfmutils.consumer import BaseConsumer
 from ui.models import Harvest, Collection, Seed, Warc, Export, HarvestStat
+from ui.mail import queue_mail
+from ui.rabbit import get_transport, ACCEPT_CONTENT
+from message_consumer.dedup import ProcessedMessageIndex, message_fingerprint
+from message_consumer.metrics import ConsumerMetrics
 import json
-from django.core.mail import send_mail
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import reverse
 from django.contrib.sites.models import Site
+from django.db import connection, transaction
+from django.db.models import Case, F, TextField, Value, When
+from django.utils import timezone
 import iso8601
+import sqlite3
 import time
-from smtplib import SMTPException
+from collections import OrderedDict
+from kombu import Connection, Exchange
+from kombu.serialization import prepare_accept_content
 
 log = logging.getLogger(__name__)
 
+# Maximum number of seeds to update in a single statement
+SEED_UPDATE_BATCH_SIZE = 1000
+
 
 class SfmUiConsumer(BaseConsumer):
     """
     Class for the SFM UI Consumer, which subscribes to
     messages from the queue and updates the models as appropriate.
+
+    It is possible for the harvester/exporter to respond before the commit
+    of the Harvest/Export occurs. Messages for a Harvest/Export that is not
+    yet visible are deferred and retried with backoff (see
+    settings.CONSUMER_RETRY_DELAYS). Later messages for the same Harvest/Export
+    are deferred behind them so that they are applied in order. Deferred messages
+    are not acked until they are applied or dropped, so that they are redelivered
+    if the consumer stops. Up to settings.CONSUMER_MAX_DEFERRED messages are
+    prefetched in addition to those being applied.
+
+    If batch_size is greater than 1, up to batch_size messages are prefetched.
+    They are grouped by routing key and each group is applied in a single
+    transaction. Messages are acked only after the commit. Within a batch,
+    harvest status messages that are superseded by a later harvest status
+    message for the same harvest are not applied, and are acked along with the
+    later message (see settings.CONSUMER_COALESCE_HARVEST_STATUS).
+
+    Fingerprints of processed messages are recorded (see settings.CONSUMER_DEDUP_SIZE)
+    so that messages that are redelivered, e.g., after a restart, are skipped.
+
+    Timings, query counts and queue-to-commit lag are periodically logged
+    (see settings.CONSUMER_METRICS_INTERVAL).
     """
+    def __init__(self, mq_config=None, batch_size=None, **kwargs):
+        BaseConsumer.__init__(self, mq_config=mq_config, **kwargs)
+        use_configured_transport(self, mq_config)
+        # Map of target to _DeferredMessages
+        self.deferred = OrderedDict()
+        # Number of times the current message has been retried
+        self.retry_attempts = 0
+        # Whether the current message was deferred or dropped rather than applied
+        self.is_deferred = False
+        # Message object of the current message, to be acked once it is no longer deferred
+        self.message_obj = None
+        self.processed_messages = ProcessedMessageIndex()
+        self.metrics = ConsumerMetrics()
+        # (routing key, message) of messages applied in the current transaction, to record lag after commit.
+        self.uncommitted_messages = []
+        self.batch_size = batch_size or settings.CONSUMER_BATCH_SIZE
+        # List of (routing key, message, message object)
+        self.batch = []
+        # Map of the message object of a harvest status message to the message objects of the superseded
+        # messages that were coalesced into it. They are acked along with it.
+        self.coalesced_message_objs = {}
+        self.batch_started = None
+
+    def get_consumers(self, Consumer, channel):
+        consumers = BaseConsumer.get_consumers(self, Consumer, channel)
+        for consumer in consumers:
+            # JSON or compact encoding. Decoded according to the message's content type.
+            consumer.accept = prepare_accept_content(ACCEPT_CONTENT)
+            # Deferred messages are held unacked.
+            consumer.qos(prefetch_count=self.batch_size + settings.CONSUMER_MAX_DEFERRED, apply_global=False)
+        return consumers
+
+    def _callback(self, message, message_obj):
+        if self.batch_size <= 1:
+            routing_key = message_obj.delivery_info["routing_key"]
+            try:
+                self._apply_message(routing_key, message, message_obj)
+            except Exception:
+                log.exception("Error applying %s message: %s", routing_key, json.dumps(message, indent=4))
+            self._ack(message_obj)
+            return
+
+        if not self.batch:
+            self.batch_started = time.time()
+        self.batch.append((message_obj.delivery_info["routing_key"], message, message_obj))
+        if len(self.batch) >= self.batch_size:
+            self.process_batch()
+
+    def on_iteration(self):
+        # Invoked by the ConsumerMixin on each pass through the consume loop.
+        if self.batch and time.time() - self.batch_started >= settings.CONSUMER_BATCH_WAIT:
+            self.process_batch()
+        self.retry_deferred_messages()
+        self.metrics.log_summary()
+
+    def process_batch(self):
+        """
+        Applies the batched messages, one transaction per routing key, and then acks them.
+
+        If a group fails, its messages are applied individually so that a bad message
+        does not prevent the rest of the group from being applied.
+        """
+        batch, self.batch = self.batch, []
+        log.debug("Processing batch of %s messages", len(batch))
+        if settings.CONSUMER_COALESCE_HARVEST_STATUS:
+            batch = self._coalesce_harvest_status_messages(batch)
+        groups = OrderedDict()
+        for routing_key, message, message_obj in batch:
+            groups.setdefault(routing_key, []).append((message, message_obj))
+
+        for routing_key, group in groups.items():
+            deferred = OrderedDict((target, deferred_messages.copy())
+                                   for target, deferred_messages in self.deferred.items())
+            self.processed_messages.mark()
+            self.uncommitted_messages = []
+            try:
+                with self.metrics.measure("batch"):
+                    with transaction.atomic():
+                        for message, message_obj in group:
+                            self._apply_message(routing_key, message, message_obj)
+                self._record_committed()
+            except Exception:
+                log.exception("Error applying batch of %s %s messages. Applying individually.", len(group),
+                              routing_key)
+                self.deferred = deferred
+                self.processed_messages.rollback()
+                for message, message_obj in group:
+                    self.processed_messages.mark()
+                    self.uncommitted_messages = []
+                    try:
+                        with transaction.atomic():
+                            self._apply_message(routing_key, message, message_obj)
+                        self._record_committed()
+                    except Exception:
+                        log.exception("Error applying %s message: %s", routing_key, json.dumps(message, indent=4))
+                        self.processed_messages.rollback()
+            for _, message_obj in group:
+                self._ack(message_obj)
+
+    def _coalesce_harvest_status_messages(self, batch):
+        """
+        Drops harvest status messages that are superseded by a later harvest status
+        message for the same harvest in the batch. The dropped messages are acked when
+        the message that they are merged into is acked, i.e., once it is committed.
+
+        Status messages are cumulative for a harvest, except that token updates and uids
+        of the dropped messages are merged into the next message that is kept.
+        Terminal (success or failure) status messages are never dropped.
+        :return: the remaining batch
+        """
+        last_indexes = {}
+        for i, (routing_key, message, _) in enumerate(batch):
+            if routing_key.startswith("harvest.status."):
+                last_indexes[message.get("id")] = i
+
+        coalesced_batch = []
+        # Map of harvest id to (token updates, uids, message objects) from dropped messages
+        dropped_updates = {}
+        for i, (routing_key, message, message_obj) in enumerate(batch):
+            if routing_key.startswith("harvest.status."):
+                harvest_id = message.get("id")
+                if i < last_indexes[harvest_id] and message.get("status") not in (Harvest.SUCCESS, Harvest.FAILURE):
+                    log.debug("Dropping harvest status message for %s superseded by a later message", harvest_id)
+                    token_updates, uids, dropped_message_objs = dropped_updates.setdefault(harvest_id, ({}, {}, []))
+                    token_updates.update(message.get("token_updates") or {})
+                    uids.update(message.get("uids") or {})
+                    dropped_message_objs.append(message_obj)
+                    continue
+                if harvest_id in dropped_updates:
+                    token_updates, uids, dropped_message_objs = dropped_updates.pop(harvest_id)
+                    self.coalesced_message_objs[message_obj] = dropped_message_objs
+                    token_updates.update(message.get("token_updates") or {})
+                    uids.update(message.get("uids") or {})
+                    message = dict(message)
+                    if token_updates:
+                        message["token_updates"] = token_updates
+                    if uids:
+                        message["uids"] = uids
+            coalesced_batch.append((routing_key, message, message_obj))
+        return coalesced_batch
+
+    def _record_committed(self):
+        for routing_key, message in self.uncommitted_messages:
+            self.metrics.record_lag(routing_key, message)
+        self.uncommitted_messages = []
+
+    def _apply_message(self, routing_key, message, message_obj=None):
+        self.routing_key = routing_key
+        self.message = message
+        self.message_obj = message_obj
+        self.on_message()
+
+    def _ack(self, message_obj):
+        """
+        Acks the message object, unless its message is deferred, along with the message
+        objects of the messages that were coalesced into it.
+        """
+        if message_obj is None:
+            return
+        for deferred_messages in self.deferred.values():
+            for _, _, deferred_message_obj in deferred_messages.messages:
+                if deferred_message_obj is message_obj:
+                    return
+        message_obj.ack()
+        for coalesced_message_obj in self.coalesced_message_objs.pop(message_obj, ()):
+            coalesced_message_obj.ack()
+
     def on_message(self):
-        # This is the worst ever, but it avoids a race condition.
-        # It is possible for the harvester/exporter to respond before the commit occurs.
-        time.sleep(1)
+        with self.metrics.measure("on_message"):
+            self._on_message()
+
+    def _on_message(self):
+        target = message_target(self.routing_key, self.message)
+        if target in self.deferred:
+            log.debug("Deferring message for %s behind earlier deferred messages", target)
+            self.deferred[target].messages.append((self.routing_key, self.message, self.message_obj))
+            return
+
+        fingerprint = message_fingerprint(self.routing_key, self.message)
+        if fingerprint in self.processed_messages:
+            log.debug("Skipping already processed %s message for %s", self.routing_key, target)
+            return
 
         if self.routing_key.startswith("harvest.status."):
-            self._on_harvest_status_message()
+            handler_name = "_on_harvest_status_message"
         elif self.routing_key == "warc_created":
-            self._on_warc_created_message()
+            handler_name = "_on_warc_created_message"
         elif self.routing_key.startswith("export.status."):
-            self._on_export_status_message()
+            handler_name = "_on_export_status_message"
         elif self.routing_key == "harvest.start.web":
-            self._on_web_harvest_start_message()
+            handler_name = "_on_web_harvest_start_message"
         else:
             log.warn("Unexpected message with routing key %s: %s", self.routing_key, json.dumps(self.message, indent=4))
+            return
+
+        self.is_deferred = False
+        with self.metrics.measure(handler_name):
+            getattr(self, handler_name)()
+
+        if not self.is_deferred:
+            self.processed_messages.add(fingerprint)
+            if transaction.get_connection().in_atomic_block:
+                self.uncommitted_messages.append((self.routing_key, self.message))
+            else:
+                self.metrics.record_lag(self.routing_key, self.message)
+
+    def _defer(self, not_found_log_msg):
+        """
+        Defers the current message to be retried after a delay.
+
+        Once the retries are exhausted, not_found_log_msg is logged with the message
+        and the message is dropped.
+        """
+        self.is_deferred = True
+        if self.retry_attempts >= len(settings.CONSUMER_RETRY_DELAYS):
+            log.error(not_found_log_msg, json.dumps(self.message, indent=4))
+            return
+
+        target = message_target(self.routing_key, self.message)
+        delay = settings.CONSUMER_RETRY_DELAYS[self.retry_attempts]
+        log.debug("%s not found. Retrying in %s seconds.", target, delay)
+        deferred_messages = _DeferredMessages(time.time() + delay, self.retry_attempts + 1)
+        deferred_messages.messages.append((self.routing_key, self.message, self.message_obj))
+        self.deferred[target] = deferred_messages
+
+    def retry_deferred_messages(self, now=None):
+        """
+        Retries the deferred messages that are due.
+        """
+        if not self.deferred:
+            return
+        if now is None:
+            now = time.time()
+        due_targets = [target for target, deferred_messages in self.deferred.items() if deferred_messages.due <= now]
+        for target in due_targets:
+            deferred_messages = self.deferred.pop(target)
+            for routing_key, message, message_obj in deferred_messages.messages:
+                self.retry_attempts = deferred_messages.attempts
+                try:
+                    self._apply_message(routing_key, message, message_obj)
+                finally:
+                    self.retry_attempts = 0
+                # Acked unless deferred again
+                self._ack(message_obj)
 
     def _on_harvest_status_message(self):
         try:
@@ -42,8 +305,7 @@ class SfmUiConsumer(BaseConsumer):
             harvest = Harvest.objects.get(harvest_id=self.message["id"])
 
         except ObjectDoesNotExist:
-            log.error("Harvest model object not found for harvest status message: %s",
-                      json.dumps(self.message, indent=4))
+            self._defer("Harvest model object not found for harvest status message: %s")
             return
 
         # And update harvest model object
@@ -60,45 +322,12 @@ class SfmUiConsumer(BaseConsumer):
             harvest.date_ended = iso8601.parse_date(self.message["date_ended"])
         harvest.save()
 
-        # Update seeds based on tokens that have changed
-        for seed_id, token in self.message.get("token_updates", {}).items():
-            # Handle case when token comes back None
-            if token:
-                # Try to find seed based on collection and uid.
-                try:
-                    seed = Seed.objects.get(seed_id=seed_id)
-                    seed.token = token
-                    seed.history_note = "Changed token based on information from harvester from harvest {}".format(
-                            self.message["id"])
-                    seed.save()
-                except ObjectDoesNotExist:
-                    log.error("Seed model object with seed_id %s not found to update token to %s", seed_id, token)
-
-        # Update seeds based on uids that have been returned
-        for seed_id, uid in self.message.get("uids", {}).items():
-            # Try to find seed based on collection and token.
-            try:
-                seed = Seed.objects.get(seed_id=seed_id)
-                seed.uid = uid
-                seed.history_note = "Changed uid based on information from harvester from harvest {}".format(
-                        self.message["id"])
-                seed.save()
-            except ObjectDoesNotExist:
-                log.error("Seed model object with seed_id %s not found to update uid to %s", seed_id, uid)
+        # Update seeds based on tokens that have changed and uids that have been returned
+        update_seeds(self.message["id"], self.message.get("token_updates") or {}, self.message.get("uids") or {})
 
         # Update stats
         if self.message["status"] != Harvest.FAILURE:
-            day_stats = self.message.get("stats", {})
-
-            for day_str, stat in day_stats.items():
-                day = iso8601.parse_date(day_str).date()
-                for item, count in stat.items():
-                    try:
-                        stat = harvest.harvest_stats.get(item=item, harvest_date=day)
-                        stat.count = count
-                        stat.save()
-                    except ObjectDoesNotExist:
-                        HarvestStat.objects.create(item=item, harvest=harvest, count=count, harvest_date=day)
+            upsert_harvest_stats(harvest, self.message.get("stats", {}))
 
         # Send email if completed and failed or has messages
         if harvest.status == Harvest.FAILURE or (
@@ -131,12 +360,7 @@ class SfmUiConsumer(BaseConsumer):
                     mail_message += self.format_messages_for_mail(harvest.warnings, "warning")
                     mail_message += self.format_messages_for_mail(harvest.errors, "error")
 
-                    try:
-                        log.debug("Sending email to %s: %s", receiver_emails, mail_subject)
-                        send_mail(mail_subject, mail_message, settings.EMAIL_HOST_USER,
-                                  receiver_emails, fail_silently=False)
-                    except SMTPException, ex:
-                        log.error("Error sending email: %s", ex)
+                    queue_mail(mail_subject, mail_message, receiver_emails)
             else:
                 log.warn("No email addresses for %s", harvest.collection.collection_set.group)
 
@@ -164,8 +388,7 @@ class SfmUiConsumer(BaseConsumer):
             warc.save()
 
         except ObjectDoesNotExist:
-            log.error("Harvest model object not found for harvest status message: %s",
-                      json.dumps(self.message, indent=4))
+            self._defer("Harvest model object not found for warc created message: %s")
 
     def _on_export_status_message(self):
         try:
@@ -205,18 +428,12 @@ class SfmUiConsumer(BaseConsumer):
                     else:
                         log.debug("Unhandled export status: %s", export.status)
                     if mail_message:
-                        try:
-                            log.debug("Sending email to %s: %s", receiver_email, mail_subject)
-                            send_mail(mail_subject, mail_message, settings.EMAIL_HOST_USER,
-                                      [receiver_email], fail_silently=False)
-                        except SMTPException, ex:
-                            log.error("Error sending email: %s", ex)
+                        queue_mail(mail_subject, mail_message, [receiver_email])
             else:
                 log.warn("No email address for %s", export.user)
 
         except ObjectDoesNotExist:
-            log.error("Export model object not found for export status message: %s",
-                      json.dumps(self.message, indent=4))
+            self._defer("Export model object not found for export status message: %s")
 
     def _on_web_harvest_start_message(self):
         try:
@@ -228,5 +445,171 @@ class SfmUiConsumer(BaseConsumer):
                                              collection=parent_harvest.collection)
             harvest.save()
         except ObjectDoesNotExist:
-            log.error("Harvest model object not found for web harvest status message: %s",
-                      json.dumps(self.message, indent=4))
+            self._defer("Harvest model object not found for web harvest start message: %s")
+
+
+def use_configured_transport(consumer, mq_config):
+    """
+    Connects the consumer with the transport set by settings.RABBITMQ_TRANSPORT.
+
+    BaseConsumer always connects to RabbitMQ with librabbitmq.
+    """
+    if mq_config is None or settings.RABBITMQ_TRANSPORT == "librabbitmq":
+        return
+    consumer.connection = Connection(transport=get_transport(),
+                                     hostname=mq_config.host,
+                                     userid=mq_config.username,
+                                     password=mq_config.password)
+    consumer.exchange = Exchange(name=mq_config.exchange, type="topic", durable=True)
+
+
+def message_target(routing_key, message):
+    """
+    Returns the (model name, id) of the Harvest/Export that a message applies to.
+    """
+    if routing_key.startswith("harvest.status."):
+        return "harvest", message.get("id")
+    elif routing_key == "warc_created":
+        return "harvest", message.get("harvest", {}).get("id")
+    elif routing_key.startswith("export.status."):
+        return "export", message.get("id")
+    elif routing_key == "harvest.start.web":
+        return "harvest", message.get("parent_id")
+    return None
+
+
+def upsert_harvest_stats(harvest, day_stats):
+    """
+    Inserts or updates the HarvestStats for a harvest in a single statement,
+    keyed on the (harvest, harvest_date, item) unique constraint.
+
+    The statement requires INSERT ... ON CONFLICT (PostgreSQL >= 9.5, SQLite >= 3.24).
+    On older databases, each HarvestStat is updated, or created if it does not exist, instead.
+    :param harvest: the harvest
+    :param day_stats: map of day (ISO8601 string) to map of item to count
+    """
+    rows = []
+    for day_str, stat in day_stats.items():
+        day = iso8601.parse_date(day_str).date()
+        for item, count in stat.items():
+            rows.append((harvest.id, day, item, count))
+    if not rows:
+        return
+
+    if not _supports_upsert():
+        with transaction.atomic():
+            for harvest_id, day, item, count in rows:
+                updated_count = HarvestStat.objects.filter(harvest_id=harvest_id, harvest_date=day,
+                                                           item=item).update(count=count)
+                if not updated_count:
+                    HarvestStat.objects.create(harvest_id=harvest_id, harvest_date=day, item=item, count=count)
+        return
+
+    qn = connection.ops.quote_name
+    columns = [HarvestStat._meta.get_field(name).column for name in ("harvest", "harvest_date", "item", "count")]
+    # Only SQLite limits the number of parameters in a statement.
+    batch_size = connection.ops.bulk_batch_size(columns, rows)
+    with connection.cursor() as cursor:
+        for i in range(0, len(rows), batch_size):
+            batch_rows = rows[i:i + batch_size]
+            sql = "INSERT INTO {table} ({columns}) VALUES {values} " \
+                  "ON CONFLICT ({key_columns}) DO UPDATE SET {count_column} = excluded.{count_column}".format(
+                    table=qn(HarvestStat._meta.db_table),
+                    columns=", ".join(qn(column) for column in columns),
+                    values=", ".join(["(%s, %s, %s, %s)"] * len(batch_rows)),
+                    key_columns=", ".join(qn(column) for column in columns[:3]),
+                    count_column=qn(columns[3]))
+            cursor.execute(sql, [value for row in batch_rows for value in row])
+
+
+def _supports_upsert():
+    """
+    Returns True if the database supports INSERT ... ON CONFLICT.
+    """
+    if connection.vendor == "postgresql":
+        return connection.pg_version >= 90500
+    if connection.vendor == "sqlite":
+        return sqlite3.sqlite_version_info >= (3, 24, 0)
+    return False
+
+
+def update_seeds(harvest_id, token_updates, uids):
+    """
+    Updates the tokens and uids of seeds based on information from the harvester.
+
+    The seeds are loaded in a single query and only the changed seeds are written,
+    with their historical records created in bulk.
+    :param harvest_id: the harvest id, for the history note
+    :param token_updates: map of seed id to token. None tokens are ignored.
+    :param uids: map of seed id to uid
+    """
+    token_updates = dict((seed_id, token) for seed_id, token in token_updates.items() if token)
+    seed_ids = set(token_updates.keys()) | set(uids.keys())
+    if not seed_ids:
+        return
+
+    seeds = dict((seed.seed_id, seed) for seed in Seed.objects.filter(seed_id__in=seed_ids))
+    for seed_id, token in token_updates.items():
+        if seed_id not in seeds:
+            log.error("Seed model object with seed_id %s not found to update token to %s", seed_id, token)
+    for seed_id, uid in uids.items():
+        if seed_id not in seeds:
+            log.error("Seed model object with seed_id %s not found to update uid to %s", seed_id, uid)
+
+    now = timezone.now()
+    changed_seeds = []
+    for seed in seeds.values():
+        is_changed = False
+        if seed.seed_id in token_updates and seed.token != token_updates[seed.seed_id]:
+            seed.token = token_updates[seed.seed_id]
+            seed.history_note = "Changed token based on information from harvester from harvest {}".format(
+                harvest_id)
+            is_changed = True
+        if seed.seed_id in uids and seed.uid != uids[seed.seed_id]:
+            seed.uid = uids[seed.seed_id]
+            seed.history_note = "Changed uid based on information from harvester from harvest {}".format(
+                harvest_id)
+            is_changed = True
+        if is_changed:
+            seed.date_updated = now
+            changed_seeds.append(seed)
+    if not changed_seeds:
+        return
+
+    log.debug("Updating %s seeds from harvest %s", len(changed_seeds), harvest_id)
+    # Each seed is a parameter in the IN clause and a pk, value pair for each updated field.
+    batch_size = min(SEED_UPDATE_BATCH_SIZE, connection.ops.bulk_batch_size(["pk"] * 7, changed_seeds))
+    for i in range(0, len(changed_seeds), batch_size):
+        batch_seeds = changed_seeds[i:i + batch_size]
+        Seed.objects.filter(pk__in=[seed.pk for seed in batch_seeds]).update(
+            token=_case_by_pk(batch_seeds, "token"),
+            uid=_case_by_pk(batch_seeds, "uid"),
+            history_note=_case_by_pk(batch_seeds, "history_note"),
+            date_updated=now)
+
+    historical_seed_model = Seed.history.model
+    historical_seeds = []
+    for seed in changed_seeds:
+        attrs = dict((field.attname, getattr(seed, field.attname)) for field in Seed._meta.fields)
+        historical_seeds.append(historical_seed_model(history_date=now, history_type="~", history_user=None, **attrs))
+    historical_seed_model.objects.bulk_create(historical_seeds)
+
+
+def _case_by_pk(objs, field_name):
+    return Case(*[When(pk=obj.pk, then=Value(getattr(obj, field_name))) for obj in objs],
+                default=F(field_name), output_field=TextField())
+
+
+class _DeferredMessages:
+    """
+    Messages for a single Harvest/Export that are waiting to be retried.
+    """
+    def __init__(self, due, attempts):
+        self.due = due
+        self.attempts = attempts
+        self.messages = []
+
+    def copy(self):
+        deferred_messages = _DeferredMessages(self.due, self.attempts)
+        deferred_messages.messages = list(self.messages)
+        return deferred_messages
@@ -0,0 +1,18 @@
+from django.test import TestCase
+from ui.models import Harvest, Warc
+from benchmark import run_benchmark
+
+
+class BenchmarkTest(TestCase):
+    def test_run_benchmark(self):
+        results = run_benchmark(message_count=50, harvest_count=3, seed_count=5, stat_days=2, stat_items=2,
+                                seed_updates=2, random_seed=1)
+        self.assertEqual(50, results["messages"])
+        self.assertEqual(50, results["acked"])
+        self.assertTrue(results["queries_per_message"] > 0)
+        self.assertTrue(Warc.objects.exists())
+        self.assertTrue(Harvest.objects.filter(status=Harvest.RUNNING).exists())
+
+    def test_run_benchmark_batch(self):
+        results = run_benchmark(message_count=50, harvest_count=3, seed_count=5, batch_size=10, random_seed=1)
+        self.assertEqual(50, results["acked"])
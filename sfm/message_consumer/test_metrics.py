@@ -0,0 +1,72 @@
+from django.db import connection, connections, DEFAULT_DB_ALIAS
+from django.test import TestCase
+from django.utils import timezone
+from ui.models import Group
+from metrics import ConsumerMetrics
+import iso8601
+
+
+class ConsumerMetricsTest(TestCase):
+    def setUp(self):
+        self.metrics = ConsumerMetrics(interval=60)
+
+    def test_measure(self):
+        with self.metrics.measure("_on_harvest_status_message"):
+            Group.objects.create(name="test_group")
+            Group.objects.count()
+        with self.metrics.measure("_on_harvest_status_message"):
+            pass
+
+        summary = self.metrics.summary()["_on_harvest_status_message"]
+        self.assertEqual(2, summary["count"])
+        self.assertEqual(1.0, summary["queries_per_message"])
+        self.assertTrue(summary["max_ms"] >= summary["mean_ms"])
+
+    def test_measure_nested(self):
+        with self.metrics.measure("on_message"):
+            Group.objects.create(name="test_group")
+            with self.metrics.measure("_on_harvest_status_message"):
+                Group.objects.count()
+            Group.objects.count()
+            # Queries are not logged.
+            self.assertFalse(connection.queries_logged)
+
+        summary = self.metrics.summary()
+        self.assertEqual(3.0, summary["on_message"]["queries_per_message"])
+        self.assertEqual(1.0, summary["_on_harvest_status_message"]["queries_per_message"])
+        # Cursors are no longer wrapped.
+        self.assertNotIn("cursor", vars(connections[DEFAULT_DB_ALIAS]))
+        Group.objects.count()
+        self.assertEqual(3, self.metrics.query_count)
+
+    def test_record_lag(self):
+        now = iso8601.parse_date("2015-07-28T11:17:52.539470")
+        self.metrics.record_lag("harvest.status.test.test_search", {"id": "test:1",
+                                                                     "date_ended": "2015-07-28T11:17:42.539470"},
+                                now=now)
+        self.metrics.record_lag("harvest.status.test.test_filter", {"id": "test:1",
+                                                                     "date_ended": "2015-07-28T11:17:32.539470"},
+                                now=now)
+        # Running harvest status has no date_ended
+        self.metrics.record_lag("harvest.status.test.test_filter", {"id": "test:1"}, now=now)
+
+        summary = self.metrics.summary()["harvest.status"]
+        self.assertEqual(15.0, summary["lag_mean_s"])
+        self.assertEqual(20.0, summary["lag_max_s"])
+
+    def test_log_summary(self):
+        with self.metrics.measure("on_message"):
+            pass
+        # Interval not elapsed
+        self.metrics.log_summary()
+        self.assertTrue(self.metrics.stats)
+
+        self.metrics.log_summary(force=True)
+        self.assertFalse(self.metrics.stats)
+
+    def test_disabled(self):
+        metrics = ConsumerMetrics(interval=0)
+        with metrics.measure("on_message"):
+            pass
+        metrics.record_lag("warc_created", {"warc": {"date_created": timezone.now().isoformat()}})
+        self.assertFalse(metrics.summary())
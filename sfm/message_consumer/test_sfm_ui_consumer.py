@@ -1,8 +1,11 @@
-from django.test import TestCase
-from ui.models import Harvest, Collection, Group, CollectionSet, Credential, User, Seed, Warc, Export, HarvestStat
+from django.test import TestCase, override_settings
+from ui.models import Harvest, Collection, Group, CollectionSet, Credential, User, Seed, Warc, Export, HarvestStat, \
+    OutboxEmail, ProcessedMessage
 import json
-from sfm_ui_consumer import SfmUiConsumer
+from sfm_ui_consumer import SfmUiConsumer, upsert_harvest_stats, update_seeds
 import iso8601
+import time
+from mock import MagicMock, patch
 
 from datetime import date
 
@@ -133,6 +136,87 @@ class ConsumerTest(TestCase):
         self.assertListEqual([{"code": "test_code_2", "message": "be careful"}], harvest.warnings)
         self.assertListEqual([{"code": "test_code_3", "message": "oops"}], harvest.errors)
 
+    def test_upsert_harvest_stats(self):
+        HarvestStat.objects.create(harvest=self.harvest, item="photos", count=3, harvest_date=date(2016, 5, 20))
+
+        day_stats = {
+            "2016-05-20": {
+                "photos": 12,
+                "users": 2
+            },
+            "2016-05-21": {
+                "photos": 19,
+            },
+        }
+        # A single statement
+        with self.assertNumQueries(1):
+            upsert_harvest_stats(self.harvest, day_stats)
+
+        self.assertEqual(3, self.harvest.harvest_stats.count())
+        self.assertEqual(12, self.harvest.harvest_stats.get(item="photos", harvest_date=date(2016, 5, 20)).count)
+        self.assertEqual(2, self.harvest.harvest_stats.get(item="users", harvest_date=date(2016, 5, 20)).count)
+        self.assertEqual(19, self.harvest.harvest_stats.get(item="photos", harvest_date=date(2016, 5, 21)).count)
+        # Stats of other harvest unchanged
+        self.assertEqual(3, HarvestStat.objects.get(harvest__harvest_id="test:2").count)
+
+    @patch("message_consumer.sfm_ui_consumer._supports_upsert", return_value=False)
+    def test_upsert_harvest_stats_without_upsert(self, mock_supports_upsert):
+        HarvestStat.objects.create(harvest=self.harvest, item="photos", count=3, harvest_date=date(2016, 5, 20))
+
+        upsert_harvest_stats(self.harvest, {"2016-05-20": {"photos": 12, "users": 2}})
+        mock_supports_upsert.assert_called_once_with()
+
+        self.assertEqual(2, self.harvest.harvest_stats.count())
+        self.assertEqual(12, self.harvest.harvest_stats.get(item="photos", harvest_date=date(2016, 5, 20)).count)
+        self.assertEqual(2, self.harvest.harvest_stats.get(item="users", harvest_date=date(2016, 5, 20)).count)
+
+    def test_update_seeds(self):
+        Seed.objects.create(collection=self.harvest.collection, token="test_token3", uid="test_uid3", seed_id='3')
+
+        # Select, update, insert historical seeds.
+        with self.assertNumQueries(3):
+            update_seeds("test:1", {"1": "j.littman", "2": None, "3": "test_token3", "4": "missing"},
+                         {"2": "671366249@N03", "3": "test_uid3"})
+
+        seed1 = Seed.objects.get(seed_id="1")
+        self.assertEqual("j.littman", seed1.token)
+        self.assertEqual("131866249@N02", seed1.uid)
+        self.assertTrue(seed1.history_note.startswith("Changed token"))
+        self.assertEqual(2, seed1.history.count())
+        historical_seed1 = seed1.history.all()[0]
+        self.assertEqual("j.littman", historical_seed1.token)
+        self.assertEqual(seed1.date_updated, historical_seed1.date_updated)
+        self.assertEqual(seed1.history_note, historical_seed1.history_note)
+
+        seed2 = Seed.objects.get(seed_id="2")
+        self.assertEqual("library_of_congress", seed2.token)
+        self.assertEqual("671366249@N03", seed2.uid)
+        self.assertTrue(seed2.history_note.startswith("Changed uid"))
+        self.assertEqual(2, seed2.history.count())
+
+        # Unchanged
+        seed3 = Seed.objects.get(seed_id="3")
+        self.assertEqual(1, seed3.history.count())
+        self.assertEqual("", seed3.history_note)
+
+    @override_settings(PERFORM_EMAILS=True)
+    def test_harvest_status_on_message_queues_email(self):
+        self.consumer.routing_key = "harvest.status.test.test_search"
+        self.consumer.message = {
+            "id": "test:1",
+            "status": Harvest.FAILURE,
+            "date_started": "2015-07-28T11:17:36.640044",
+            "date_ended": "2015-07-28T11:17:42.539470",
+            "errors": [{"code": "test_code_3", "message": "oops"}]
+        }
+        self.consumer.on_message()
+
+        email = OutboxEmail.objects.get()
+        self.assertEqual("SFM Harvest for test_collection failed", email.subject)
+        self.assertTrue("- oops" in email.message)
+        self.assertListEqual(["test_user@test.com"], email.recipients)
+        self.assertEqual(OutboxEmail.QUEUED, email.status)
+
     def test_on_message_ignores_bad_routing_key(self):
         self.consumer.routing_key = "xharvest.status.test.test_search"
 
@@ -147,6 +231,53 @@ class ConsumerTest(TestCase):
         # Trigger on_message and nothing happens
         self.consumer.on_message()
 
+    def test_on_message_defers_unknown_harvest(self):
+        self.consumer.routing_key = "harvest.status.test.test_search"
+        self.consumer.message = {
+            "id": "test:3",
+            "status": Harvest.RUNNING,
+            "date_started": "2015-07-28T11:17:36.640044"
+        }
+        self.consumer.on_message()
+        self.assertEqual(1, len(self.consumer.deferred))
+
+        # A later message for the same harvest is deferred behind it.
+        self.consumer.message = {
+            "id": "test:3",
+            "status": Harvest.SUCCESS,
+            "date_started": "2015-07-28T11:17:36.640044",
+            "date_ended": "2015-07-28T11:17:42.539470"
+        }
+        self.consumer.on_message()
+        self.assertEqual(2, len(self.consumer.deferred[("harvest", "test:3")].messages))
+
+        # Not yet due
+        self.consumer.retry_deferred_messages()
+        self.assertEqual(1, len(self.consumer.deferred))
+
+        # Now the harvest is committed
+        Harvest.objects.create(harvest_id="test:3", collection=self.harvest.collection)
+        self.consumer.retry_deferred_messages(now=time.time() + 60)
+        self.assertFalse(self.consumer.deferred)
+        harvest = Harvest.objects.get(harvest_id="test:3")
+        self.assertEqual(Harvest.SUCCESS, harvest.status)
+        self.assertEqual(iso8601.parse_date("2015-07-28T11:17:42.539470"), harvest.date_ended)
+
+    @override_settings(CONSUMER_RETRY_DELAYS=(0,))
+    def test_on_message_drops_after_retries(self):
+        self.consumer.routing_key = "export.status.test"
+        self.consumer.message = {
+            "id": "xtest:2",
+            "status": "completed success",
+            "date_started": "2015-07-28T11:17:36.640044"
+        }
+        self.consumer.on_message()
+        self.assertEqual(1, len(self.consumer.deferred))
+
+        # Retry is exhausted, so message is dropped.
+        self.consumer.retry_deferred_messages()
+        self.assertFalse(self.consumer.deferred)
+
     def test_warc_created_on_message(self):
         self.consumer.routing_key = "warc_created"
         self.consumer.message = {
@@ -177,6 +308,52 @@ class ConsumerTest(TestCase):
         self.assertEqual(iso8601.parse_date("2015-07-28T11:17:36.640178"), warc.date_created)
         self.assertEqual(self.harvest, warc.harvest)
 
+    def test_on_message_skips_processed_message(self):
+        self.consumer.routing_key = "warc_created"
+        self.consumer.message = {
+            "warc": {
+                "path": "/sfm-data/test.warc.gz",
+                "sha1": "7512e1c227c29332172118f0b79b2ca75cbe8979",
+                "bytes": 26146,
+                "id": "test_warc",
+                "date_created": "2015-07-28T11:17:36.640178"
+            },
+            "harvest": {
+                "id": "test:1",
+            }
+        }
+        self.consumer.on_message()
+        self.assertEqual(1, Warc.objects.filter(warc_id="test_warc").count())
+        self.assertEqual(1, ProcessedMessage.objects.count())
+
+        # Redelivered message is skipped without querying.
+        with self.assertNumQueries(0):
+            self.consumer.on_message()
+
+        # Also skipped after a restart.
+        consumer = SfmUiConsumer()
+        consumer.routing_key = self.consumer.routing_key
+        consumer.message = self.consumer.message
+        # Loading fingerprints
+        with self.assertNumQueries(1):
+            consumer.on_message()
+        self.assertEqual(1, Warc.objects.filter(warc_id="test_warc").count())
+
+    def test_on_message_does_not_record_deferred_message(self):
+        self.consumer.routing_key = "harvest.status.test.test_search"
+        self.consumer.message = {
+            "id": "test:3",
+            "status": Harvest.RUNNING,
+            "date_started": "2015-07-28T11:17:36.640044"
+        }
+        self.consumer.on_message()
+        self.assertFalse(ProcessedMessage.objects.exists())
+
+        Harvest.objects.create(harvest_id="test:3", collection=self.harvest.collection)
+        self.consumer.retry_deferred_messages(now=time.time() + 60)
+        self.assertEqual(Harvest.RUNNING, Harvest.objects.get(harvest_id="test:3").status)
+        self.assertEqual(1, ProcessedMessage.objects.count())
+
     def test_export_status_on_message(self):
         self.consumer.routing_key = "export.status.test"
         self.consumer.message = {
@@ -225,3 +402,181 @@ class ConsumerTest(TestCase):
         self.assertEqual("web", harvest.harvest_type)
         self.assertEqual(self.harvest, harvest.parent_harvest)
         self.assertEqual(harvest.status, "requested")
+
+
+class BatchConsumerTest(TestCase):
+    def setUp(self):
+        group = Group.objects.create(name="test_group")
+        user = User.objects.create_superuser(username="test_user", email="test_user@test.com",
+                                             password="test_password")
+        collection_set = CollectionSet.objects.create(group=group, name="test_collection_set")
+        credential = Credential.objects.create(user=user, platform="test_platform",
+                                               token=json.dumps({}))
+        collection = Collection.objects.create(collection_set=collection_set, credential=credential,
+                                               harvest_type="test_type", name="test_collection",
+                                               harvest_options=json.dumps({}))
+        Harvest.objects.create(harvest_id="test:1", collection=collection)
+        Harvest.objects.create(harvest_id="test:2", collection=collection)
+        self.consumer = SfmUiConsumer(batch_size=3)
+
+    @staticmethod
+    def _message_obj(routing_key):
+        message_obj = MagicMock()
+        message_obj.delivery_info = {"routing_key": routing_key}
+        return message_obj
+
+    @staticmethod
+    def _status_message(harvest_id, status):
+        return {
+            "id": harvest_id,
+            "status": status,
+            "date_started": "2015-07-28T11:17:36.640044"
+        }
+
+    def test_batch(self):
+        message_obj1 = self._message_obj("harvest.status.test.test_search")
+        self.consumer._callback(self._status_message("test:1", Harvest.RUNNING), message_obj1)
+        message_obj2 = self._message_obj("warc_created")
+        self.consumer._callback({
+            "warc": {
+                "path": "/sfm-data/test.warc.gz",
+                "sha1": "7512e1c227c29332172118f0b79b2ca75cbe8979",
+                "bytes": 26146,
+                "id": "test_warc",
+                "date_created": "2015-07-28T11:17:36.640178"
+            },
+            "harvest": {
+                "id": "test:1",
+            }
+        }, message_obj2)
+
+        # Not yet processed or acked
+        self.assertEqual(Harvest.REQUESTED, Harvest.objects.get(harvest_id="test:1").status)
+        message_obj1.ack.assert_not_called()
+
+        message_obj3 = self._message_obj("harvest.status.test.test_search")
+        self.consumer._callback(self._status_message("test:2", Harvest.SUCCESS), message_obj3)
+
+        self.assertEqual(Harvest.RUNNING, Harvest.objects.get(harvest_id="test:1").status)
+        self.assertEqual(Harvest.SUCCESS, Harvest.objects.get(harvest_id="test:2").status)
+        self.assertTrue(Warc.objects.filter(warc_id="test_warc").exists())
+        message_obj1.ack.assert_called_once_with()
+        message_obj2.ack.assert_called_once_with()
+        message_obj3.ack.assert_called_once_with()
+        self.assertFalse(self.consumer.batch)
+
+    @override_settings(CONSUMER_BATCH_WAIT=0)
+    def test_partial_batch_on_iteration(self):
+        message_obj = self._message_obj("harvest.status.test.test_search")
+        self.consumer._callback(self._status_message("test:1", Harvest.RUNNING), message_obj)
+        self.consumer.on_iteration()
+
+        self.assertEqual(Harvest.RUNNING, Harvest.objects.get(harvest_id="test:1").status)
+        message_obj.ack.assert_called_once_with()
+
+    @override_settings(CONSUMER_COALESCE_HARVEST_STATUS=False)
+    def test_deferred_message_acked_after_retry(self):
+        message_obj1 = self._message_obj("harvest.status.test.test_search")
+        self.consumer._callback(self._status_message("test:3", Harvest.RUNNING), message_obj1)
+        message_obj2 = self._message_obj("harvest.status.test.test_search")
+        self.consumer._callback(self._status_message("test:3", Harvest.SUCCESS), message_obj2)
+        self.consumer.process_batch()
+
+        # Held unacked, so redelivered if the consumer stops
+        self.assertEqual(2, len(self.consumer.deferred[("harvest", "test:3")].messages))
+        message_obj1.ack.assert_not_called()
+        message_obj2.ack.assert_not_called()
+
+        Harvest.objects.create(harvest_id="test:3", collection=Collection.objects.get())
+        self.consumer.retry_deferred_messages(now=time.time() + 60)
+        self.assertEqual(Harvest.SUCCESS, Harvest.objects.get(harvest_id="test:3").status)
+        message_obj1.ack.assert_called_once_with()
+        message_obj2.ack.assert_called_once_with()
+
+    @override_settings(CONSUMER_RETRY_DELAYS=(0,))
+    def test_dropped_message_acked(self):
+        message_obj = self._message_obj("harvest.status.test.test_search")
+        self.consumer._callback(self._status_message("test:3", Harvest.RUNNING), message_obj)
+        self.consumer.process_batch()
+        message_obj.ack.assert_not_called()
+
+        # Retry is exhausted, so message is dropped and acked.
+        self.consumer.retry_deferred_messages()
+        self.assertFalse(self.consumer.deferred)
+        message_obj.ack.assert_called_once_with()
+
+    def test_batch_with_bad_message(self):
+        message_obj1 = self._message_obj("harvest.status.test.test_search")
+        self.consumer._callback(self._status_message("test:1", Harvest.RUNNING), message_obj1)
+        message_obj2 = self._message_obj("harvest.status.test.test_search")
+        # Missing date_started
+        self.consumer._callback({"id": "test:2", "status": Harvest.SUCCESS}, message_obj2)
+        self.consumer.process_batch()
+
+        # Good message is still applied and both are acked.
+        self.assertEqual(Harvest.RUNNING, Harvest.objects.get(harvest_id="test:1").status)
+        self.assertEqual(Harvest.REQUESTED, Harvest.objects.get(harvest_id="test:2").status)
+        message_obj1.ack.assert_called_once_with()
+        message_obj2.ack.assert_called_once_with()
+
+    def test_coalesce_harvest_status(self):
+        seed = Seed.objects.create(collection=Harvest.objects.get(harvest_id="test:1").collection, seed_id="1",
+                                   token="test_token")
+        running_message1 = self._status_message("test:1", Harvest.RUNNING)
+        running_message1["token_updates"] = {"1": "new_token"}
+        running_message1["warcs"] = {"count": 1, "bytes": 10}
+        running_message2 = self._status_message("test:1", Harvest.RUNNING)
+        running_message2["warcs"] = {"count": 2, "bytes": 20}
+        running_message3 = self._status_message("test:2", Harvest.RUNNING)
+        message_objs = [self._message_obj("harvest.status.test.test_filter") for _ in range(3)]
+
+        with patch.object(self.consumer, "_on_harvest_status_message",
+                          wraps=self.consumer._on_harvest_status_message) as mock_on_harvest_status_message:
+            self.consumer._callback(running_message1, message_objs[0])
+            self.consumer._callback(running_message2, message_objs[1])
+            self.consumer._callback(running_message3, message_objs[2])
+
+            # Only the newest status per harvest is applied.
+            self.assertEqual(2, mock_on_harvest_status_message.call_count)
+
+        harvest = Harvest.objects.get(harvest_id="test:1")
+        self.assertEqual(Harvest.RUNNING, harvest.status)
+        self.assertEqual(2, harvest.warcs_count)
+        # Token update from the dropped message is still applied.
+        self.assertEqual("new_token", Seed.objects.get(id=seed.id).token)
+        self.assertEqual(Harvest.RUNNING, Harvest.objects.get(harvest_id="test:2").status)
+        for message_obj in message_objs:
+            message_obj.ack.assert_called_once_with()
+
+    def test_coalesced_message_acked_after_retry(self):
+        message_objs = [self._message_obj("harvest.status.test.test_filter") for _ in range(2)]
+        self.consumer._callback(self._status_message("test:3", Harvest.RUNNING), message_objs[0])
+        self.consumer._callback(self._status_message("test:3", Harvest.RUNNING), message_objs[1])
+        self.consumer.process_batch()
+
+        # Dropped message is held unacked along with the deferred message that it was merged into.
+        self.assertEqual(1, len(self.consumer.deferred[("harvest", "test:3")].messages))
+        for message_obj in message_objs:
+            message_obj.ack.assert_not_called()
+
+        Harvest.objects.create(harvest_id="test:3", collection=Collection.objects.get())
+        self.consumer.retry_deferred_messages(now=time.time() + 60)
+        self.assertEqual(Harvest.RUNNING, Harvest.objects.get(harvest_id="test:3").status)
+        for message_obj in message_objs:
+            message_obj.ack.assert_called_once_with()
+        self.assertFalse(self.consumer.coalesced_message_objs)
+
+    def test_coalesce_keeps_terminal_harvest_status(self):
+        message_objs = [self._message_obj("harvest.status.test.test_filter") for _ in range(3)]
+        with patch.object(self.consumer, "_on_harvest_status_message",
+                          wraps=self.consumer._on_harvest_status_message) as mock_on_harvest_status_message:
+            self.consumer._callback(self._status_message("test:1", Harvest.RUNNING), message_objs[0])
+            self.consumer._callback(self._status_message("test:1", Harvest.FAILURE), message_objs[1])
+            self.consumer._callback(self._status_message("test:1", Harvest.SUCCESS), message_objs[2])
+
+            # Running is dropped, but not the terminal statuses.
+            self.assertEqual(2, mock_on_harvest_status_message.call_count)
+
+        self.assertEqual(Harvest.SUCCESS, Harvest.objects.get(harvest_id="test:1").status)
+        for message_obj in message_objs:
+            message_obj.ack.assert_called_once_with()
@@ -0,0 +1,39 @@
+from django.test import TestCase
+from mock import MagicMock
+from Queue import Queue
+from worker_pool import PartitionedConsumer, partition
+
+
+class PartitionedConsumerTest(TestCase):
+    def setUp(self):
+        self.consumer = PartitionedConsumer(workers=4)
+        self.consumer.worker_queues = [Queue() for _ in range(4)]
+        self.consumer.done_queue = Queue()
+
+    def test_partition(self):
+        status_message = {"id": "test:1", "status": "running"}
+        warc_message = {"warc": {"id": "test_warc"}, "harvest": {"id": "test:1"}}
+        # Messages for the same harvest are in the same partition.
+        self.assertEqual(partition("harvest.status.test.test_search", status_message, 4),
+                         partition("warc_created", warc_message, 4))
+        # Different harvests are spread across partitions.
+        partitions = set(partition("harvest.status.test.test_search", {"id": "test:{}".format(i)}, 4)
+                         for i in range(20))
+        self.assertTrue(len(partitions) > 1)
+
+    def test_callback_and_ack(self):
+        message = {"id": "test:1", "status": "running"}
+        message_obj = MagicMock()
+        message_obj.delivery_info = {"routing_key": "harvest.status.test.test_search"}
+        message_obj.delivery_tag = 1
+        self.consumer._callback(message, message_obj)
+
+        worker_queue = self.consumer.worker_queues[partition("harvest.status.test.test_search", message, 4)]
+        self.assertEqual(("harvest.status.test.test_search", message, 1), worker_queue.get_nowait())
+        message_obj.ack.assert_not_called()
+
+        # Worker processed the message
+        self.consumer.done_queue.put(1)
+        self.consumer.on_iteration()
+        message_obj.ack.assert_called_once_with()
+        self.assertFalse(self.consumer.unacked)
@@ -0,0 +1,141 @@
+import logging
+import multiprocessing
+import zlib
+from Queue import Empty
+
+from django import db
+from django.conf import settings
+from kombu.serialization import prepare_accept_content
+from sfmutils.consumer import BaseConsumer
+from ui.rabbit import ACCEPT_CONTENT
+from message_consumer.sfm_ui_consumer import SfmUiConsumer, message_target, use_configured_transport
+
+log = logging.getLogger(__name__)
+
+
+class PartitionedConsumer(BaseConsumer):
+    """
+    Consumer that applies messages with a pool of SfmUiConsumer worker processes.
+
+    Messages are routed to workers by the Harvest/Export that they apply to, so
+    messages for a harvest are applied in order while different harvests are
+    applied in parallel. Messages are acked once a worker has processed them.
+    """
+    def __init__(self, mq_config=None, workers=2, batch_size=None, **kwargs):
+        BaseConsumer.__init__(self, mq_config=mq_config, **kwargs)
+        use_configured_transport(self, mq_config)
+        self.worker_count = workers
+        self.batch_size = batch_size
+        # Map of delivery tag to message object
+        self.unacked = {}
+        self.worker_queues = []
+        self.workers = []
+        self.done_queue = None
+
+    def run(self, *args, **kwargs):
+        self.start_workers()
+        try:
+            BaseConsumer.run(self, *args, **kwargs)
+        finally:
+            self.stop_workers()
+
+    def start_workers(self):
+        # Workers must not share the database connections of this process.
+        db.connections.close_all()
+        self.done_queue = multiprocessing.Queue()
+        for i in range(self.worker_count):
+            worker_queue = multiprocessing.Queue()
+            worker = multiprocessing.Process(target=run_worker,
+                                             args=(worker_queue, self.done_queue, self.batch_size),
+                                             name="sfm_ui_consumer_{}".format(i))
+            worker.daemon = True
+            worker.start()
+            log.debug("Started worker %s", worker.name)
+            self.worker_queues.append(worker_queue)
+            self.workers.append(worker)
+
+    def stop_workers(self):
+        for worker_queue in self.worker_queues:
+            worker_queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout=30)
+        self.ack_processed()
+
+    def get_consumers(self, Consumer, channel):
+        consumers = BaseConsumer.get_consumers(self, Consumer, channel)
+        for consumer in consumers:
+            consumer.accept = prepare_accept_content(ACCEPT_CONTENT)
+            consumer.qos(prefetch_count=self.worker_count * settings.CONSUMER_WORKER_PREFETCH, apply_global=False)
+        return consumers
+
+    def consume(self, *args, **kwargs):
+        # Check frequently for messages processed by the workers.
+        kwargs.setdefault("safety_interval", 0.1)
+        return BaseConsumer.consume(self, *args, **kwargs)
+
+    def _callback(self, message, message_obj):
+        routing_key = message_obj.delivery_info["routing_key"]
+        delivery_tag = message_obj.delivery_tag
+        self.unacked[delivery_tag] = message_obj
+        self.worker_queues[partition(routing_key, message, self.worker_count)].put(
+            (routing_key, message, delivery_tag))
+
+    def on_iteration(self):
+        self.ack_processed()
+        for worker in self.workers:
+            if not worker.is_alive():
+                log.error("Worker %s exited with %s. Stopping.", worker.name, worker.exitcode)
+                self.should_stop = True
+
+    def ack_processed(self):
+        """
+        Acks the messages that the workers have processed.
+        """
+        while True:
+            try:
+                delivery_tag = self.done_queue.get_nowait()
+            except Empty:
+                break
+            self.unacked.pop(delivery_tag).ack()
+
+
+def partition(routing_key, message, partitions):
+    """
+    Returns the partition for a message, based on the Harvest/Export that it applies to.
+    """
+    target = message_target(routing_key, message)
+    key = "{}:{}".format(*target) if target else routing_key
+    return zlib.crc32(key) % partitions
+
+
+def run_worker(worker_queue, done_queue, batch_size):
+    """
+    Applies the messages from worker_queue with an SfmUiConsumer until None is received.
+    """
+    consumer = SfmUiConsumer(batch_size=batch_size)
+    while True:
+        try:
+            item = worker_queue.get(timeout=0.1)
+        except Empty:
+            consumer.on_iteration()
+            continue
+        if item is None:
+            if consumer.batch:
+                consumer.process_batch()
+            break
+        routing_key, message, delivery_tag = item
+        consumer._callback(message, _WorkerMessage(routing_key, delivery_tag, done_queue))
+        consumer.on_iteration()
+
+
+class _WorkerMessage:
+    """
+    Stands in for the message object in a worker. Acking notifies the consuming process.
+    """
+    def __init__(self, routing_key, delivery_tag, done_queue):
+        self.delivery_info = {"routing_key": routing_key}
+        self.delivery_tag = delivery_tag
+        self.done_queue = done_queue
+
+    def ack(self):
+        self.done_queue.put(self.delivery_tag)
@@ -150,6 +150,22 @@ SOCIALACCOUNT_ADAPTER = "ui.auth.SocialAccountAdapter"
 RABBITMQ_HOST = env.get('SFM_RABBITMQ_HOST')
 RABBITMQ_USER = env.get('SFM_RABBITMQ_USER')
 RABBITMQ_PASSWORD = env.get('SFM_RABBITMQ_PASSWORD')
+# Kombu transport for connections to the message broker. Set to "memory" to use an in-process broker,
+# e.g., for local runs and tests.
+RABBITMQ_TRANSPORT = env.get('SFM_RABBITMQ_TRANSPORT', 'librabbitmq')
+# Routing keys (topic patterns, comma separated) of messages to publish with compact encoding
+# (zlib-compressed msgpack), e.g., "harvest.start.twitter.*,export.start.#". Only list routing keys
+# whose consumers accept this encoding. Other messages are published as JSON.
+RABBITMQ_COMPACT_ROUTING_KEYS = [key for key in env.get('SFM_RABBITMQ_COMPACT_ROUTING_KEYS', '').split(',') if key]
+# Number of unconfirmed messages when bulk publishing with publisher confirms.
+RABBITMQ_CONFIRM_WINDOW = 1000
+# Seconds to wait for publisher confirms.
+RABBITMQ_CONFIRM_TIMEOUT = 30
+# Harvest, stop and export requests are queued in the database and published by the startdispatcher command.
+# Maximum number of queued messages to publish at a time.
+OUTBOX_DISPATCH_BATCH_SIZE = 500
+# Seconds between checks for queued messages.
+OUTBOX_DISPATCH_INTERVAL = 1
 
 # crispy forms bootstrap version
 CRISPY_TEMPLATE_PACK = 'bootstrap3'
@@ -178,11 +194,99 @@ EMAIL_PORT = 587
 EMAIL_HOST_USER = env.get('SFM_EMAIL_USER')
 EMAIL_HOST_PASSWORD = env.get('SFM_EMAIL_PASSWORD')
 EMAIL_USE_TLS = True
+# Emails from the message consumer are queued and sent by the startmailsender command.
+# Maximum number of queued emails to send per connection to the mail server.
+EMAIL_SENDER_BATCH_SIZE = 100
+# Seconds between checks for queued emails.
+EMAIL_SENDER_INTERVAL = 5
+# Number of attempts to send a queued email and seconds before the first retry. Retries back off exponentially.
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_DELAY = 60
+# Seconds that an email sender has to send the emails that it has claimed before they are due again.
+EMAIL_CLAIM_SECONDS = 300
 
 # Whether to run apscheduler
 RUN_SCHEDULER = env.get('SFM_RUN_SCHEDULER', 'False') == 'True'
+# Per-credential budget for harvests. When a credential is over budget, its harvests are delayed.
+# Maximum number of requested or running harvests per credential. 0 for no maximum.
+CREDENTIAL_MAX_CONCURRENT_HARVESTS = int(env.get('SFM_CREDENTIAL_MAX_CONCURRENT_HARVESTS', '0'))
+# Requested or running harvests that were requested more than this many hours ago are assumed to be stuck and
+# are not counted as concurrent harvests.
+CREDENTIAL_CONCURRENT_HARVEST_MAX_HOURS = 24
+# Maximum number of harvests per credential requested within CREDENTIAL_HARVEST_WINDOW_MINUTES. 0 for no maximum.
+CREDENTIAL_MAX_RECENT_HARVESTS = int(env.get('SFM_CREDENTIAL_MAX_RECENT_HARVESTS', '0'))
+CREDENTIAL_HARVEST_WINDOW_MINUTES = 15
+# Seconds to delay a harvest when its credential has the maximum number of concurrent harvests.
+CREDENTIAL_HARVEST_DELAY_SECONDS = 60
+# Seconds between checks of whether the previous harvest of a collection that coalesces overlapping harvests
+# has finished.
+HARVEST_OVERLAP_RETRY_SECONDS = 60
+# Requested or running harvests that were requested more than this many hours ago are assumed to be stuck and
+# do not prevent overlapping harvests.
+HARVEST_IN_PROGRESS_MAX_HOURS = 24
+# Executor that runs the scheduler's jobs, either "thread" (a pool of threads) or "process" (a pool of processes
+# forked from SFM UI).
+SCHEDULER_EXECUTOR = env.get('SFM_SCHEDULER_EXECUTOR', 'thread')
+# Maximum number of threads or processes running the scheduler's jobs.
+SCHEDULER_MAX_WORKERS = int(env.get('SFM_SCHEDULER_MAX_WORKERS', '10'))
+# Whether a job whose run times were missed (e.g., while SFM UI was down) is run once rather than once per run time.
+SCHEDULER_COALESCE = True
+# Seconds after its run time that a job may still be run. Otherwise, the run is missed.
+SCHEDULER_MISFIRE_GRACE_TIME = int(env.get('SFM_SCHEDULER_MISFIRE_GRACE_TIME', '900'))
+# Seconds between logging the scheduler's job queue depth and latency. 0 to not log.
+SCHEDULER_METRICS_INTERVAL = 300
+# Whether the schedulers of several nodes (all with RUN_SCHEDULER) elect a leader to run the jobs, using a
+# PostgreSQL advisory lock on the scheduler database.
+SCHEDULER_LEADER_ELECTION = env.get('SFM_SCHEDULER_LEADER_ELECTION', 'False') == 'True'
+# Seconds between leader elections. Another node takes over from a lost leader within about this long. Also, with
+# leader election or the process executor, seconds between reloads of the jobs, which may be changed elsewhere.
+SCHEDULER_LEADER_INTERVAL = 5
+# Id of the advisory lock
+SCHEDULER_LEADER_LOCK_ID = 51700001
+# Interval harvests are spread over their interval, but not more than this many minutes, rather than
+# all starting when their collections are saved (e.g., by a bulk import). This delays the first harvest
+# of a new collection by up to this many minutes. 0 to not spread.
+SCHEDULE_STAGGER_MAX_MINUTES = int(env.get('SFM_SCHEDULE_STAGGER_MAX_MINUTES', '0'))
+# Maximum number of seconds added at random to the start of interval harvests.
+SCHEDULE_JITTER_SECONDS = int(env.get('SFM_SCHEDULE_JITTER_SECONDS', '30'))
+# Whether to adapt the intervals of harvests to the number of items collected by recent harvests.
+# Collections whose harvests collect few items are harvested less often and those that collect many more often.
+ADAPTIVE_SCHEDULE = env.get('SFM_ADAPTIVE_SCHEDULE', 'False') == 'True'
+# Number of recent successful harvests to average.
+ADAPTIVE_SCHEDULE_WINDOW = 5
+# Average number of items below which the interval is doubled.
+ADAPTIVE_SCHEDULE_QUIET_ITEMS = 1
+# Average number of items at or above which the interval is halved.
+ADAPTIVE_SCHEDULE_BUSY_ITEMS = 1000
+# Bounds of the interval, as multiples of the collection's schedule.
+ADAPTIVE_SCHEDULE_MIN_FACTOR = 0.5
+ADAPTIVE_SCHEDULE_MAX_FACTOR = 8
 
 
 PERFORM_USER_HARVEST_EMAILS = env.get('SFM_PERFORM_USER_HARVEST_EMAILS', 'True') == 'True'
 USER_HARVEST_EMAILS_HOUR = env.get('SFM_USER_HARVEST_EMAILS_HOUR', '1')
 USER_HARVEST_EMAILS_MINUTE = env.get('SFM_USER_HARVEST_EMAILS_MINUTE', '0')
+
+# Seconds to wait before each retry of a consumer message whose Harvest/Export is not yet visible.
+# Once exhausted, the message is dropped.
+CONSUMER_RETRY_DELAYS = (0.5, 1, 2, 4, 8)
+# Maximum number of deferred messages the consumer holds unacked while waiting to retry them. Once reached, no
+# more messages are received until deferred messages are applied or dropped.
+CONSUMER_MAX_DEFERRED = 100
+
+# Number of messages the consumer prefetches and applies in a batch, one transaction per routing key.
+# 1 applies each message as it is received.
+CONSUMER_BATCH_SIZE = int(env.get('SFM_CONSUMER_BATCH_SIZE', '1'))
+# Seconds to wait for a batch to fill before applying it.
+CONSUMER_BATCH_WAIT = 0.5
+# Whether to skip harvest status messages in a batch that are superseded by a later status for the same harvest,
+# e.g., the repeated status messages of streaming harvests. Only applies when CONSUMER_BATCH_SIZE is greater than 1.
+CONSUMER_COALESCE_HARVEST_STATUS = True
+# Number of fingerprints of processed messages the consumer keeps to skip redelivered messages. 0 disables.
+CONSUMER_DEDUP_SIZE = 100000
+# Seconds between logging summaries of consumer timings, query counts and lag. 0 disables.
+CONSUMER_METRICS_INTERVAL = int(env.get('SFM_CONSUMER_METRICS_INTERVAL', '300'))
+# Number of consumer worker processes. Messages are partitioned across workers by harvest/export.
+CONSUMER_WORKERS = int(env.get('SFM_CONSUMER_WORKERS', '1'))
+# Number of unacked messages to prefetch per consumer worker process.
+CONSUMER_WORKER_PREFETCH = 50
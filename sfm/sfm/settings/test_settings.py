@@ -12,6 +12,8 @@ DATABASES = {
 
 SFM_DATA_DIR=os.path.join(tempfile.gettempdir(), "test-data")
 
+RABBITMQ_TRANSPORT = "memory"
+
 SCHEDULER_DB_URL = "sqlite:///testdb"
 
 SCHEDULE_HARVESTS = False
@@ -79,7 +79,7 @@ class HistoricalCollectionSet(a.ModelAdmin):
 
 class Collection(a.ModelAdmin):
     fields = ('collection_id', 'collection_set', 'credential', 'harvest_type', 'name',
-              'description', 'is_active', 'schedule_minutes', 'harvest_options',
+              'description', 'is_active', 'schedule_minutes', 'overlap_policy', 'harvest_options',
               'date_added', 'end_date', 'history_note')
     list_display = ['collection_set', 'credential', 'harvest_type', 'name',
                     'description', 'is_active', 'harvest_options',
@@ -94,7 +94,7 @@ class Collection(a.ModelAdmin):
 
 class HistoricalCollection(a.ModelAdmin):
     fields = ('history_user', 'history_date', 'history_note', 'collection_set', 'credential', 'harvest_type', 'name',
-              'description', 'is_active', 'schedule_minutes', 'harvest_options',
+              'description', 'is_active', 'schedule_minutes', 'overlap_policy', 'harvest_options',
               'date_added', 'end_date')
     list_display = ['collection_set', 'credential', 'harvest_type', 'name',
                     'description', 'is_active', 'harvest_options',
@@ -129,9 +129,16 @@ class HistoricalSeed(a.ModelAdmin):
                      'is_valid', 'date_added', 'date_updated']
 
 
+class SeedSet(a.ModelAdmin):
+    fields = ('digest', 'date_added')
+    list_display = ['id', 'digest', 'date_added']
+    list_filter = ['date_added']
+    search_fields = ['id', 'digest']
+
+
 class Harvest(a.ModelAdmin):
     fields = (
-       'harvest_type', 'harvest_id', 'historical_collection', 'historical_seeds', 'historical_credential',
+       'harvest_type', 'harvest_id', 'historical_collection', 'seed_set', 'historical_credential',
        'parent_harvest', 'status', 'date_requested', 'date_started', 'date_ended',
        'infos', 'warnings', 'errors', 'token_updates', 'uids', 'warcs_count', 'warcs_bytes')
     list_display = ['harvest_type', 'id', 'harvest_id', 'historical_collection', 'status', 'date_requested',
@@ -169,6 +176,20 @@ class Export(a.ModelAdmin):
     list_filter = ['date_requested', 'user', 'export_type', 'status']
     search_fields = ['id', 'export_id', 'path']
 
+class OutboxEmail(a.ModelAdmin):
+    fields = (
+       'subject', 'message', 'recipients', 'status', 'attempts', 'error', 'date_added', 'date_next_attempt',
+       'date_sent')
+    list_display = ['id', 'subject', 'status', 'date_added', 'date_sent']
+    list_filter = ['status', 'date_added']
+    search_fields = ['id', 'subject']
+
+class OutboxMessage(a.ModelAdmin):
+    fields = ('routing_key', 'message', 'date_added')
+    list_display = ['id', 'routing_key', 'date_added']
+    list_filter = ['date_added']
+    search_fields = ['id', 'routing_key']
+
 a.site.register(m.Credential, Credential)
 a.site.register(m.HistoricalCredential, HistoricalCredential)
 a.site.register(m.CollectionSet, CollectionSet)
@@ -177,7 +198,10 @@ a.site.register(m.Collection, Collection)
 a.site.register(m.HistoricalCollection, HistoricalCollection)
 a.site.register(m.Seed, Seed)
 a.site.register(m.HistoricalSeed, HistoricalSeed)
+a.site.register(m.SeedSet, SeedSet)
 a.site.register(m.Harvest, Harvest)
 a.site.register(m.HarvestStat, HarvestStat)
 a.site.register(m.Warc, Warc)
 a.site.register(m.Export, Export)
+a.site.register(m.OutboxEmail, OutboxEmail)
+a.site.register(m.OutboxMessage, OutboxMessage)
@@ -0,0 +1,51 @@
+import datetime
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Collection, Credential, Harvest
+
+log = logging.getLogger(__name__)
+
+
+def credential_harvest_delay(credential_id, now=None):
+    """
+    Returns the number of seconds to delay a harvest using the credential, or 0 if it can be requested now.
+
+    Keeps each credential within a budget of concurrent harvests (settings.CREDENTIAL_MAX_CONCURRENT_HARVESTS)
+    and of harvests requested within a window (settings.CREDENTIAL_MAX_RECENT_HARVESTS in
+    settings.CREDENTIAL_HARVEST_WINDOW_MINUTES). Streaming and web harvests are not counted, nor are
+    requested or running harvests older than settings.CREDENTIAL_CONCURRENT_HARVEST_MAX_HOURS, which are
+    assumed to be stuck.
+
+    The credential is locked until the end of the caller's transaction, so the caller should create the
+    harvest in the same transaction. Otherwise, concurrent harvests could all find the credential under budget.
+    """
+    if not settings.CREDENTIAL_MAX_CONCURRENT_HARVESTS and not settings.CREDENTIAL_MAX_RECENT_HARVESTS:
+        return 0
+
+    with transaction.atomic():
+        Credential.objects.select_for_update().get(pk=credential_id)
+        now = now or timezone.now()
+        harvests = Harvest.objects.filter(collection__credential_id=credential_id).exclude(
+            harvest_type__in=Collection.STREAMING_HARVEST_TYPES + ("web",))
+
+        if settings.CREDENTIAL_MAX_CONCURRENT_HARVESTS:
+            concurrent_count = harvests.filter(status__in=(Harvest.REQUESTED, Harvest.RUNNING), date_requested__gt=(
+                now - datetime.timedelta(hours=settings.CREDENTIAL_CONCURRENT_HARVEST_MAX_HOURS))).count()
+            if concurrent_count >= settings.CREDENTIAL_MAX_CONCURRENT_HARVESTS:
+                log.debug("Credential %s has %s concurrent harvests", credential_id, concurrent_count)
+                return settings.CREDENTIAL_HARVEST_DELAY_SECONDS
+
+        if settings.CREDENTIAL_MAX_RECENT_HARVESTS:
+            window = datetime.timedelta(minutes=settings.CREDENTIAL_HARVEST_WINDOW_MINUTES)
+            recent_dates = list(harvests.filter(date_requested__gt=now - window).order_by(
+                "-date_requested").values_list("date_requested", flat=True)[:settings.CREDENTIAL_MAX_RECENT_HARVESTS])
+            if len(recent_dates) >= settings.CREDENTIAL_MAX_RECENT_HARVESTS:
+                log.debug("Credential %s has %s recent harvests", credential_id, len(recent_dates))
+                # Until the oldest of the budgeted harvests leaves the window
+                return max(int((recent_dates[-1] + window - now).total_seconds()) + 1, 1)
+
+        return 0
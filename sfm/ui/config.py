@@ -14,7 +14,7 @@ class UIConfig(AppConfig):
     def ready(self):
         RabbitWorker().declare_exchange()
         from models import Collection, Export
-        from sched import start_sched, schedule_harvest_receiver, unschedule_harvest_receiver
+        from sched import start_sched, schedule_harvest_receiver, unschedule_harvest_receiver, THREAD_EXECUTOR
         from export import export_receiver, export_m2m_receiver
         from notifications import send_user_harvest_emails
 
@@ -41,7 +41,8 @@ class UIConfig(AppConfig):
                 if sched.get_job('user_harvest_emails') is not None:
                     sched.remove_job('user_harvest_emails')
                 sched.add_job(send_user_harvest_emails, 'cron', hour=settings.USER_HARVEST_EMAILS_HOUR,
-                              minute=settings.USER_HARVEST_EMAILS_MINUTE, id='user_harvest_emails')
+                              minute=settings.USER_HARVEST_EMAILS_MINUTE, id='user_harvest_emails',
+                              executor=THREAD_EXECUTOR)
 
         else:
             log.debug("Not running scheduler")
@@ -1,5 +1,6 @@
-from .rabbit import RabbitWorker
+from .outbox import queue_message
 import logging
+from django.db import transaction
 from django.utils import timezone
 from .models import Export
 
@@ -25,6 +26,7 @@ def export_m2m_receiver(sender, **kwargs):
         request_export(kwargs["instance"])
 
 
+@transaction.atomic
 def request_export(export):
 
     # Return if already requested
@@ -71,8 +73,8 @@ def request_export(export):
 
     log.debug("Sending %s message to %s with id %s", export.export_type, routing_key, export.export_id)
 
-    # Publish message to queue via rabbit worker
-    RabbitWorker().send_message(message, routing_key)
+    # Queue message to be published once the export is committed
+    queue_message(message, routing_key)
 
     # Update date requested
     export.date_requested = timezone.now()
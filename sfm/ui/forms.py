@@ -103,7 +103,7 @@ class BaseCollectionForm(forms.ModelForm):
     class Meta:
         model = Collection
         fields = ['name', 'description', 'collection_set',
-                  'schedule_minutes', 'credential', 'end_date',
+                  'schedule_minutes', 'overlap_policy', 'credential', 'end_date',
                   'history_note']
         exclude = []
         widgets = {'collection_set': forms.HiddenInput,
@@ -141,6 +141,7 @@ class BaseCollectionForm(forms.ModelForm):
                 'credential',
                 Div(),
                 'schedule_minutes',
+                'overlap_policy',
                 'end_date',
                 'collection_set',
                 'history_note'
@@ -234,7 +235,7 @@ class CollectionTwitterSampleForm(BaseCollectionForm):
                                               label=TWITTER_WEB_RESOURCES_LABEL)
 
     class Meta(BaseCollectionForm.Meta):
-        exclude = ('schedule_minutes',)
+        exclude = ('schedule_minutes', 'overlap_policy')
 
     def __init__(self, *args, **kwargs):
         super(CollectionTwitterSampleForm, self).__init__(*args, **kwargs)
@@ -266,7 +267,7 @@ class CollectionTwitterFilterForm(BaseCollectionForm):
                                               label=TWITTER_WEB_RESOURCES_LABEL)
 
     class Meta(BaseCollectionForm.Meta):
-        exclude = ('schedule_minutes',)
+        exclude = ('schedule_minutes', 'overlap_policy')
 
     def __init__(self, *args, **kwargs):
         super(CollectionTwitterFilterForm, self).__init__(*args, **kwargs)
@@ -1,11 +1,13 @@
 import json
 import logging
 
-from .rabbit import RabbitWorker
-from .models import Collection, Harvest, default_uuid
+from .admission import credential_harvest_delay
+from .outbox import queue_message
+from .models import Collection, Harvest, HistoricalSeed, SeedSet, default_uuid, seed_set_digest
 from django.core.exceptions import ObjectDoesNotExist
 from django.conf import settings
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.db.models import Max
 
 log = logging.getLogger(__name__)
 
@@ -28,14 +30,29 @@ def collection_harvest(collection_pk):
         log.debug("Ignoring Harvest for collection as collection %s is inactive", collection_pk)
         return
 
+    if not collection.is_streaming():
+        if collection.overlap_policy != Collection.OVERLAP_QUEUE and collection.has_harvest_in_progress():
+            if collection.overlap_policy == Collection.OVERLAP_SKIP:
+                log.info("Skipping harvest of collection %s since previous harvest is still in progress",
+                         collection_pk)
+                return
+            # Replaces an already delayed harvest, so overlapping harvests are coalesced into one.
+            log.info("Delaying harvest of collection %s until previous harvest is finished", collection_pk)
+            from .sched import delay_harvest
+            delay_harvest(collection_pk, settings.HARVEST_OVERLAP_RETRY_SECONDS)
+            return
+
+        delay = credential_harvest_delay(collection.credential_id)
+        if delay:
+            log.info("Delaying harvest of collection %s by %s seconds since credential %s is over budget",
+                     collection_pk, delay, collection.credential_id)
+            from .sched import delay_harvest
+            delay_harvest(collection_pk, delay)
+            return
+
     historical_collection = collection.history.all()[0]
     historical_credential = historical_collection.credential.history.all()[0]
-    historical_seeds = []
-    for seed in collection.seeds.all():
-        if seed.is_active:
-            historical_seeds.append(seed.history.all()[0])
-        else:
-            log.debug("Seed %s is ignored from the harvest as it is inactive", seed)
+    historical_seeds = latest_historical_seeds(collection)
 
     # Make sure that have the correct number of seeds.
     required_seed_count = collection.required_seed_count()
@@ -83,19 +100,58 @@ def collection_harvest(collection_pk):
     routing_key = "harvest.start.{}.{}".format(historical_credential.platform,
                                                harvest_type)
 
+    # Record harvest model instance
+    Harvest.objects.create(harvest_type=harvest_type,
+                           harvest_id=harvest_id,
+                           collection=collection,
+                           historical_collection=historical_collection,
+                           historical_credential=historical_credential,
+                           seed_set=get_seed_set(historical_seeds))
+
     log.debug("Sending %s message to %s with id %s", harvest_type,
               routing_key, harvest_id)
 
-    # Publish message to queue via rabbit worker
-    RabbitWorker().send_message(message, routing_key)
+    # Queue message to be published once the harvest is committed
+    queue_message(message, routing_key)
 
-    # Record harvest model instance
-    harvest = Harvest.objects.create(harvest_type=harvest_type,
-                                     harvest_id=harvest_id,
-                                     collection=collection,
-                                     historical_collection=historical_collection,
-                                     historical_credential=historical_credential)
-    harvest.historical_seeds.add(*historical_seeds)
+
+def latest_historical_seeds(collection):
+    """
+    Returns the latest HistoricalSeed of each active seed of the collection, ordered by seed.
+
+    The historical seeds are retrieved in a single query.
+    """
+    active_seed_ids = collection.seeds.filter(is_active=True).values("id")
+    # Clearing the default ordering, which would otherwise be added to the GROUP BY.
+    latest_history_ids = HistoricalSeed.objects.filter(id__in=active_seed_ids).order_by().values("id").annotate(
+        latest_history_id=Max("history_id")).values("latest_history_id")
+    return list(HistoricalSeed.objects.filter(history_id__in=latest_history_ids).order_by("id"))
+
+
+def get_seed_set(historical_seeds):
+    """
+    Returns the SeedSet of the historical seeds, creating it if it does not exist.
+
+    Returns None if there are no historical seeds.
+    """
+    if not historical_seeds:
+        return None
+    digest = seed_set_digest([historical_seed.history_id for historical_seed in historical_seeds])
+    try:
+        return SeedSet.objects.get(digest=digest)
+    except ObjectDoesNotExist:
+        pass
+    try:
+        with transaction.atomic():
+            seed_set = SeedSet.objects.create(digest=digest)
+            seed_set.historical_seeds.through.objects.bulk_create(
+                [seed_set.historical_seeds.through(seedset=seed_set, historicalseed=historical_seed)
+                 for historical_seed in historical_seeds])
+        log.debug("Created seed set %s of %s seeds", digest, len(historical_seeds))
+        return seed_set
+    except IntegrityError:
+        # Created by a concurrent harvest
+        return SeedSet.objects.get(digest=digest)
 
 
 @transaction.atomic
@@ -121,8 +177,8 @@ def collection_stop(collection_id):
 
     log.debug("Sending %s stop message to %s with id %s", harvest.harvest_type, routing_key, harvest.harvest_id)
 
-    # Publish message to queue via rabbit worker
-    RabbitWorker().send_message(message, routing_key)
+    # Queue message to be published once the harvest is committed
+    queue_message(message, routing_key)
 
     # Update harvest model instance
     harvest.status = Harvest.STOP_REQUESTED
@@ -0,0 +1,99 @@
+import logging
+import socket
+import datetime
+from smtplib import SMTPException
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+log = logging.getLogger(__name__)
+
+
+def queue_mail(subject, message, recipient_list):
+    """
+    Queues an email to be sent by the email sender.
+
+    Unlike send_mail, the email is written as part of the caller's
+    transaction and the caller does not wait on the mail server.
+    """
+    log.debug("Queueing email to %s: %s", recipient_list, subject)
+    return OutboxEmail.objects.create(subject=subject, message=message, recipients=list(recipient_list))
+
+
+def send_queued_mail(now=None):
+    """
+    Sends the queued emails that are due over a single connection to the mail server.
+
+    Each queued email is sent as its own email to its recipients. Emails that cannot be
+    sent are retried with backoff until EMAIL_MAX_ATTEMPTS is reached. The emails are
+    claimed before they are sent (see _claim_queued_mail()), so that concurrent email
+    senders (e.g., on several SFM UI nodes) do not send the same emails.
+    :return: the number of queued emails that were sent
+    """
+    if now is None:
+        now = timezone.now()
+    emails = _claim_queued_mail(now)
+    if not emails:
+        return 0
+
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except (SMTPException, socket.error), ex:
+        log.error("Error connecting to mail server: %s", ex)
+        _retry_later(emails, ex, now)
+        return 0
+
+    sent_count = 0
+    try:
+        for email in emails:
+            try:
+                log.debug("Sending email to %s: %s", email.recipients, email.subject)
+                EmailMessage(email.subject, email.message, settings.EMAIL_HOST_USER, email.recipients,
+                             connection=connection).send()
+            except (SMTPException, socket.error), ex:
+                log.error("Error sending email: %s", ex)
+                _retry_later([email], ex, now)
+                continue
+            OutboxEmail.objects.filter(id=email.id).update(status=OutboxEmail.SENT, attempts=F("attempts") + 1,
+                                                           date_sent=timezone.now())
+            sent_count += 1
+    finally:
+        connection.close()
+    return sent_count
+
+
+@transaction.atomic
+def _claim_queued_mail(now):
+    """
+    Claims the queued emails that are due by postponing their next attempt by EMAIL_CLAIM_SECONDS.
+
+    The emails are only locked while they are claimed, not while they are sent. If the
+    email sender stops before sending them, they are due again once the claim expires.
+    :return: list of the claimed emails
+    """
+    emails = list(OutboxEmail.objects.select_for_update().filter(status=OutboxEmail.QUEUED,
+                                                                 date_next_attempt__lte=now).order_by("id")[
+                  :settings.EMAIL_SENDER_BATCH_SIZE])
+    if emails:
+        OutboxEmail.objects.filter(id__in=[email.id for email in emails]).update(
+            date_next_attempt=now + datetime.timedelta(seconds=settings.EMAIL_CLAIM_SECONDS))
+    return emails
+
+
+def _retry_later(emails, ex, now):
+    for email in emails:
+        email.attempts += 1
+        email.error = str(ex)
+        if email.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+            log.error("Giving up on email to %s: %s", email.recipients, email.subject)
+            email.status = OutboxEmail.FAILURE
+        else:
+            email.date_next_attempt = now + datetime.timedelta(
+                seconds=settings.EMAIL_RETRY_DELAY * 2 ** (email.attempts - 1))
+        email.save()
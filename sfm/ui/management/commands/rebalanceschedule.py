@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from ui.sched import open_jobstore, rebalance_harvests, jobs_changed_elsewhere
+
+
+class Command(BaseCommand):
+    help = 'Spreads the scheduled interval harvests evenly over their intervals.'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--test", action="store_true", help="Print out the new schedule instead of saving it")
+
+    def handle(self, *args, **options):
+        jobstore = open_jobstore()
+        try:
+            jobs = rebalance_harvests(jobstore.get_all_jobs())
+            for job in jobs:
+                self.stdout.write("{}: next run at {}".format(job.name, job.next_run_time))
+                if not options["test"]:
+                    jobstore.update_job(job)
+        finally:
+            jobstore.shutdown()
+        if options["test"]:
+            self.stdout.write("{} harvests would be rebalanced".format(len(jobs)))
+        else:
+            self.stdout.write("{} harvests rebalanced".format(len(jobs)))
+            # The jobs are changed outside of the running scheduler.
+            if jobs_changed_elsewhere():
+                self.stdout.write("The running scheduler will pick up the new schedule within {} seconds.".format(
+                    settings.SCHEDULER_LEADER_INTERVAL))
+            else:
+                self.stdout.write("Restart SFM UI so that the running scheduler picks up the new schedule.")
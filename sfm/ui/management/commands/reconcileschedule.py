@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from ui.models import Collection
+from ui.sched import open_jobstore, reconcile_harvests, save_reconciled_jobs
+
+
+class Command(BaseCommand):
+    help = 'Adds, replaces and removes scheduled jobs so that they match the active collections.'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--test", action="store_true", help="Print out the changes instead of saving them")
+
+    def handle(self, *args, **options):
+        collections = Collection.objects.filter(is_active=True).values("id", "harvest_type", "schedule_minutes",
+                                                                       "end_date")
+        jobstore = open_jobstore()
+        try:
+            added_jobs, replaced_jobs, removed_job_ids = reconcile_harvests(jobstore.get_all_jobs(), collections)
+            for job in added_jobs:
+                self.stdout.write("Add {}: next run at {}".format(job.name, job.next_run_time))
+            for job in replaced_jobs:
+                self.stdout.write("Replace {}: next run at {}".format(job.name, job.next_run_time))
+            for job_id in removed_job_ids:
+                self.stdout.write("Remove job {}".format(job_id))
+            if not options["test"]:
+                save_reconciled_jobs(jobstore, added_jobs, replaced_jobs, removed_job_ids)
+        finally:
+            jobstore.shutdown()
+        self.stdout.write("{} jobs {}added, {} replaced and {} removed".format(
+            len(added_jobs), "would be " if options["test"] else "", len(replaced_jobs), len(removed_job_ids)))
@@ -19,7 +19,8 @@ class Command(BaseCommand):
         if options["routing_key"] == "warc_created":
             raise CommandError("Cannot send messages to warc_created since they may have unintended consequeunces.")
 
-        warcs = Warc.objects.all()
+        # Ordered, so that unconfirmed messages can be found again by their index.
+        warcs = Warc.objects.order_by("id")
         if options["collection_set"]:
             warcs = warcs.filter(harvest__collection__collection_set__collection_set_id=options["collection_set"])
         if options["harvest_type"]:
@@ -29,8 +30,14 @@ class Command(BaseCommand):
             for msg in self.message_generator(warcs):
                 self.stdout.write(json.dumps(msg))
         else:
-            RabbitWorker().send_messages(self.message_generator(warcs), options["routing_key"])
-            self.stdout.write("Messages sent")
+            failed_indexes = RabbitWorker().publish_messages(
+                (options["routing_key"], msg) for msg in self.message_generator(warcs))
+            if failed_indexes:
+                failed_index_set = set(failed_indexes)
+                for index, msg in enumerate(self.message_generator(warcs)):
+                    if index in failed_index_set:
+                        self.stderr.write("Not confirmed: {}".format(json.dumps(msg)))
+            self.stdout.write("Messages sent with {} failures".format(len(failed_indexes)))
 
     @staticmethod
     def message_generator(warcs):
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from ui.outbox import dispatch_messages
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Starts the dispatcher of queued messages'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Dispatching queued messages.')
+        while True:
+            try:
+                dispatched_count = dispatch_messages()
+            except Exception:
+                log.exception("Error dispatching messages")
+                # Reconnects if the database connection was lost.
+                close_old_connections()
+                dispatched_count = 0
+            # Keep dispatching while there are more messages queued.
+            if dispatched_count < settings.OUTBOX_DISPATCH_BATCH_SIZE:
+                time.sleep(settings.OUTBOX_DISPATCH_INTERVAL)
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from ui.mail import send_queued_mail
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Starts the sender of queued emails'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Sending queued emails.')
+        while True:
+            try:
+                sent_count = send_queued_mail()
+            except Exception:
+                log.exception("Error sending queued emails")
+                # Reconnects if the database connection was lost.
+                close_old_connections()
+                sent_count = 0
+            # Keep draining while there are more emails due.
+            if sent_count < settings.EMAIL_SENDER_BATCH_SIZE:
+                time.sleep(settings.EMAIL_SENDER_INTERVAL)
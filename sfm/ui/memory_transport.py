@@ -0,0 +1,43 @@
+"""
+In-process kombu transport, used when settings.RABBITMQ_TRANSPORT is "memory".
+
+Exchanges, queues and bindings are held in memory and shared by all connections
+in the process. Unlike kombu's memory transport, a queue may be bound to a topic
+exchange with multiple routing keys (e.g., harvest.status.* and harvest.status.*.*)
+and a message is delivered to a queue at most once, as with RabbitMQ.
+"""
+from kombu.transport import memory, virtual
+
+
+class Channel(memory.Channel):
+    queues = {}
+
+    def queue_bind(self, queue, exchange=None, routing_key='', arguments=None, **kwargs):
+        exchange = exchange or 'amq.direct'
+        table = self.state.exchanges[exchange].setdefault('table', [])
+        meta = self.typeof(exchange).prepare_bind(queue, exchange, routing_key, arguments)
+        if meta not in table:
+            table.append(meta)
+        self.state.bindings[queue] = exchange, routing_key, arguments
+
+    def queue_delete(self, queue, if_unused=False, if_empty=False, **kwargs):
+        if if_empty and self._size(queue):
+            return
+        for exchange in self.state.exchanges.values():
+            exchange['table'] = [meta for meta in exchange.get('table', []) if meta[2] != queue]
+        self.state.bindings.pop(queue, None)
+        self._delete(queue)
+
+    def _lookup(self, exchange, routing_key, default=None):
+        # Each queue once, even if several of its bindings match.
+        queues = []
+        for queue in memory.Channel._lookup(self, exchange, routing_key, default=default):
+            if queue not in queues:
+                queues.append(queue)
+        return queues
+
+
+class Transport(memory.Transport):
+    Channel = Channel
+
+    state = virtual.BrokerState()
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import jsonfield.fields
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ui', '0003_auto_20160901_1837'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEmail',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('subject', models.TextField()),
+                ('message', models.TextField()),
+                ('recipients', jsonfield.fields.JSONField(default=dict)),
+                ('status', models.CharField(default=b'queued', max_length=20, choices=[(b'queued', b'Queued'), (b'sent', b'Sent'), (b'failure', b'Failure')])),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('date_added', models.DateTimeField(default=django.utils.timezone.now)),
+                ('date_next_attempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('date_sent', models.DateTimeField(null=True, blank=True)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='outboxemail',
+            index_together=set([('status', 'date_next_attempt')]),
+        ),
+    ]
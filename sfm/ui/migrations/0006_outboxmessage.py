@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import jsonfield.fields
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ui', '0005_processedmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('routing_key', models.CharField(max_length=255)),
+                ('message', jsonfield.fields.JSONField(default=dict)),
+                ('date_added', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
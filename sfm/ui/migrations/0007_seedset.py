@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ui', '0006_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeedSet',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('digest', models.CharField(unique=True, max_length=40)),
+                ('date_added', models.DateTimeField(default=django.utils.timezone.now)),
+                ('historical_seeds', models.ManyToManyField(related_name='seed_sets', to='ui.HistoricalSeed')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='harvest',
+            name='seed_set',
+            field=models.ForeignKey(related_name='harvests', blank=True, to='ui.SeedSet', null=True),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from itertools import groupby
+import hashlib
+
+# Number of harvests to update per statement
+BATCH_SIZE = 500
+
+
+def seed_set_digest(historical_seed_ids):
+    # Copy of ui.models.seed_set_digest at the time of this migration.
+    return hashlib.sha1(",".join(str(history_id) for history_id in sorted(historical_seed_ids))).hexdigest()
+
+
+def create_seed_sets(apps, schema_editor):
+    Harvest = apps.get_model("ui", "Harvest")
+    SeedSet = apps.get_model("ui", "SeedSet")
+    HarvestSeeds = Harvest.historical_seeds.through
+    SeedSetSeeds = SeedSet.historical_seeds.through
+
+    # Map of digest to seed set id
+    seed_set_ids = {}
+    # Map of seed set id to harvest ids
+    seed_set_harvest_ids = {}
+    harvest_seeds = HarvestSeeds.objects.order_by("harvest_id").values_list("harvest_id",
+                                                                            "historicalseed_id").iterator()
+    for harvest_id, rows in groupby(harvest_seeds, lambda row: row[0]):
+        historical_seed_ids = [historical_seed_id for _, historical_seed_id in rows]
+        digest = seed_set_digest(historical_seed_ids)
+        if digest not in seed_set_ids:
+            seed_set = SeedSet.objects.create(digest=digest)
+            SeedSetSeeds.objects.bulk_create([SeedSetSeeds(seedset_id=seed_set.id, historicalseed_id=historical_seed_id)
+                                              for historical_seed_id in historical_seed_ids])
+            seed_set_ids[digest] = seed_set.id
+        seed_set_harvest_ids.setdefault(seed_set_ids[digest], []).append(harvest_id)
+
+    for seed_set_id, harvest_ids in seed_set_harvest_ids.items():
+        for i in range(0, len(harvest_ids), BATCH_SIZE):
+            Harvest.objects.filter(id__in=harvest_ids[i:i + BATCH_SIZE]).update(seed_set=seed_set_id)
+
+
+def restore_historical_seeds(apps, schema_editor):
+    Harvest = apps.get_model("ui", "Harvest")
+    SeedSet = apps.get_model("ui", "SeedSet")
+    HarvestSeeds = Harvest.historical_seeds.through
+    SeedSetSeeds = SeedSet.historical_seeds.through
+
+    # Map of seed set id to historical seed ids
+    seed_set_seeds = {}
+    for seed_set_id, historical_seed_id in SeedSetSeeds.objects.values_list("seedset_id",
+                                                                            "historicalseed_id").iterator():
+        seed_set_seeds.setdefault(seed_set_id, []).append(historical_seed_id)
+
+    for harvest_id, seed_set_id in Harvest.objects.filter(seed_set__isnull=False).values_list("id",
+                                                                                               "seed_set").iterator():
+        HarvestSeeds.objects.bulk_create([HarvestSeeds(harvest_id=harvest_id, historicalseed_id=historical_seed_id)
+                                          for historical_seed_id in seed_set_seeds[seed_set_id]])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ui', '0007_seedset'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_seed_sets, restore_historical_seeds),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ui', '0008_seedset_data'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='harvest',
+            name='historical_seeds',
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ui', '0009_remove_harvest_historical_seeds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='overlap_policy',
+            field=models.CharField(default='queue', max_length=20, verbose_name='if the previous harvest is still running', choices=[('queue', 'Harvest anyway'), ('skip', 'Skip the harvest'), ('coalesce', 'Harvest once the previous harvest finishes')]),
+        ),
+        migrations.AddField(
+            model_name='historicalcollection',
+            name='overlap_policy',
+            field=models.CharField(default='queue', max_length=20, verbose_name='if the previous harvest is still running', choices=[('queue', 'Harvest anyway'), ('skip', 'Skip the harvest'), ('coalesce', 'Harvest once the previous harvest finishes')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='harvest',
+            index_together=set([('collection', 'status')]),
+        ),
+    ]
@@ -9,6 +9,7 @@ from django.conf import settings
 
 import uuid
 import datetime
+import hashlib
 import logging
 import json
 
@@ -232,6 +233,14 @@ class Collection(models.Model):
         TUMBLR_BLOG_POSTS: Credential.TUMBLR
     }
     STREAMING_HARVEST_TYPES = (TWITTER_SAMPLE, TWITTER_FILTER)
+    OVERLAP_QUEUE = "queue"
+    OVERLAP_SKIP = "skip"
+    OVERLAP_COALESCE = "coalesce"
+    OVERLAP_CHOICES = [
+        (OVERLAP_QUEUE, 'Harvest anyway'),
+        (OVERLAP_SKIP, 'Skip the harvest'),
+        (OVERLAP_COALESCE, 'Harvest once the previous harvest finishes')
+    ]
     collection_id = models.CharField(max_length=32, unique=True, default=default_uuid)
     collection_set = models.ForeignKey(CollectionSet, related_name='collections')
     credential = models.ForeignKey(Credential, related_name='collections')
@@ -241,6 +250,8 @@ class Collection(models.Model):
     is_active = models.BooleanField(default=False)
     schedule_minutes = models.PositiveIntegerField(default=60 * 24 * 7, choices=SCHEDULE_CHOICES,
                                                    verbose_name="schedule", null=True)
+    overlap_policy = models.CharField(max_length=20, choices=OVERLAP_CHOICES, default=OVERLAP_QUEUE,
+                                      verbose_name="if the previous harvest is still running")
     harvest_options = models.TextField(blank=True)
     date_added = models.DateTimeField(default=timezone.now)
     date_updated = models.DateTimeField(auto_now=True)
@@ -253,7 +264,7 @@ class Collection(models.Model):
     class Meta:
         diff_fields = (
             "collection_set", "credential", "harvest_type", "name", "description", "is_active", "schedule_minutes",
-            "harvest_options", "end_date")
+            "overlap_policy", "harvest_options", "end_date")
 
     def __str__(self):
         return '<Collection %s "%s">' % (self.id, self.name)
@@ -280,6 +291,22 @@ class Collection(models.Model):
         """
         return self.harvests.exclude(harvest_type="web").order_by("-date_requested").first()
 
+    def has_harvest_in_progress(self):
+        """
+        Returns True if a harvest is requested or running.
+
+        Web harvests are excluded, as are harvests requested more than settings.HARVEST_IN_PROGRESS_MAX_HOURS
+        ago, which are assumed to be stuck.
+        """
+        cutoff = timezone.now() - datetime.timedelta(hours=settings.HARVEST_IN_PROGRESS_MAX_HOURS)
+        for harvest_id, date_requested in self.harvests.filter(status__in=(Harvest.REQUESTED, Harvest.RUNNING)) \
+                .exclude(harvest_type="web").values_list("harvest_id", "date_requested"):
+            if date_requested > cutoff:
+                return True
+            log.warning("Ignoring harvest %s of collection %s requested at %s, which is assumed to be stuck",
+                        harvest_id, self.id, date_requested)
+        return False
+
     def is_streaming(self):
         """
         Returns True if a streaming harvest type.
@@ -352,6 +379,28 @@ class Seed(models.Model):
         return "; ".join(labels)
 
 
+class SeedSet(models.Model):
+    """
+    A set of historical seeds that is shared by the harvests of those seeds.
+
+    A seed set is identified by a digest of its historical seeds (see seed_set_digest()),
+    so a new seed set is only created when the seeds of a collection change.
+    """
+    digest = models.CharField(max_length=40, unique=True)
+    historical_seeds = models.ManyToManyField(HistoricalSeed, related_name='seed_sets')
+    date_added = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return '<SeedSet %s "%s">' % (self.id, self.digest)
+
+
+def seed_set_digest(historical_seed_ids):
+    """
+    Returns the digest that identifies the set of historical seeds.
+    """
+    return hashlib.sha1(",".join(str(history_id) for history_id in sorted(historical_seed_ids))).hexdigest()
+
+
 class Harvest(models.Model):
     REQUESTED = "requested"
     SUCCESS = "completed success"
@@ -368,7 +417,7 @@ class Harvest(models.Model):
     harvest_type = models.CharField(max_length=255)
     historical_collection = models.ForeignKey(HistoricalCollection, related_name='historical_harvests', null=True)
     historical_credential = models.ForeignKey(HistoricalCredential, related_name='historical_harvests', null=True)
-    historical_seeds = models.ManyToManyField(HistoricalSeed, related_name='historical_harvests')
+    seed_set = models.ForeignKey(SeedSet, related_name='harvests', null=True, blank=True)
     harvest_id = models.CharField(max_length=32, unique=True, default=default_uuid)
     collection = models.ForeignKey(Collection, related_name='harvests')
     parent_harvest = models.ForeignKey("self", related_name='child_harvests', null=True, blank=True)
@@ -385,12 +434,22 @@ class Harvest(models.Model):
     warcs_count = models.PositiveIntegerField(default=0)
     warcs_bytes = models.BigIntegerField(default=0)
 
+    class Meta:
+        index_together = ("collection", "status")
+
     def __str__(self):
         return '<Harvest %s "%s">' % (self.id, self.harvest_id)
 
     def get_harvest_type_display(self):
         return self.harvest_type.replace("_", " ").capitalize()
 
+    @property
+    def historical_seeds(self):
+        """
+        Returns the historical seeds of the harvest's seed set.
+        """
+        return HistoricalSeed.objects.filter(seed_sets__harvests=self)
+
     def message_count(self):
         return len(self.infos) if self.infos else 0 + len(self.warnings) if self.warnings else 0 + len(
             self.errors) if self.errors else 0
@@ -477,3 +536,55 @@ class Export(models.Model):
 
     def __str__(self):
         return '<Export %s "%s">' % (self.id, self.export_id)
+
+
+class OutboxEmail(models.Model):
+    """
+    An email waiting to be sent by the email sender (see ui.mail).
+    """
+    QUEUED = "queued"
+    SENT = "sent"
+    FAILURE = "failure"
+    STATUS_CHOICES = (
+        (QUEUED, "Queued"),
+        (SENT, "Sent"),
+        (FAILURE, "Failure")
+    )
+    subject = models.TextField()
+    message = models.TextField()
+    recipients = JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    date_added = models.DateTimeField(default=timezone.now)
+    date_next_attempt = models.DateTimeField(default=timezone.now)
+    date_sent = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        index_together = ("status", "date_next_attempt")
+
+    def __str__(self):
+        return '<OutboxEmail %s "%s">' % (self.id, self.subject)
+
+
+class ProcessedMessage(models.Model):
+    """
+    Fingerprint of a message that the message consumer has processed, used to skip redelivered messages.
+    """
+    fingerprint = models.CharField(max_length=40, unique=True)
+    date_added = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return '<ProcessedMessage %s "%s">' % (self.id, self.fingerprint)
+
+
+class OutboxMessage(models.Model):
+    """
+    A message waiting to be published by the message dispatcher (see ui.outbox).
+    """
+    routing_key = models.CharField(max_length=255)
+    message = JSONField()
+    date_added = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return '<OutboxMessage %s "%s">' % (self.id, self.routing_key)
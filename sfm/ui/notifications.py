@@ -13,7 +13,7 @@ from django.core.urlresolvers import reverse
 
 
 from .models import User, CollectionSet, Collection, HarvestStat
-from .sched import next_run_time
+from .sched import next_run_times
 
 log = logging.getLogger(__name__)
 
@@ -86,12 +86,15 @@ def _create_context(user, collection_set_cache):
             collections = collection_set_cache[collection_set]
         else:
             collections = OrderedDict()
-            for collection in Collection.objects.filter(collection_set=collection_set).order_by('name'):
+            collection_objs = list(Collection.objects.filter(collection_set=collection_set).order_by('name'))
+            collection_next_run_times = next_run_times(
+                [collection.id for collection in collection_objs if collection.is_active])
+            for collection in collection_objs:
                 collection_info = {
                     "url": _create_url(reverse('collection_detail', args=(collection.id,)))
                 }
                 if collection.is_active:
-                    collection_info['next_run_time'] = next_run_time(collection.id)
+                    collection_info['next_run_time'] = collection_next_run_times[collection.id]
                     stats = {}
                     # Yesterday
                     _add_stats(stats, 'yesterday', HarvestStat.objects.filter(harvest__collection=collection,
@@ -0,0 +1,50 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import OutboxMessage
+from .rabbit import RabbitWorker
+
+log = logging.getLogger(__name__)
+
+
+def queue_message(message, routing_key):
+    """
+    Queues a message to be published by the message dispatcher.
+
+    The message is written as part of the caller's transaction, so it is only
+    published once the caller's changes (e.g., a new Harvest) are committed.
+    The caller does not wait on RabbitMQ.
+    """
+    log.debug("Queueing message to %s", routing_key)
+    return OutboxMessage.objects.create(routing_key=routing_key, message=message)
+
+
+@transaction.atomic
+def dispatch_messages():
+    """
+    Publishes queued messages in order, in a batch with publisher confirms.
+
+    Published messages are removed from the outbox. Messages that the broker
+    does not confirm are left to be published by a later dispatch. The messages
+    are locked until they are removed, so that concurrent dispatchers (e.g., on
+    several SFM UI nodes) do not publish the same messages.
+    :return: number of messages published
+    """
+    outbox_messages = list(OutboxMessage.objects.select_for_update().order_by("id")[:settings.OUTBOX_DISPATCH_BATCH_SIZE])
+    if not outbox_messages:
+        return 0
+
+    failed_indexes = set(RabbitWorker().publish_messages([(outbox_message.routing_key, outbox_message.message)
+                                                          for outbox_message in outbox_messages]))
+    published_ids = []
+    for index, outbox_message in enumerate(outbox_messages):
+        if index in failed_indexes:
+            log.warn("Message %s to %s not confirmed. Will retry.", outbox_message.id, outbox_message.routing_key)
+        else:
+            published_ids.append(outbox_message.id)
+
+    OutboxMessage.objects.filter(id__in=published_ids).delete()
+    log.debug("Dispatched %s messages", len(published_ids))
+    return len(published_ids)
@@ -1,13 +1,82 @@
 from django.conf import settings
-from kombu import Connection, Exchange
+from kombu import Connection, Exchange, Producer
+from kombu.pools import connections, producers
 from sfmutils.consumer import EXCHANGE
+from collections import OrderedDict
+from itertools import takewhile
 import logging
 import json
+import re
+import socket
 
 log = logging.getLogger(__name__)
 
+# Retry policy for publishing when the connection to RabbitMQ is lost.
+RETRY_POLICY = {
+    "max_retries": 3,
+    "interval_start": 0,
+    "interval_step": 1,
+    "interval_max": 5
+}
+
+# Transports that connect to RabbitMQ. Other transports (e.g., memory) are in-process.
+AMQP_TRANSPORTS = ("librabbitmq", "pyamqp", "amqp")
+TRANSPORT_ALIASES = {
+    "memory": "ui.memory_transport:Transport"
+}
+
+
+# Content types accepted by the message consumer.
+ACCEPT_CONTENT = ["json", "msgpack"]
+
+# Compact encoding for large messages (e.g., harvest requests with many seeds).
+COMPACT_ENCODING = {
+    "serializer": "msgpack",
+    "compression": "zlib"
+}
+
+
+def get_transport():
+    """
+    Returns the kombu transport for settings.RABBITMQ_TRANSPORT.
+    """
+    return TRANSPORT_ALIASES.get(settings.RABBITMQ_TRANSPORT, settings.RABBITMQ_TRANSPORT)
+
+
+def encoding_options(routing_key):
+    """
+    Returns the publish options for encoding a message to routing_key.
+
+    Messages are encoded compactly (see COMPACT_ENCODING) if the routing key matches one of
+    settings.RABBITMQ_COMPACT_ROUTING_KEYS, i.e., the consumers are known to accept it.
+    Otherwise, the default JSON encoding is used.
+    """
+    for pattern in settings.RABBITMQ_COMPACT_ROUTING_KEYS:
+        if re.match(_topic_regex(pattern), routing_key):
+            return COMPACT_ENCODING
+    return {}
+
+
+def _topic_regex(pattern):
+    # Topic exchange pattern: * matches one word, # matches any number of words.
+    return "^{}$".format(r"\.".join("[^.]+" if word == "*" else ".*" if word == "#" else re.escape(word)
+                                     for word in pattern.split(".")))
+
 
 class RabbitWorker:
+    """
+    Publishes messages to the exchange.
+
+    Producers and their connections are taken from kombu's process-wide pools,
+    so connections are reused across messages rather than opened for each one.
+    Connections that have been lost are re-established when publishing.
+
+    For bulk publishing with publisher confirms, use publish_messages().
+
+    The transport is set by settings.RABBITMQ_TRANSPORT. With the "memory"
+    transport, messages are routed by an in-process topic exchange instead of
+    RabbitMQ, which is useful for local runs and tests.
+    """
     def __init__(self):
         self.exchange = Exchange(name=EXCHANGE,
                                  type="topic",
@@ -15,7 +84,17 @@ class RabbitWorker:
 
     @staticmethod
     def get_connection():
-        return Connection(transport="librabbitmq",
+        return Connection(transport=get_transport(),
+                          hostname=settings.RABBITMQ_HOST,
+                          userid=settings.RABBITMQ_USER,
+                          password=settings.RABBITMQ_PASSWORD)
+
+    @staticmethod
+    def get_confirm_connection():
+        if settings.RABBITMQ_TRANSPORT not in AMQP_TRANSPORTS:
+            return RabbitWorker.get_connection()
+        # librabbitmq does not support publisher confirms.
+        return Connection(transport="pyamqp",
                           hostname=settings.RABBITMQ_HOST,
                           userid=settings.RABBITMQ_USER,
                           password=settings.RABBITMQ_PASSWORD)
@@ -29,12 +108,101 @@ class RabbitWorker:
             log.error("Error connecting to RabbitMQ to declare exchange")
 
     def send_message(self, message, routing_key):
-        with self.get_connection() as connection:
-            log.debug("Sending message to %s: %s", routing_key, json.dumps(message, indent=4))
-            connection.Producer(exchange=self.exchange).publish(message, routing_key=routing_key)
+        with producers[self.get_connection()].acquire(block=True) as producer:
+            self._log_message(message, routing_key)
+            self._publish(producer, message, routing_key)
 
     def send_messages(self, messages, routing_key):
-        with self.get_connection() as connection:
+        with producers[self.get_connection()].acquire(block=True) as producer:
             for message in messages:
-                log.debug("Sending message to %s: %s", routing_key, json.dumps(message, indent=4))
-                connection.Producer(exchange=self.exchange).publish(message, routing_key=routing_key)
+                self._log_message(message, routing_key)
+                self._publish(producer, message, routing_key)
+
+    def _publish(self, producer, message, routing_key):
+        producer.publish(message, exchange=self.exchange, routing_key=routing_key, retry=True,
+                         retry_policy=RETRY_POLICY, **encoding_options(routing_key))
+
+    @staticmethod
+    def _log_message(message, routing_key):
+        # Messages may be large, so only serialized when debug logging is enabled.
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Sending message to %s: %s", routing_key, json.dumps(message, indent=4))
+
+    def publish_messages(self, messages, window=None):
+        """
+        Publishes messages with publisher confirms.
+
+        The confirm connection is taken from a process-wide pool, so it is reused across calls.
+        Publishes are pipelined on a single channel. After each window of messages, waits for
+        the broker to confirm them.
+        :param messages: iterable of (routing key, message) pairs
+        :param window: number of unconfirmed messages. Defaults to RABBITMQ_CONFIRM_WINDOW.
+        :return: list of the indexes of the messages that were not confirmed by the broker
+        """
+        if settings.RABBITMQ_TRANSPORT not in AMQP_TRANSPORTS:
+            # In-process transports deliver on publish, so there is nothing to confirm.
+            with producers[self.get_connection()].acquire(block=True) as producer:
+                for routing_key, message in messages:
+                    self._log_message(message, routing_key)
+                    self._publish(producer, message, routing_key)
+            return []
+
+        window = window or settings.RABBITMQ_CONFIRM_WINDOW
+        published_count = 0
+        failed_indexes = []
+        # Map of delivery tag to message index
+        unconfirmed = OrderedDict()
+
+        def on_confirm(delivery_tag, multiple, is_ack):
+            if multiple:
+                delivery_tags = list(takewhile(lambda tag: tag <= delivery_tag, unconfirmed))
+            else:
+                delivery_tags = [delivery_tag]
+            for tag in delivery_tags:
+                index = unconfirmed.pop(tag, None)
+                if not is_ack and index is not None:
+                    failed_indexes.append(index)
+
+        def open_channel():
+            channel = connection.channel()
+            channel.confirm_select()
+            return channel
+
+        with connections[self.get_confirm_connection()].acquire(block=True) as connection:
+            try:
+                connection.ensure_connection(**RETRY_POLICY)
+                # Re-establishes the pooled connection if it has been lost since it was last used.
+                channel = connection.ensure(connection, open_channel, **RETRY_POLICY)
+                try:
+                    channel.events["basic_ack"].add(
+                        lambda delivery_tag, multiple: on_confirm(delivery_tag, multiple, True))
+                    channel.events["basic_nack"].add(
+                        lambda delivery_tag, multiple, requeue: on_confirm(delivery_tag, multiple, False))
+                    producer = Producer(channel, exchange=self.exchange)
+                    for index, (routing_key, message) in enumerate(messages):
+                        producer.publish(message, routing_key=routing_key, **encoding_options(routing_key))
+                        published_count += 1
+                        # The delivery tags of a new channel start at 1.
+                        unconfirmed[published_count] = index
+                        if len(unconfirmed) >= window:
+                            self._wait_for_confirms(connection, unconfirmed, failed_indexes)
+                    self._wait_for_confirms(connection, unconfirmed, failed_indexes)
+                finally:
+                    connection.maybe_close_channel(channel)
+            except connection.connection_errors:
+                # Dropped, so that it is re-established the next time that it is taken from the pool.
+                connection.collect()
+                raise
+
+        log.debug("Published %s messages with %s failures", published_count, len(failed_indexes))
+        return sorted(failed_indexes)
+
+    @staticmethod
+    def _wait_for_confirms(connection, unconfirmed, failed_indexes):
+        try:
+            while unconfirmed:
+                connection.drain_events(timeout=settings.RABBITMQ_CONFIRM_TIMEOUT)
+        except socket.timeout:
+            log.error("Timed out waiting for confirms of %s messages", len(unconfirmed))
+            failed_indexes.extend(unconfirmed.values())
+            unconfirmed.clear()
@@ -1,34 +1,404 @@
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.executors.pool import ThreadPoolExecutor, ProcessPoolExecutor
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.job import Job
+from apscheduler.util import datetime_to_utc_timestamp
+from apscheduler.events import EVENT_SCHEDULER_START, EVENT_JOB_ADDED, EVENT_JOB_MODIFIED, EVENT_JOB_REMOVED, \
+    EVENT_ALL_JOBS_REMOVED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED
 from django.conf import settings
+from django.db.models import Sum
+from sqlalchemy import create_engine, text
+from sqlalchemy import event as sa_event, exc as sa_exc
+from sqlalchemy.pool import NullPool
 import logging
+import cPickle as pickle
 from jobs import collection_harvest, collection_stop
 from models import Collection, Harvest
 import datetime
+import os
+import pytz
+import random
+import threading
+import time
+import zlib
 from utils import diff_field_changed
 from django.core.exceptions import ObjectDoesNotExist
 
 log = logging.getLogger(__name__)
 
-sched = BackgroundScheduler()
+
+class LeaderScheduler(BackgroundScheduler):
+    """
+    A scheduler that only runs jobs while it is the leader (see LeaderElection).
+
+    Jobs can be added, modified and removed whether or not it is the leader.
+    """
+    def __init__(self, *args, **kwargs):
+        BackgroundScheduler.__init__(self, *args, **kwargs)
+        self.is_leader = True
+
+    def _process_jobs(self):
+        if not self.is_leader:
+            # Woken up when elected.
+            return None
+        wait_seconds = BackgroundScheduler._process_jobs(self)
+        if jobs_changed_elsewhere():
+            # Jobs may be changed by the schedulers of other nodes or by jobs run in worker processes.
+            try:
+                job_index.load(self.get_jobs())
+            except Exception:
+                log.exception("Error reloading job index")
+            wait_seconds = min(wait_seconds, settings.SCHEDULER_LEADER_INTERVAL) \
+                if wait_seconds is not None else settings.SCHEDULER_LEADER_INTERVAL
+        return wait_seconds
+
+
+def jobs_changed_elsewhere():
+    """
+    Returns True if the scheduler's jobs may be changed outside of this process, in which case the
+    scheduler checks for changed jobs every settings.SCHEDULER_LEADER_INTERVAL seconds.
+    """
+    return settings.SCHEDULER_LEADER_ELECTION or settings.SCHEDULER_EXECUTOR == "process"
+
+
+sched = LeaderScheduler()
+
+
+class LeaderElection(threading.Thread):
+    """
+    Elects the node whose scheduler runs jobs, using a PostgreSQL advisory lock.
+
+    Every node tries to take the lock every settings.SCHEDULER_LEADER_INTERVAL seconds.
+    The lock is held by the leader's database session, so if the leader's node or its
+    connection to the database is lost, the lock is released and another node takes over.
+    """
+    def __init__(self, scheduler):
+        threading.Thread.__init__(self, name="SchedulerLeaderElection")
+        self.daemon = True
+        self.scheduler = scheduler
+        self.engine = create_engine(settings.SCHEDULER_DB_URL, poolclass=NullPool)
+        self.connection = None
+
+    def run(self):
+        while True:
+            try:
+                self.elect()
+                if not self.scheduler.is_leader:
+                    # Jobs may be changed by the schedulers of other nodes. The leader reloads them when it
+                    # processes its jobs.
+                    job_index.load(self.scheduler.get_jobs())
+            except Exception:
+                log.exception("Error electing scheduler leader")
+                self.resign()
+            time.sleep(settings.SCHEDULER_LEADER_INTERVAL)
+
+    def elect(self):
+        if self.connection is None:
+            self.connection = self.engine.connect()
+        if self.scheduler.is_leader:
+            # Make sure that still holding the lock.
+            self.connection.execute(text("SELECT 1"))
+        elif self.connection.execute(text("SELECT pg_try_advisory_lock(:lock_id)"),
+                                     lock_id=settings.SCHEDULER_LEADER_LOCK_ID).scalar():
+            log.info("Scheduler elected leader")
+            self.scheduler.is_leader = True
+            self.scheduler.wakeup()
+
+    def resign(self):
+        if self.scheduler.is_leader:
+            log.warn("Scheduler no longer leader")
+        self.scheduler.is_leader = False
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+
+class SchedulerMetrics:
+    """
+    Queue depth and latency of the jobs run by the scheduler.
+
+    The queue depth is the number of jobs submitted to the executor that have not finished,
+    including those that are running. The latency of a job is from its scheduled run time until
+    it finishes, so includes the time waiting for the scheduler and the executor.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_logged = time.time()
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.runs = 0
+        self.missed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def job_submitted(self):
+        with self._lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        self.log()
+
+    def job_finished(self):
+        with self._lock:
+            self.queue_depth -= 1
+
+    def job_run(self, scheduled_run_time, now=None):
+        latency = ((now or datetime.datetime.now(pytz.utc)) - scheduled_run_time).total_seconds()
+        with self._lock:
+            self.runs += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+        self.log()
+
+    def job_missed(self):
+        with self._lock:
+            self.missed += 1
+
+    def snapshot(self, reset=False):
+        """
+        Returns a dict of the metrics.
+
+        :param reset: if True, starts new maximums and counts
+        """
+        with self._lock:
+            metrics = {
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "runs": self.runs,
+                "missed": self.missed,
+                "average_latency": self.total_latency / self.runs if self.runs else 0.0,
+                "max_latency": self.max_latency
+            }
+            if reset:
+                self.max_queue_depth = self.queue_depth
+                self.runs = 0
+                self.missed = 0
+                self.total_latency = 0.0
+                self.max_latency = 0.0
+        return metrics
+
+    def log(self):
+        """
+        Logs the metrics since last logged, if settings.SCHEDULER_METRICS_INTERVAL seconds have passed.
+        """
+        with self._lock:
+            if not settings.SCHEDULER_METRICS_INTERVAL or \
+                    time.time() - self._last_logged < settings.SCHEDULER_METRICS_INTERVAL:
+                return
+            self._last_logged = time.time()
+        log.info("Scheduler jobs: queue depth %(queue_depth)s (max %(max_queue_depth)s), %(runs)s run with "
+                 "latency %(average_latency).1fs (max %(max_latency).1fs), %(missed)s missed",
+                 self.snapshot(reset=True))
+
+
+scheduler_metrics = SchedulerMetrics()
+
+
+class _InstrumentedExecutorMixin(object):
+    """
+    Records the jobs submitted to and finished by an executor in scheduler_metrics.
+    """
+    def _do_submit_job(self, job, run_times):
+        scheduler_metrics.job_submitted()
+        try:
+            super(_InstrumentedExecutorMixin, self)._do_submit_job(job, run_times)
+        except Exception:
+            scheduler_metrics.job_finished()
+            raise
+
+    def _run_job_success(self, job_id, events):
+        scheduler_metrics.job_finished()
+        super(_InstrumentedExecutorMixin, self)._run_job_success(job_id, events)
+
+    def _run_job_error(self, job_id, exc, traceback=None):
+        scheduler_metrics.job_finished()
+        super(_InstrumentedExecutorMixin, self)._run_job_error(job_id, exc, traceback=traceback)
+
+
+class InstrumentedThreadPoolExecutor(_InstrumentedExecutorMixin, ThreadPoolExecutor):
+    pass
+
+
+class InstrumentedProcessPoolExecutor(_InstrumentedExecutorMixin, ProcessPoolExecutor):
+    pass
+
+
+class JobIndex:
+    """
+    In-memory index of the triggers and next run times of the scheduler's jobs.
+
+    Kept in sync with the job store by scheduler events, so that next run times can be
+    looked up without querying the job store.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Map of job id to (trigger, next run time)
+        self._jobs = {}
+
+    def load(self, jobs):
+        with self._lock:
+            self._jobs = dict((job.id, (job.trigger, job.next_run_time)) for job in jobs)
+
+    def update(self, job):
+        with self._lock:
+            self._jobs[job.id] = (job.trigger, job.next_run_time)
+
+    def remove(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def next_run_time(self, job_id, now):
+        with self._lock:
+            trigger, run_time = self._jobs.get(job_id, (None, None))
+        # The scheduler advances the next run times of jobs when they are run, without an event.
+        while run_time is not None and run_time < now:
+            run_time = trigger.get_next_fire_time(run_time, now)
+        return run_time
+
+
+job_index = JobIndex()
+
+
+def _on_job_event(event):
+    if event.code == EVENT_SCHEDULER_START:
+        job_index.load(sched.get_jobs())
+    elif event.code == EVENT_ALL_JOBS_REMOVED:
+        job_index.load([])
+    elif event.code == EVENT_JOB_REMOVED:
+        job_index.remove(event.job_id)
+    else:
+        job = sched.get_job(event.job_id)
+        if job is not None:
+            job_index.update(job)
+
+
+def _on_job_run(event):
+    if event.code == EVENT_JOB_MISSED:
+        scheduler_metrics.job_missed()
+    else:
+        scheduler_metrics.job_run(event.scheduled_run_time)
+
+
+def job_defaults():
+    """
+    Returns the options of the scheduler's jobs, from settings.
+    """
+    return {
+        'coalesce': settings.SCHEDULER_COALESCE,
+        'misfire_grace_time': settings.SCHEDULER_MISFIRE_GRACE_TIME,
+        'max_instances': 1
+    }
+
+
+def apply_job_defaults(jobs):
+    """
+    Changes the options of jobs that were scheduled with other options to job_defaults().
+
+    The jobs are modified, but not saved.
+    :param jobs: jobs from the job store
+    :return: list of the changed jobs
+    """
+    defaults = job_defaults()
+    changed_jobs = []
+    for job in jobs:
+        if any(getattr(job, key) != value for key, value in defaults.items()):
+            job._modify(**defaults)
+            changed_jobs.append(job)
+    return changed_jobs
+
+
+# Executor for jobs that read the scheduler's state (e.g., next_run_times()). Always a thread pool, since a
+# worker process forked by the process pool executor has a stale copy of the scheduler and the job index.
+THREAD_EXECUTOR = "thread"
+
+
+def _create_executor():
+    if settings.SCHEDULER_EXECUTOR == "process":
+        return InstrumentedProcessPoolExecutor(max_workers=settings.SCHEDULER_MAX_WORKERS)
+    return InstrumentedThreadPoolExecutor(max_workers=settings.SCHEDULER_MAX_WORKERS)
+
+
+def _create_jobstore():
+    engine = create_engine(settings.SCHEDULER_DB_URL)
+    if settings.SCHEDULER_EXECUTOR == "process":
+        _discard_forked_connections(engine)
+    return SQLAlchemyJobStore(engine=engine)
+
+
+def _discard_forked_connections(engine):
+    """
+    Keeps worker processes forked by the process pool executor from using the pooled connections of the
+    scheduler's process. Jobs (e.g., delayed harvests) may change the scheduler's jobs.
+    """
+    @sa_event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        connection_record.info["pid"] = os.getpid()
+
+    @sa_event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        pid = os.getpid()
+        if connection_record.info["pid"] != pid:
+            # Not closed, since the connection is still used by the scheduler's process.
+            connection_record.connection = connection_proxy.connection = None
+            raise sa_exc.DisconnectionError("Connection record belongs to pid {}, attempting to check out in pid {}"
+                                         .format(connection_record.info["pid"], pid))
 
 
 def start_sched():
+    # Existing jobs keep the options that they were scheduled with.
+    jobstore = open_jobstore()
+    try:
+        for job in apply_job_defaults(jobstore.get_all_jobs()):
+            jobstore.update_job(job)
+    finally:
+        jobstore.shutdown()
+
     sched.configure(jobstores={
-        'default': SQLAlchemyJobStore(url=settings.SCHEDULER_DB_URL)
-    })
+        'default': _create_jobstore()
+    }, executors={
+        'default': _create_executor(),
+        THREAD_EXECUTOR: InstrumentedThreadPoolExecutor(max_workers=1)
+    }, job_defaults=job_defaults())
+    sched.add_listener(_on_job_event, EVENT_SCHEDULER_START | EVENT_JOB_ADDED | EVENT_JOB_MODIFIED |
+                       EVENT_JOB_REMOVED | EVENT_ALL_JOBS_REMOVED)
+    sched.add_listener(_on_job_run, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+    if settings.ADAPTIVE_SCHEDULE:
+        sched.add_listener(_on_job_executed, EVENT_JOB_EXECUTED)
+    if settings.SCHEDULER_LEADER_ELECTION:
+        sched.is_leader = False
     log.info("Starting scheduler")
     sched.start()
+    if settings.SCHEDULER_LEADER_ELECTION:
+        LeaderElection(sched).start()
     return sched
 
 
+def open_jobstore():
+    """
+    Returns the scheduler's job store, for modifying jobs from a process that is not running the scheduler.
+
+    The caller should shut down the job store when done.
+    """
+    jobstore = SQLAlchemyJobStore(url=settings.SCHEDULER_DB_URL)
+    jobstore.start(sched, 'default')
+    return jobstore
+
+
 def next_run_time(collection_pk):
-    job_id = _job_id(collection_pk)
-    job = sched.get_job(job_id)
-    if job:
-        return job.next_run_time
-    else:
-        return None
+    return next_run_times([collection_pk])[collection_pk]
+
+
+def next_run_times(collection_pks):
+    """
+    Returns a map of collection pk to the next run time of its harvest (or None), from the job index.
+    """
+    now = datetime.datetime.now(sched.timezone)
+    return dict((collection_pk, job_index.next_run_time(_job_id(collection_pk), now))
+                for collection_pk in collection_pks)
 
 
 def _job_id(collection_pk):
@@ -39,6 +409,24 @@ def _end_job_id(collection_pk):
     return "end_{}".format(collection_pk)
 
 
+def _delayed_job_id(collection_pk):
+    return "delayed_{}".format(collection_pk)
+
+
+def delay_harvest(collection_pk, seconds):
+    """
+    Schedules a one-off harvest of the collection, replacing a delayed harvest that is already scheduled.
+    """
+    log.debug("Scheduling delayed harvest for collection %s in %s seconds", collection_pk, seconds)
+    sched.add_job(collection_harvest,
+                  args=[collection_pk],
+                  id=_delayed_job_id(collection_pk),
+                  name="Delayed harvest for collection {}".format(collection_pk),
+                  trigger='date',
+                  run_date=datetime.datetime.now() + datetime.timedelta(seconds=seconds),
+                  replace_existing=True)
+
+
 def unschedule_harvest(collection_pk):
     _unschedule_job(_job_id(collection_pk))
     _unschedule_job(_end_job_id(collection_pk))
@@ -62,12 +450,29 @@ def toggle_collection_inactive(collection_id):
     collection.save()
 
 
+def stagger_start_date(collection_pk, schedule_minutes, start_date=None):
+    """
+    Returns the start date for an interval harvest, offset so that harvests are spread over their interval.
+
+    The offset is determined by the collection, so harvests of collections created together
+    (e.g., by a bulk import) do not all start at once. It is within the interval, but not more than
+    settings.SCHEDULE_STAGGER_MAX_MINUTES. Up to settings.SCHEDULE_JITTER_SECONDS are added at random.
+    """
+    start_date = start_date or datetime.datetime.now()
+    window_seconds = min(schedule_minutes, settings.SCHEDULE_STAGGER_MAX_MINUTES) * 60
+    offset_seconds = zlib.crc32(_job_id(collection_pk)) % window_seconds if window_seconds else 0
+    if settings.SCHEDULE_JITTER_SECONDS:
+        offset_seconds += random.randint(0, settings.SCHEDULE_JITTER_SECONDS)
+    return start_date + datetime.timedelta(seconds=offset_seconds)
+
+
 def schedule_harvest(collection_pk, is_active, schedule_minutes, start_date=None, end_date=None):
     assert schedule_minutes
 
     unschedule_harvest(collection_pk)
     log.debug("Collection %s is active = %s", collection_pk, is_active)
     if is_active:
+        start_date = stagger_start_date(collection_pk, schedule_minutes, start_date=start_date)
         name = "Harvest ({}) for collection {}".format(schedule_minutes, collection_pk)
         log.debug("Scheduling job %s", name)
         sched.add_job(collection_harvest,
@@ -89,6 +494,189 @@ def schedule_harvest(collection_pk, is_active, schedule_minutes, start_date=None
                           run_date=end_date)
 
 
+def rebalance_harvests(jobs, now=None):
+    """
+    Spreads the interval harvest jobs evenly over their intervals.
+
+    Jobs with the same interval are given start dates evenly spaced over the interval,
+    in the order of their next run times. The jobs are modified, but not saved.
+    :param jobs: jobs from the job store
+    :return: list of the rebalanced jobs
+    """
+    now = now or datetime.datetime.now(sched.timezone)
+    # Map of interval to jobs
+    interval_jobs = {}
+    for job in jobs:
+        if job.func == collection_harvest and isinstance(job.trigger, IntervalTrigger) and job.next_run_time:
+            interval_jobs.setdefault(job.trigger.interval, []).append(job)
+
+    rebalanced_jobs = []
+    for interval, jobs in interval_jobs.items():
+        jobs.sort(key=lambda j: j.next_run_time)
+        for i, job in enumerate(jobs):
+            start_date = now + datetime.timedelta(seconds=15) + interval * i // len(jobs)
+            trigger = IntervalTrigger(seconds=int(interval.total_seconds()), start_date=start_date,
+                                      end_date=job.trigger.end_date, timezone=job.trigger.timezone)
+            job._modify(trigger=trigger, next_run_time=trigger.get_next_fire_time(None, now))
+            rebalanced_jobs.append(job)
+    return rebalanced_jobs
+
+
+def reconcile_harvests(jobs, collections, now=None):
+    """
+    Compares the harvest jobs with the active collections.
+
+    Interval harvest jobs are missing if an active collection does not have one, and changed if
+    the interval (allowing for the adaptive schedule) or end date does not match the collection's.
+    Jobs for collections that are not active are orphaned. The jobs of streaming collections
+    are started and stopped by their harvests, so only their end jobs are compared.
+    :param jobs: jobs from the job store
+    :param collections: dicts of the id, harvest_type, schedule_minutes and end_date of the active collections
+    :return: tuple of new jobs to add, new jobs to replace changed jobs and ids of orphaned jobs to remove
+    """
+    now = now or datetime.datetime.now(sched.timezone)
+    job_map = dict((job.id, job) for job in jobs)
+    collection_map = dict((collection["id"], collection) for collection in collections)
+    added_jobs = []
+    replaced_jobs = []
+    removed_job_ids = []
+
+    for job_id, job in job_map.items():
+        collection_pk = job_id.rsplit("_", 1)[-1]
+        if collection_pk.isdigit() and int(collection_pk) not in collection_map:
+            removed_job_ids.append(job_id)
+
+    for collection_pk, collection in collection_map.items():
+        end_date = collection["end_date"]
+        schedule_minutes = collection["schedule_minutes"]
+        if collection["harvest_type"] not in Collection.STREAMING_HARVEST_TYPES and schedule_minutes:
+            job = job_map.get(_job_id(collection_pk))
+            if job is None or not isinstance(job.trigger, IntervalTrigger):
+                (added_jobs if job is None else replaced_jobs).append(
+                    _harvest_job(collection_pk, schedule_minutes, end_date, now))
+            elif not _interval_matches(job.trigger.interval, schedule_minutes) or job.trigger.end_date != end_date:
+                replaced_jobs.append(_harvest_job(collection_pk, schedule_minutes, end_date, now))
+
+        end_job = job_map.get(_end_job_id(collection_pk))
+        if end_date is None:
+            if end_job is not None:
+                removed_job_ids.append(end_job.id)
+        elif end_job is None:
+            added_jobs.append(_end_job(collection_pk, end_date, now))
+        elif not isinstance(end_job.trigger, DateTrigger) or end_job.trigger.run_date != end_date:
+            replaced_jobs.append(_end_job(collection_pk, end_date, now))
+
+    return added_jobs, replaced_jobs, removed_job_ids
+
+
+def _interval_matches(interval, schedule_minutes):
+    if settings.ADAPTIVE_SCHEDULE:
+        # In seconds, since a timedelta can't be multiplied by a float
+        schedule_seconds = schedule_minutes * 60
+        return schedule_seconds * settings.ADAPTIVE_SCHEDULE_MIN_FACTOR <= interval.total_seconds() <= \
+            schedule_seconds * settings.ADAPTIVE_SCHEDULE_MAX_FACTOR
+    return interval == datetime.timedelta(minutes=schedule_minutes)
+
+
+def _harvest_job(collection_pk, schedule_minutes, end_date, now):
+    start_date = stagger_start_date(collection_pk, schedule_minutes,
+                                    start_date=now + datetime.timedelta(seconds=15))
+    trigger = IntervalTrigger(minutes=schedule_minutes, start_date=start_date, end_date=end_date,
+                              timezone=sched.timezone)
+    return _new_job(collection_harvest, collection_pk, _job_id(collection_pk),
+                    "Harvest ({}) for collection {}".format(schedule_minutes, collection_pk), trigger, now)
+
+
+def _end_job(collection_pk, end_date, now):
+    return _new_job(toggle_collection_inactive, collection_pk, _end_job_id(collection_pk),
+                    "End harvest for collection {}".format(collection_pk),
+                    DateTrigger(run_date=end_date, timezone=sched.timezone), now)
+
+
+def _new_job(func, collection_pk, job_id, name, trigger, now):
+    job_kwargs = job_defaults()
+    job_kwargs.update(func=func, args=(collection_pk,), kwargs={}, trigger=trigger, executor="default",
+                      name=name, next_run_time=trigger.get_next_fire_time(None, now))
+    return Job(sched, id=job_id, **job_kwargs)
+
+
+def save_reconciled_jobs(jobstore, added_jobs, replaced_jobs, removed_job_ids):
+    """
+    Saves the result of reconcile_harvests() to the job store in a single transaction.
+
+    The jobs are deleted and inserted in bulk, rather than one at a time through the job store.
+    """
+    new_jobs = added_jobs + replaced_jobs
+    with jobstore.engine.begin() as connection:
+        delete_job_ids = removed_job_ids + [job.id for job in new_jobs]
+        if delete_job_ids:
+            connection.execute(jobstore.jobs_t.delete().where(jobstore.jobs_t.c.id.in_(delete_job_ids)))
+        if new_jobs:
+            connection.execute(jobstore.jobs_t.insert(), [{
+                'id': job.id,
+                'next_run_time': datetime_to_utc_timestamp(job.next_run_time),
+                'job_state': pickle.dumps(job.__getstate__(), jobstore.pickle_protocol)
+            } for job in new_jobs])
+
+
+def _on_job_executed(event):
+    # Only interval harvests have numeric job ids.
+    if event.job_id.isdigit():
+        try:
+            adapt_harvest_interval(int(event.job_id))
+        except Exception:
+            log.exception("Error adapting harvest interval of job %s", event.job_id)
+
+
+def adaptive_interval(collection, interval_minutes):
+    """
+    Returns the interval in minutes for harvests of the collection, based on the items collected by its recent harvests.
+
+    If the last settings.ADAPTIVE_SCHEDULE_WINDOW successful harvests averaged fewer than
+    settings.ADAPTIVE_SCHEDULE_QUIET_ITEMS items, the interval is doubled (up to
+    settings.ADAPTIVE_SCHEDULE_MAX_FACTOR times the collection's schedule). If they averaged at least
+    settings.ADAPTIVE_SCHEDULE_BUSY_ITEMS items, it is halved (down to settings.ADAPTIVE_SCHEDULE_MIN_FACTOR
+    times the collection's schedule). Otherwise, the collection's schedule is used.
+    :param collection: the collection
+    :param interval_minutes: the current interval in minutes
+    """
+    window = settings.ADAPTIVE_SCHEDULE_WINDOW
+    item_counts = list(collection.harvests.filter(status=Harvest.SUCCESS).exclude(harvest_type="web").order_by(
+        "-date_requested").annotate(items=Sum("harvest_stats__count")).values_list("items", flat=True)[:window])
+    if len(item_counts) < window:
+        return interval_minutes
+
+    average_items = float(sum(items or 0 for items in item_counts)) / window
+    if average_items < settings.ADAPTIVE_SCHEDULE_QUIET_ITEMS:
+        return int(min(interval_minutes * 2, collection.schedule_minutes * settings.ADAPTIVE_SCHEDULE_MAX_FACTOR))
+    if average_items >= settings.ADAPTIVE_SCHEDULE_BUSY_ITEMS:
+        return int(max(interval_minutes // 2, collection.schedule_minutes * settings.ADAPTIVE_SCHEDULE_MIN_FACTOR, 1))
+    return collection.schedule_minutes
+
+
+def adapt_harvest_interval(collection_pk):
+    """
+    Reschedules the interval harvest of the collection if its adaptive interval has changed.
+    """
+    job = sched.get_job(_job_id(collection_pk))
+    if job is None or not isinstance(job.trigger, IntervalTrigger):
+        return
+    try:
+        collection = Collection.objects.get(pk=collection_pk)
+    except ObjectDoesNotExist:
+        return
+    interval_minutes = int(job.trigger.interval.total_seconds()) // 60
+    new_interval_minutes = adaptive_interval(collection, interval_minutes)
+    if new_interval_minutes != interval_minutes:
+        log.info("Changing harvest interval of collection %s from %s to %s minutes", collection_pk,
+                 interval_minutes, new_interval_minutes)
+        sched.reschedule_job(job.id,
+                             trigger='interval',
+                             minutes=new_interval_minutes,
+                             start_date=datetime.datetime.now() + datetime.timedelta(minutes=new_interval_minutes),
+                             end_date=job.trigger.end_date)
+
+
 def schedule_stream_harvest(collection_pk, is_active, start_date=None, end_date=None, last_harvest_status=None):
     unschedule_harvest(collection_pk)
 
@@ -0,0 +1,63 @@
+from django.test import TestCase, override_settings
+from django.utils import timezone
+import datetime
+import json
+from .admission import credential_harvest_delay
+from .models import Collection, CollectionSet, Credential, Group, User, Harvest
+
+
+class CredentialHarvestDelayTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_superuser(username="test_user", email="test_user@test.com",
+                                             password="test_password")
+        group = Group.objects.create(name="test_group")
+        collection_set = CollectionSet.objects.create(group=group, name="test_collection_set")
+        self.credential = Credential.objects.create(user=user, platform="test_platform",
+                                                    token=json.dumps({"key": "test_key"}))
+        self.collection = Collection.objects.create(collection_set=collection_set, credential=self.credential,
+                                                    harvest_type=Collection.TWITTER_USER_TIMELINE,
+                                                    name="test_collection", is_active=True)
+        self.stream_collection = Collection.objects.create(collection_set=collection_set,
+                                                           credential=self.credential,
+                                                           harvest_type=Collection.TWITTER_SAMPLE,
+                                                           name="test_stream_collection", is_active=True)
+        self.now = timezone.now()
+
+    def _harvest(self, collection, status=Harvest.SUCCESS, minutes_ago=0):
+        historical_collection = collection.history.all()[0]
+        return Harvest.objects.create(harvest_type=collection.harvest_type, collection=collection,
+                                      historical_collection=historical_collection,
+                                      historical_credential=self.credential.history.all()[0], status=status,
+                                      date_requested=self.now - datetime.timedelta(minutes=minutes_ago))
+
+    def test_no_budget(self):
+        self._harvest(self.collection, status=Harvest.RUNNING)
+        with self.assertNumQueries(0):
+            self.assertEqual(0, credential_harvest_delay(self.credential.id, now=self.now))
+
+    @override_settings(CREDENTIAL_MAX_CONCURRENT_HARVESTS=2, CREDENTIAL_HARVEST_DELAY_SECONDS=60)
+    def test_concurrent_harvests(self):
+        self._harvest(self.collection, status=Harvest.RUNNING)
+        self._harvest(self.collection, status=Harvest.SUCCESS)
+        # Streaming harvests are not counted.
+        self._harvest(self.stream_collection, status=Harvest.RUNNING)
+        self.assertEqual(0, credential_harvest_delay(self.credential.id, now=self.now))
+
+        self._harvest(self.collection, status=Harvest.REQUESTED)
+        self.assertEqual(60, credential_harvest_delay(self.credential.id, now=self.now))
+
+    @override_settings(CREDENTIAL_MAX_CONCURRENT_HARVESTS=1, CREDENTIAL_CONCURRENT_HARVEST_MAX_HOURS=24)
+    def test_stuck_harvests(self):
+        # Running for more than a day, so assumed to be stuck.
+        self._harvest(self.collection, status=Harvest.RUNNING, minutes_ago=25 * 60)
+        self.assertEqual(0, credential_harvest_delay(self.credential.id, now=self.now))
+
+    @override_settings(CREDENTIAL_MAX_RECENT_HARVESTS=2, CREDENTIAL_HARVEST_WINDOW_MINUTES=15)
+    def test_recent_harvests(self):
+        self._harvest(self.collection, minutes_ago=20)
+        self._harvest(self.collection, minutes_ago=10)
+        self.assertEqual(0, credential_harvest_delay(self.credential.id, now=self.now))
+
+        self._harvest(self.collection, minutes_ago=5)
+        # Until the harvest from 10 minutes ago is out of the window
+        self.assertEqual(5 * 60 + 1, credential_harvest_delay(self.credential.id, now=self.now))
@@ -1,8 +1,7 @@
 from django.test import TestCase
-from mock import MagicMock, patch
+from mock import patch
 from .export import request_export
 from .models import Collection, CollectionSet, Seed, Credential, Group, User, Export
-from .rabbit import RabbitWorker
 import datetime
 from tzlocal import get_localzone
 import iso8601
@@ -22,11 +21,8 @@ class ExportTests(TestCase):
         self.seed1 = Seed.objects.create(collection=self.collection, uid="test_uid")
         self.seed2 = Seed.objects.create(collection=self.collection, uid="test_uid2")
 
-    @patch("ui.export.RabbitWorker", autospec=True)
-    def test_collection_export(self, mock_rabbit_worker_class):
-        mock_rabbit_worker = MagicMock(spec=RabbitWorker)
-        mock_rabbit_worker_class.side_effect = [mock_rabbit_worker]
-
+    @patch("ui.export.queue_message")
+    def test_collection_export(self, mock_queue_message):
         export = Export.objects.create(user=self.user,
                                        export_type="test_type",
                                        export_format="json",
@@ -41,8 +37,7 @@ class ExportTests(TestCase):
         request_export(export)
 
         # Export start message sent
-        name, args, kwargs = mock_rabbit_worker.mock_calls[0]
-        self.assertEqual("send_message", name)
+        args, kwargs = mock_queue_message.call_args
         message = args[0]
         self.assertEqual(message["id"], export.export_id)
         self.assertEqual(message["path"], export.path)
@@ -56,11 +51,8 @@ class ExportTests(TestCase):
         self.assertEqual(message["collection"]["id"], export.collection.collection_id)
         self.assertEqual("export.start.test_platform.test_type", args[1])
 
-    @patch("ui.export.RabbitWorker", autospec=True)
-    def test_seed_export(self, mock_rabbit_worker_class):
-        mock_rabbit_worker = MagicMock(spec=RabbitWorker)
-        mock_rabbit_worker_class.side_effect = [mock_rabbit_worker]
-
+    @patch("ui.export.queue_message")
+    def test_seed_export(self, mock_queue_message):
         export = Export.objects.create(user=self.user,
                                        export_type="test_type")
         export.seeds.add(self.seed1)
@@ -70,8 +62,7 @@ class ExportTests(TestCase):
         request_export(export)
 
         # Export start message sent
-        name, args, kwargs = mock_rabbit_worker.mock_calls[0]
-        self.assertEqual("send_message", name)
+        args, kwargs = mock_queue_message.call_args
         message = args[0]
         self.assertEqual(message["id"], export.export_id)
         self.assertEqual(message["path"], export.path)
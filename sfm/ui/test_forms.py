@@ -111,7 +111,8 @@ class CollectionFormTest(TestCase):
             'name': 'my test collection',
             'end_date': '01/01/2200',
             'date_added': '03/16/2016',
-            'schedule_minutes': '60'
+            'schedule_minutes': '60',
+            'overlap_policy': 'queue'
         }
 
     def test_valid_form(self):
@@ -1,10 +1,13 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+import datetime
 import json
-from mock import MagicMock, patch
-from .jobs import collection_harvest, collection_stop
-from .models import Collection, CollectionSet, Seed, Credential, Group, User, Harvest
-from .rabbit import RabbitWorker
+from mock import patch
+from .jobs import collection_harvest, collection_stop, latest_historical_seeds
+from .models import Collection, CollectionSet, Seed, Credential, Group, User, Harvest, SeedSet
 
 
 class StartJobsTests(TestCase):
@@ -18,8 +21,8 @@ class StartJobsTests(TestCase):
                                                     token=json.dumps(self.credential_token))
         self.harvest_options = {"test_option": "test_value"}
 
-    @patch("ui.jobs.RabbitWorker", autospec=True)
-    def test_collection_harvest(self, mock_rabbit_worker_class):
+    @patch("ui.jobs.queue_message")
+    def test_collection_harvest(self, mock_queue_message):
         collection = Collection.objects.create(collection_set=self.collection_set, credential=self.credential,
                                                harvest_type=Collection.TWITTER_USER_TIMELINE, name="test_collection",
                                                harvest_options=json.dumps(self.harvest_options), is_active=True)
@@ -29,14 +32,10 @@ class StartJobsTests(TestCase):
         # Creating Inactive seed which will be ignored from harvest
         Seed.objects.create(collection=collection, uid="test_uid4", seed_id="4", is_active=False)
 
-        mock_rabbit_worker = MagicMock(spec=RabbitWorker)
-        mock_rabbit_worker_class.side_effect = [mock_rabbit_worker]
-
         collection_harvest(collection.id)
 
         # Harvest start message sent
-        name, args, kwargs = mock_rabbit_worker.mock_calls[0]
-        self.assertEqual("send_message", name)
+        args, kwargs = mock_queue_message.call_args
         message = args[0]
         self.assertTrue(message["collection_set"]["id"])
         self.assertEqual(
@@ -58,29 +57,184 @@ class StartJobsTests(TestCase):
         self.assertEqual(Harvest.REQUESTED, harvest.status)
         self.assertEqual(Collection.TWITTER_USER_TIMELINE, harvest.harvest_type)
 
-    @patch("ui.jobs.RabbitWorker", autospec=True)
-    def test_missing_collection_harvest(self, mock_rabbit_worker_class):
-        mock_rabbit_worker = MagicMock(spec=RabbitWorker)
-        mock_rabbit_worker_class.side_effect = [mock_rabbit_worker]
+    def test_latest_historical_seeds(self):
+        collection = Collection.objects.create(collection_set=self.collection_set, credential=self.credential,
+                                               harvest_type=Collection.TWITTER_USER_TIMELINE, name="test_collection",
+                                               harvest_options=json.dumps(self.harvest_options), is_active=True)
+        seed1 = Seed.objects.create(collection=collection, token="test_token1", seed_id="1")
+        seed2 = Seed.objects.create(collection=collection, uid="test_uid2", seed_id="2")
+        seed3 = Seed.objects.create(collection=collection, uid="test_uid3", seed_id="3")
+        seed4 = Seed.objects.create(collection=collection, uid="test_uid4", seed_id="4")
+        seed1.token = "test_token1b"
+        seed1.save()
+        seed3.is_active = False
+        seed3.save()
+        seed4.delete()
+
+        with self.assertNumQueries(1):
+            historical_seeds = latest_historical_seeds(collection)
+        self.assertListEqual([seed1.id, seed2.id], [historical_seed.id for historical_seed in historical_seeds])
+        self.assertEqual("test_token1b", historical_seeds[0].token)
+        self.assertEqual(seed1.history.all()[0].history_id, historical_seeds[0].history_id)
+
+    @patch("ui.jobs.queue_message")
+    def test_seed_sets(self, mock_queue_message):
+        collection = Collection.objects.create(collection_set=self.collection_set, credential=self.credential,
+                                               harvest_type=Collection.TWITTER_USER_TIMELINE, name="test_collection",
+                                               harvest_options=json.dumps(self.harvest_options), is_active=True)
+        seed1 = Seed.objects.create(collection=collection, token="test_token1", seed_id="1")
+        Seed.objects.create(collection=collection, uid="test_uid2", seed_id="2")
+
+        collection_harvest(collection.id)
+        collection_harvest(collection.id)
+        # Seeds not changed, so harvests share a seed set.
+        harvest1, harvest2 = Harvest.objects.order_by("id")
+        self.assertEqual(1, SeedSet.objects.count())
+        self.assertEqual(harvest1.seed_set, harvest2.seed_set)
+        self.assertSetEqual(set(["1", "2"]), set(harvest1.historical_seeds.values_list("seed_id", flat=True)))
+
+        seed1.token = "test_token1b"
+        seed1.save()
+        collection_harvest(collection.id)
+        # Seed changed, so new seed set.
+        harvest3 = Harvest.objects.order_by("-id")[0]
+        self.assertEqual(2, SeedSet.objects.count())
+        self.assertNotEqual(harvest1.seed_set, harvest3.seed_set)
+        self.assertSetEqual(set(["test_token1", ""]), set(harvest1.historical_seeds.values_list("token", flat=True)))
+        self.assertSetEqual(set(["test_token1b", ""]),
+                            set(harvest3.historical_seeds.values_list("token", flat=True)))
+
+    @patch("ui.jobs.queue_message")
+    def test_collection_harvest_queries(self, mock_queue_message):
+        collection = Collection.objects.create(collection_set=self.collection_set, credential=self.credential,
+                                               harvest_type=Collection.TWITTER_USER_TIMELINE, name="test_collection",
+                                               harvest_options=json.dumps(self.harvest_options), is_active=True)
+        for i in range(3):
+            Seed.objects.create(collection=collection, uid="test_uid{}".format(i), seed_id=str(i))
+        with CaptureQueriesContext(connection) as queries:
+            collection_harvest(collection.id)
+
+        for i in range(3, 30):
+            Seed.objects.create(collection=collection, uid="test_uid{}".format(i), seed_id=str(i))
+        with CaptureQueriesContext(connection) as more_seeds_queries:
+            collection_harvest(collection.id)
+
+        # Number of queries does not depend on the number of seeds.
+        self.assertEqual(len(queries), len(more_seeds_queries))
+        self.assertEqual(30, len(mock_queue_message.call_args[0][0]["seeds"]))
+
+    @override_settings(CREDENTIAL_MAX_CONCURRENT_HARVESTS=1, CREDENTIAL_HARVEST_DELAY_SECONDS=60)
+    @patch("ui.sched.delay_harvest")
+    @patch("ui.jobs.queue_message")
+    def test_delayed_collection_harvest(self, mock_queue_message, mock_delay_harvest):
+        collection = Collection.objects.create(collection_set=self.collection_set, credential=self.credential,
+                                               harvest_type=Collection.TWITTER_USER_TIMELINE, name="test_collection",
+                                               harvest_options=json.dumps(self.harvest_options), is_active=True)
+        Seed.objects.create(collection=collection, uid="test_uid1", seed_id="1")
+
+        collection_harvest(collection.id)
+        self.assertEqual(1, mock_queue_message.call_count)
+        mock_delay_harvest.assert_not_called()
+
+        # Credential over budget while first harvest is requested
+        collection_harvest(collection.id)
+        self.assertEqual(1, mock_queue_message.call_count)
+        mock_delay_harvest.assert_called_once_with(collection.id, 60)
+        self.assertEqual(1, Harvest.objects.count())
+
+    @patch("ui.sched.delay_harvest")
+    @patch("ui.jobs.queue_message")
+    def test_skip_overlapping_collection_harvest(self, mock_queue_message, mock_delay_harvest):
+        collection = Collection.objects.create(collection_set=self.collection_set, credential=self.credential,
+                                               harvest_type=Collection.TWITTER_USER_TIMELINE, name="test_collection",
+                                               harvest_options=json.dumps(self.harvest_options), is_active=True,
+                                               overlap_policy=Collection.OVERLAP_SKIP)
+        Seed.objects.create(collection=collection, uid="test_uid1", seed_id="1")
 
+        collection_harvest(collection.id)
+        self.assertEqual(1, mock_queue_message.call_count)
+
+        # Skipped while first harvest is requested
+        collection_harvest(collection.id)
+        self.assertEqual(1, mock_queue_message.call_count)
+        mock_delay_harvest.assert_not_called()
+        self.assertEqual(1, Harvest.objects.count())
+
+        # Harvested once first harvest is finished
+        Harvest.objects.update(status=Harvest.SUCCESS)
+        collection_harvest(collection.id)
+        self.assertEqual(2, mock_queue_message.call_count)
+
+    @override_settings(HARVEST_IN_PROGRESS_MAX_HOURS=24)
+    @patch("ui.sched.delay_harvest")
+    @patch("ui.jobs.queue_message")
+    def test_stuck_overlapping_collection_harvest(self, mock_queue_message, mock_delay_harvest):
+        collection = Collection.objects.create(collection_set=self.collection_set, credential=self.credential,
+                                               harvest_type=Collection.TWITTER_USER_TIMELINE, name="test_collection",
+                                               harvest_options=json.dumps(self.harvest_options), is_active=True,
+                                               overlap_policy=Collection.OVERLAP_SKIP)
+        Seed.objects.create(collection=collection, uid="test_uid1", seed_id="1")
+
+        collection_harvest(collection.id)
+        self.assertEqual(1, mock_queue_message.call_count)
+
+        # First harvest is stuck, so is ignored.
+        Harvest.objects.update(status=Harvest.RUNNING, date_requested=timezone.now() - datetime.timedelta(hours=25))
+        with patch("ui.models.log") as mock_log:
+            collection_harvest(collection.id)
+        self.assertEqual(1, mock_log.warning.call_count)
+        self.assertEqual(2, mock_queue_message.call_count)
+        mock_delay_harvest.assert_not_called()
+        self.assertEqual(2, Harvest.objects.count())
+
+    @override_settings(HARVEST_OVERLAP_RETRY_SECONDS=60)
+    @patch("ui.sched.delay_harvest")
+    @patch("ui.jobs.queue_message")
+    def test_coalesce_overlapping_collection_harvest(self, mock_queue_message, mock_delay_harvest):
+        collection = Collection.objects.create(collection_set=self.collection_set, credential=self.credential,
+                                               harvest_type=Collection.TWITTER_USER_TIMELINE, name="test_collection",
+                                               harvest_options=json.dumps(self.harvest_options), is_active=True,
+                                               overlap_policy=Collection.OVERLAP_COALESCE)
+        Seed.objects.create(collection=collection, uid="test_uid1", seed_id="1")
+
+        collection_harvest(collection.id)
+        self.assertEqual(1, mock_queue_message.call_count)
+
+        # Delayed while first harvest is running
+        Harvest.objects.update(status=Harvest.RUNNING)
+        collection_harvest(collection.id)
+        self.assertEqual(1, mock_queue_message.call_count)
+        mock_delay_harvest.assert_called_once_with(collection.id, 60)
+        self.assertEqual(1, Harvest.objects.count())
+
+    @patch("ui.jobs.queue_message")
+    def test_queue_overlapping_collection_harvest(self, mock_queue_message):
+        collection = Collection.objects.create(collection_set=self.collection_set, credential=self.credential,
+                                               harvest_type=Collection.TWITTER_USER_TIMELINE, name="test_collection",
+                                               harvest_options=json.dumps(self.harvest_options), is_active=True)
+        Seed.objects.create(collection=collection, uid="test_uid1", seed_id="1")
+
+        collection_harvest(collection.id)
+        collection_harvest(collection.id)
+        self.assertEqual(2, mock_queue_message.call_count)
+        self.assertEqual(2, Harvest.objects.count())
+
+    @patch("ui.jobs.queue_message")
+    def test_missing_collection_harvest(self, mock_queue_message):
         # Error should be logged and nothing happens
         collection_harvest(1234567)
-        mock_rabbit_worker.assert_not_called()
+        self.assertFalse(mock_queue_message.called)
 
-    @patch("ui.jobs.RabbitWorker", autospec=True)
-    def test_collection_without_seeds_harvest(self, mock_rabbit_worker_class):
+    @patch("ui.jobs.queue_message")
+    def test_collection_without_seeds_harvest(self, mock_queue_message):
         collection = Collection.objects.create(collection_set=self.collection_set, credential=self.credential,
                                          harvest_type=Collection.TWITTER_SAMPLE, name="test_collection",
                                          harvest_options=json.dumps(self.harvest_options), is_active=True)
 
-        mock_rabbit_worker = MagicMock(spec=RabbitWorker)
-        mock_rabbit_worker_class.side_effect = [mock_rabbit_worker]
-
         collection_harvest(collection.id)
 
         # Harvest start message sent
-        name, args, kwargs = mock_rabbit_worker.mock_calls[0]
-        self.assertEqual("send_message", name)
+        args, kwargs = mock_queue_message.call_args
         message = args[0]
         self.assertTrue(message["collection_set"]["id"])
         self.assertEqual(
@@ -99,32 +253,26 @@ class StartJobsTests(TestCase):
         self.assertEqual(collection, harvest.collection)
         self.assertEqual(Harvest.REQUESTED, harvest.status)
 
-    @patch("ui.jobs.RabbitWorker", autospec=True)
-    def test_missing_seeds(self, mock_rabbit_worker_class):
+    @patch("ui.jobs.queue_message")
+    def test_missing_seeds(self, mock_queue_message):
         collection = Collection.objects.create(collection_set=self.collection_set, credential=self.credential,
                                                harvest_type=Collection.TWITTER_USER_TIMELINE, name="test_collection",
                                                harvest_options=json.dumps(self.harvest_options), is_active=True)
 
-        mock_rabbit_worker = MagicMock(spec=RabbitWorker)
-        mock_rabbit_worker_class.side_effect = [mock_rabbit_worker]
-
         # Error should be logged and nothing happens
         collection_harvest(collection.id)
-        mock_rabbit_worker.assert_not_called()
+        self.assertFalse(mock_queue_message.called)
 
-    @patch("ui.jobs.RabbitWorker", autospec=True)
-    def test_wrong_number_of_seeds(self, mock_rabbit_worker_class):
+    @patch("ui.jobs.queue_message")
+    def test_wrong_number_of_seeds(self, mock_queue_message):
         collection = Collection.objects.create(collection_set=self.collection_set, credential=self.credential,
                                                harvest_type=Collection.TWITTER_SAMPLE, name="test_collection",
                                                harvest_options=json.dumps(self.harvest_options), is_active=True)
         Seed.objects.create(collection=collection, token="test_token1")
 
-        mock_rabbit_worker = MagicMock(spec=RabbitWorker)
-        mock_rabbit_worker_class.side_effect = [mock_rabbit_worker]
-
         # Error should be logged and nothing happens
         collection_harvest(collection.id)
-        mock_rabbit_worker.assert_not_called()
+        self.assertFalse(mock_queue_message.called)
 
 
 class StopJobsTests(TestCase):
@@ -143,21 +291,17 @@ class StopJobsTests(TestCase):
         self.historical_collection = self.collection.history.all()[0]
         self.historical_credential = self.historical_collection.credential.history.all()[0]
 
-    @patch("ui.jobs.RabbitWorker", autospec=True)
-    def test_stop_harvest(self, mock_rabbit_worker_class):
+    @patch("ui.jobs.queue_message")
+    def test_stop_harvest(self, mock_queue_message):
         harvest = Harvest.objects.create(harvest_type=Collection.TWITTER_SAMPLE,
                                          collection=self.collection,
                                          historical_collection=self.historical_collection,
                                          historical_credential=self.historical_credential)
 
-        mock_rabbit_worker = MagicMock(spec=RabbitWorker)
-        mock_rabbit_worker_class.side_effect = [mock_rabbit_worker]
-
         collection_stop(self.collection.id)
 
         # Harvest stop message sent
-        name, args, kwargs = mock_rabbit_worker.mock_calls[0]
-        self.assertEqual("send_message", name)
+        args, kwargs = mock_queue_message.call_args
         message = args[0]
         self.assertEqual(message["id"], harvest.harvest_id)
         self.assertEqual("harvest.stop.test_platform.twitter_sample", args[1])
@@ -166,11 +310,8 @@ class StopJobsTests(TestCase):
         harvest = Harvest.objects.get(harvest_id=message["id"])
         self.assertEqual(Harvest.STOP_REQUESTED, harvest.status)
 
-    @patch("ui.jobs.RabbitWorker", autospec=True)
-    def test_missing_collection(self, mock_rabbit_worker_class):
-        mock_rabbit_worker = MagicMock(spec=RabbitWorker)
-        mock_rabbit_worker_class.side_effect = [mock_rabbit_worker]
-
+    @patch("ui.jobs.queue_message")
+    def test_missing_collection(self, mock_queue_message):
         # Error should be logged and nothing happens
         collection_stop(1234567)
-        mock_rabbit_worker.assert_not_called()
+        self.assertFalse(mock_queue_message.called)
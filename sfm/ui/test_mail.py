@@ -0,0 +1,71 @@
+from django.test import TestCase, override_settings
+from django.core import mail
+from django.utils import timezone
+from mock import patch
+from smtplib import SMTPException
+import datetime
+from .mail import queue_mail, send_queued_mail
+from .models import OutboxEmail
+
+
+class MailTests(TestCase):
+    def test_send_queued_mail(self):
+        queue_mail("SFM Harvest for test failed", "The harvest failed.", ["a@test.com", "b@test.com"])
+        queue_mail("SFM Harvest for test failed", "The harvest failed.", ["b@test.com", "c@test.com"])
+        queue_mail("SFM Export is ready", "Your export is ready.", ["a@test.com"])
+
+        self.assertEqual(3, send_queued_mail())
+
+        # Each is sent to its own recipients.
+        self.assertEqual(3, len(mail.outbox))
+        self.assertEqual("SFM Harvest for test failed", mail.outbox[0].subject)
+        self.assertListEqual(["a@test.com", "b@test.com"], mail.outbox[0].to)
+        self.assertListEqual(["b@test.com", "c@test.com"], mail.outbox[1].to)
+        self.assertListEqual(["a@test.com"], mail.outbox[2].to)
+        for email in OutboxEmail.objects.all():
+            self.assertEqual(OutboxEmail.SENT, email.status)
+            self.assertEqual(1, email.attempts)
+            self.assertIsNotNone(email.date_sent)
+
+        # Nothing left to send
+        self.assertEqual(0, send_queued_mail())
+
+    @override_settings(EMAIL_MAX_ATTEMPTS=2)
+    @patch("ui.mail.EmailMessage.send")
+    def test_send_queued_mail_retry(self, mock_send):
+        mock_send.side_effect = SMTPException("Mail server unavailable")
+        queue_mail("SFM Export is ready", "Your export is ready.", ["a@test.com"])
+
+        now = timezone.now()
+        self.assertEqual(0, send_queued_mail(now=now))
+        email = OutboxEmail.objects.get()
+        self.assertEqual(OutboxEmail.QUEUED, email.status)
+        self.assertEqual(1, email.attempts)
+        self.assertEqual("Mail server unavailable", email.error)
+        self.assertTrue(email.date_next_attempt > now)
+
+        # Not yet due
+        self.assertEqual(0, send_queued_mail(now=now))
+        self.assertEqual(1, OutboxEmail.objects.get().attempts)
+
+        # Gives up after max attempts
+        self.assertEqual(0, send_queued_mail(now=now + datetime.timedelta(days=1)))
+        email = OutboxEmail.objects.get()
+        self.assertEqual(OutboxEmail.FAILURE, email.status)
+        self.assertEqual(2, email.attempts)
+
+    @override_settings(EMAIL_CLAIM_SECONDS=300)
+    @patch("ui.mail.EmailMessage.send")
+    def test_send_claimed_mail(self, mock_send):
+        queue_mail("SFM Export is ready", "Your export is ready.", ["a@test.com"])
+        now = timezone.now()
+        # Another sender runs while the email is being sent.
+        concurrent_sent_counts = []
+        mock_send.side_effect = lambda: concurrent_sent_counts.append(send_queued_mail(now=now))
+
+        self.assertEqual(1, send_queued_mail(now=now))
+
+        # The claimed email is not sent by the other sender.
+        self.assertListEqual([0], concurrent_sent_counts)
+        self.assertEqual(1, mock_send.call_count)
+        self.assertEqual(OutboxEmail.SENT, OutboxEmail.objects.get().status)
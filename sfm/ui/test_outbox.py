@@ -0,0 +1,42 @@
+from django.test import TestCase
+from mock import patch
+from .outbox import queue_message, dispatch_messages
+from .models import OutboxMessage
+
+
+class OutboxTests(TestCase):
+    @patch("ui.outbox.RabbitWorker", autospec=True)
+    def test_dispatch_messages(self, mock_rabbit_worker_class):
+        mock_rabbit_worker = mock_rabbit_worker_class.return_value
+        mock_rabbit_worker.publish_messages.return_value = []
+        queue_message({"id": "test:1"}, "harvest.start.test.test_search")
+        queue_message({"id": "test:2"}, "harvest.start.test.test_search")
+        queue_message({"id": "test:3"}, "export.start.test.test_search")
+
+        self.assertEqual(3, dispatch_messages())
+
+        # Published together, in order.
+        mock_rabbit_worker.publish_messages.assert_called_once_with([
+            ("harvest.start.test.test_search", {"id": "test:1"}),
+            ("harvest.start.test.test_search", {"id": "test:2"}),
+            ("export.start.test.test_search", {"id": "test:3"})
+        ])
+        self.assertFalse(OutboxMessage.objects.exists())
+
+        # Nothing left to dispatch
+        self.assertEqual(0, dispatch_messages())
+
+    @patch("ui.outbox.RabbitWorker", autospec=True)
+    def test_dispatch_messages_unconfirmed(self, mock_rabbit_worker_class):
+        mock_rabbit_worker = mock_rabbit_worker_class.return_value
+        # Broker does not confirm the second message.
+        mock_rabbit_worker.publish_messages.return_value = [1]
+        queue_message({"id": "test:1"}, "harvest.start.test.test_search")
+        queue_message({"id": "test:2"}, "harvest.start.test.test_search")
+        queue_message({"id": "test:3"}, "export.start.test.test_search")
+
+        self.assertEqual(2, dispatch_messages())
+
+        # Unconfirmed message is left to be published again.
+        self.assertListEqual([{"id": "test:2"}],
+                             [outbox_message.message for outbox_message in OutboxMessage.objects.all()])
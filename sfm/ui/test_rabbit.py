@@ -0,0 +1,192 @@
+from django.test import TestCase, override_settings
+from mock import patch, call, Mock
+from kombu import Queue
+from kombu.utils import eqhash
+from collections import defaultdict
+from message_consumer.management.commands.startconsumer import QUEUE, ROUTING_KEYS
+from .rabbit import RabbitWorker, RETRY_POLICY
+
+
+class RabbitWorkerTests(TestCase):
+    @patch("ui.rabbit.producers")
+    def test_send_messages(self, mock_producers):
+        mock_producer = mock_producers.__getitem__.return_value.acquire.return_value.__enter__.return_value
+        worker = RabbitWorker()
+        worker.send_message({"id": "test:1"}, "harvest.start.test.test_search")
+        worker.send_messages([{"id": "test:2"}, {"id": "test:3"}], "harvest.start.test.test_search")
+
+        # Pooled producers are used
+        self.assertEqual(2, mock_producers.__getitem__.return_value.acquire.call_count)
+        mock_producer.publish.assert_has_calls([
+            call({"id": "test:1"}, exchange=worker.exchange, routing_key="harvest.start.test.test_search",
+                 retry=True, retry_policy=RETRY_POLICY),
+            call({"id": "test:2"}, exchange=worker.exchange, routing_key="harvest.start.test.test_search",
+                 retry=True, retry_policy=RETRY_POLICY),
+            call({"id": "test:3"}, exchange=worker.exchange, routing_key="harvest.start.test.test_search",
+                 retry=True, retry_policy=RETRY_POLICY)
+        ])
+
+    @override_settings(RABBITMQ_COMPACT_ROUTING_KEYS=["harvest.start.twitter.*", "export.start.#"])
+    @patch("ui.rabbit.producers")
+    def test_send_compact_messages(self, mock_producers):
+        mock_producer = mock_producers.__getitem__.return_value.acquire.return_value.__enter__.return_value
+        worker = RabbitWorker()
+        worker.send_message({"id": "test:1"}, "harvest.start.twitter.twitter_search")
+        worker.send_message({"id": "test:2"}, "harvest.start.flickr.flickr_user")
+        worker.send_message({"id": "test:3"}, "export.start.twitter.twitter_search")
+
+        # Compact encoding only for the listed routing keys
+        mock_producer.publish.assert_has_calls([
+            call({"id": "test:1"}, exchange=worker.exchange, routing_key="harvest.start.twitter.twitter_search",
+                 retry=True, retry_policy=RETRY_POLICY, serializer="msgpack", compression="zlib"),
+            call({"id": "test:2"}, exchange=worker.exchange, routing_key="harvest.start.flickr.flickr_user",
+                 retry=True, retry_policy=RETRY_POLICY),
+            call({"id": "test:3"}, exchange=worker.exchange, routing_key="export.start.twitter.twitter_search",
+                 retry=True, retry_policy=RETRY_POLICY, serializer="msgpack", compression="zlib")
+        ])
+
+    def test_pooled_connection(self):
+        # Connections with the same parameters share a pool.
+        self.assertEqual(eqhash(RabbitWorker.get_connection()), eqhash(RabbitWorker.get_connection()))
+
+    @override_settings(RABBITMQ_TRANSPORT="pyamqp")
+    @patch("ui.rabbit.Producer")
+    @patch("ui.rabbit.connections")
+    def test_publish_messages(self, mock_connections, mock_producer_class):
+        # Broker acks all but the third message.
+        connection = FakeConfirmConnection(nack_delivery_tags=[3])
+        mock_connections.__getitem__.return_value.acquire.return_value = connection
+        mock_producer_class.side_effect = FakeProducer
+
+        messages = [{"id": "test:{}".format(i)} for i in range(1, 8)]
+        failed_indexes = RabbitWorker().publish_messages(iter(("test_routing_key", message) for message in messages),
+                                                         window=3)
+
+        self.assertListEqual([2], failed_indexes)
+        self.assertListEqual(messages, connection.channels[0].published)
+        # Waited for confirms after each window and at the end.
+        self.assertEqual(3, connection.drain_count)
+        # Connection is established with the retry policy and kept. The channel is closed.
+        self.assertListEqual([RETRY_POLICY], connection.ensure_kwargs)
+        self.assertFalse(connection.collected)
+        self.assertTrue(connection.channels[0].closed)
+
+        # The pooled connection is used again.
+        RabbitWorker().publish_messages([("test_routing_key", {"id": "test:8"})])
+        self.assertEqual(2, len(connection.channels))
+        self.assertEqual(2, mock_connections.__getitem__.return_value.acquire.call_count)
+
+    @override_settings(RABBITMQ_TRANSPORT="pyamqp")
+    @patch("ui.rabbit.Producer")
+    @patch("ui.rabbit.connections")
+    def test_publish_messages_connection_error(self, mock_connections, mock_producer_class):
+        connection = FakeConfirmConnection(nack_delivery_tags=[])
+        connection.drain_events = Mock(side_effect=IOError())
+        mock_connections.__getitem__.return_value.acquire.return_value = connection
+        mock_producer_class.side_effect = FakeProducer
+
+        self.assertRaises(IOError, RabbitWorker().publish_messages, [("test_routing_key", {"id": "test:1"})])
+
+        # Connection is dropped.
+        self.assertTrue(connection.collected)
+
+    @override_settings(RABBITMQ_TRANSPORT="memory")
+    def test_memory_transport(self):
+        worker = RabbitWorker()
+        worker.declare_exchange()
+        with RabbitWorker.get_connection() as connection:
+            # Bound as by the message consumer
+            queue = Queue(name=QUEUE, exchange=worker.exchange, channel=connection.default_channel)
+            queue.declare()
+            for routing_key in ROUTING_KEYS:
+                queue.bind_to(exchange=worker.exchange, routing_key=routing_key)
+            try:
+                worker.send_message({"id": "test:1"}, "harvest.status.twitter.twitter_search")
+                worker.send_message({"id": "test:2"}, "harvest.start.twitter.twitter_search")
+                self.assertListEqual([], worker.publish_messages([("warc_created", {"id": "test:3"})]))
+
+                received = []
+                message = queue.get(no_ack=True)
+                while message is not None:
+                    received.append((message.delivery_info["routing_key"], message.payload))
+                    message = queue.get(no_ack=True)
+                self.assertListEqual([("harvest.status.twitter.twitter_search", {"id": "test:1"}),
+                                      ("warc_created", {"id": "test:3"})], received)
+
+                # Compact messages are decoded according to their content type.
+                with override_settings(RABBITMQ_COMPACT_ROUTING_KEYS=["harvest.status.*.*"]):
+                    worker.send_message({"id": "test:4", "seeds": [{"id": "1"}]},
+                                        "harvest.status.twitter.twitter_search")
+                message = queue.get(no_ack=True, accept=["json", "msgpack"])
+                self.assertEqual("application/x-msgpack", message.content_type)
+                self.assertDictEqual({"id": "test:4", "seeds": [{"id": "1"}]}, message.payload)
+            finally:
+                queue.delete()
+
+
+class FakeChannel:
+    def __init__(self):
+        self.events = defaultdict(set)
+        self.published = []
+        self.closed = False
+
+    def confirm_select(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class FakeProducer:
+    def __init__(self, channel, exchange=None):
+        self.channel = channel
+
+    def publish(self, message, routing_key=None, **kwargs):
+        self.channel.published.append(message)
+
+
+class FakeConfirmConnection:
+    connection_errors = (IOError,)
+
+    def __init__(self, nack_delivery_tags):
+        self.channels = []
+        self.nack_delivery_tags = nack_delivery_tags
+        self.confirmed_count = 0
+        self.drain_count = 0
+        self.ensure_kwargs = []
+        self.collected = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def ensure_connection(self, **kwargs):
+        self.ensure_kwargs.append(kwargs)
+
+    def ensure(self, obj, fun, **kwargs):
+        return fun()
+
+    def channel(self):
+        self.channels.append(FakeChannel())
+        self.confirmed_count = 0
+        return self.channels[-1]
+
+    def maybe_close_channel(self, channel):
+        channel.close()
+
+    def collect(self):
+        self.collected = True
+
+    def drain_events(self, timeout=None):
+        self.drain_count += 1
+        channel = self.channels[-1]
+        for delivery_tag in range(self.confirmed_count + 1, len(channel.published) + 1):
+            if delivery_tag in self.nack_delivery_tags:
+                for callback in channel.events["basic_nack"]:
+                    callback(delivery_tag, False, False)
+        # Ack the rest at once
+        for callback in channel.events["basic_ack"]:
+            callback(len(channel.published), True)
+        self.confirmed_count = len(channel.published)
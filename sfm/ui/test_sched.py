@@ -1,12 +1,18 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from apscheduler.job import Job
+from apscheduler.triggers.interval import IntervalTrigger
+import datetime as dt
 import json
-from mock import patch, ANY, call
-from .models import Collection, CollectionSet, Credential, Group, User, Harvest
+from mock import MagicMock, patch, ANY, call
+from .models import Collection, CollectionSet, Credential, Group, User, Harvest, HarvestStat
 from jobs import collection_harvest
 from datetime import datetime
 import pytz
 from django.db.models.signals import post_save, pre_delete
-from sched import schedule_harvest_receiver, unschedule_harvest_receiver, toggle_collection_inactive
+from sched import schedule_harvest_receiver, unschedule_harvest_receiver, toggle_collection_inactive, \
+    stagger_start_date, rebalance_harvests, sched, next_run_times, JobIndex, LeaderScheduler, LeaderElection, \
+    adaptive_interval, adapt_harvest_interval, reconcile_harvests, SchedulerMetrics, apply_job_defaults, \
+    InstrumentedThreadPoolExecutor, InstrumentedProcessPoolExecutor, _create_executor
 
 
 class ScheduleTests(TestCase):
@@ -172,3 +178,297 @@ class ScheduleTests(TestCase):
         mock_scheduler.get_job.assert_has_calls([call(str(collection_id)), call("end_{}".format(collection_id))])
         mock_scheduler.remove_job.assert_has_calls([call(str(collection_id)), call("end_{}".format(collection_id))])
         mock_collection_stop.assert_called_once_with(collection_id)
+
+
+class StaggerTests(TestCase):
+    @override_settings(SCHEDULE_STAGGER_MAX_MINUTES=60, SCHEDULE_JITTER_SECONDS=0)
+    def test_stagger_start_date(self):
+        start_date = dt.datetime(2016, 1, 1, 12)
+        start_dates = [stagger_start_date(collection_pk, 60 * 24, start_date=start_date)
+                       for collection_pk in range(1, 101)]
+        # Same collection, same start date
+        self.assertEqual(start_dates[0], stagger_start_date(1, 60 * 24, start_date=start_date))
+        # Within the window
+        for collection_start_date in start_dates:
+            self.assertTrue(start_date <= collection_start_date < start_date + dt.timedelta(minutes=60))
+        # Spread out
+        self.assertTrue(len(set(start_dates)) > 90)
+
+        # Within the interval
+        self.assertTrue(stagger_start_date(1, 5, start_date=start_date) < start_date + dt.timedelta(minutes=5))
+
+    @override_settings(SCHEDULE_STAGGER_MAX_MINUTES=60)
+    def test_rebalance_harvests(self):
+        now = datetime(2016, 1, 1, 12, tzinfo=pytz.utc)
+        jobs = [_interval_job(collection_pk, 60 * 24, now) for collection_pk in range(1, 5)]
+        jobs.append(_interval_job(5, 30, now))
+
+        rebalanced_jobs = rebalance_harvests(jobs, now=now)
+        self.assertEqual(5, len(rebalanced_jobs))
+        # Spread evenly over the day, regardless of the stagger maximum
+        self.assertListEqual([now + dt.timedelta(seconds=15, hours=hours) for hours in (0, 6, 12, 18)],
+                             [job.next_run_time for job in jobs[:4]])
+        self.assertEqual(dt.timedelta(days=1), jobs[0].trigger.interval)
+        self.assertEqual(now + dt.timedelta(seconds=15), jobs[4].next_run_time)
+        self.assertEqual(dt.timedelta(minutes=30), jobs[4].trigger.interval)
+
+
+@override_settings(ADAPTIVE_SCHEDULE_WINDOW=3, ADAPTIVE_SCHEDULE_QUIET_ITEMS=1, ADAPTIVE_SCHEDULE_BUSY_ITEMS=100,
+                   ADAPTIVE_SCHEDULE_MIN_FACTOR=0.5, ADAPTIVE_SCHEDULE_MAX_FACTOR=4)
+class AdaptiveScheduleTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_superuser(username="test_user", email="test_user@test.com",
+                                             password="test_password")
+        group = Group.objects.create(name="test_group")
+        collection_set = CollectionSet.objects.create(group=group, name="test_collection_set")
+        credential = Credential.objects.create(user=user, platform="test_platform", token="{}")
+        self.collection = Collection.objects.create(collection_set=collection_set, credential=credential,
+                                                    harvest_type="test_type", name="test_collection",
+                                                    schedule_minutes=60)
+
+    def _harvests(self, *item_counts):
+        for items in item_counts:
+            harvest = Harvest.objects.create(collection=self.collection, harvest_type="test_type",
+                                             status=Harvest.SUCCESS)
+            if items is not None:
+                HarvestStat.objects.create(harvest=harvest, harvest_date=dt.date(2016, 1, 1), item="tweets",
+                                           count=items)
+
+    def test_too_few_harvests(self):
+        self._harvests(0, 0)
+        self.assertEqual(120, adaptive_interval(self.collection, 120))
+
+    def test_quiet(self):
+        self._harvests(0, None, 1)
+        self.assertEqual(120, adaptive_interval(self.collection, 60))
+        # Not more than the maximum
+        self.assertEqual(240, adaptive_interval(self.collection, 180))
+
+    def test_busy(self):
+        self._harvests(100, 150, 200)
+        self.assertEqual(60, adaptive_interval(self.collection, 120))
+        # Not less than the minimum
+        self.assertEqual(30, adaptive_interval(self.collection, 60))
+
+    def test_normal(self):
+        self._harvests(10, 20, 30)
+        self.assertEqual(60, adaptive_interval(self.collection, 240))
+
+    def test_unsuccessful_harvests_ignored(self):
+        self._harvests(0, 0, 0)
+        Harvest.objects.create(collection=self.collection, harvest_type="test_type", status=Harvest.FAILURE)
+        self.assertEqual(120, adaptive_interval(self.collection, 60))
+
+    @patch("ui.sched.sched", autospec=True)
+    def test_adapt_harvest_interval(self, mock_scheduler):
+        now = datetime(2016, 1, 1, 12, tzinfo=pytz.utc)
+        mock_scheduler.get_job.return_value = _interval_job(self.collection.pk, 60, now)
+        self._harvests(0, 0, 0)
+
+        adapt_harvest_interval(self.collection.pk)
+        mock_scheduler.reschedule_job.assert_called_once_with(str(self.collection.pk), trigger="interval",
+                                                              minutes=120, start_date=ANY, end_date=None)
+
+    @patch("ui.sched.sched", autospec=True)
+    def test_adapt_harvest_interval_unchanged(self, mock_scheduler):
+        now = datetime(2016, 1, 1, 12, tzinfo=pytz.utc)
+        mock_scheduler.get_job.return_value = _interval_job(self.collection.pk, 60, now)
+        self._harvests(10, 20, 30)
+
+        adapt_harvest_interval(self.collection.pk)
+        mock_scheduler.reschedule_job.assert_not_called()
+
+
+@override_settings(ADAPTIVE_SCHEDULE=False, SCHEDULE_JITTER_SECONDS=0)
+class ReconcileTests(TestCase):
+    def setUp(self):
+        self.now = datetime(2016, 1, 1, 12, tzinfo=pytz.utc)
+        self.end_date = datetime(2207, 12, 22, 17, 31, tzinfo=pytz.utc)
+
+    def _collection(self, collection_pk, schedule_minutes=60, harvest_type=Collection.TWITTER_USER_TIMELINE,
+                    end_date=None):
+        return {"id": collection_pk, "harvest_type": harvest_type, "schedule_minutes": schedule_minutes,
+                "end_date": end_date}
+
+    def test_reconcile_harvests(self):
+        jobs = [_interval_job(1, 60, self.now),
+                _interval_job(3, 30, self.now),
+                _interval_job(4, 60, self.now),
+                _interval_job("end_4", 60, self.now),
+                _interval_job("other", 60, self.now)]
+        collections = [self._collection(1),
+                       self._collection(2),
+                       self._collection(3),
+                       self._collection(5, end_date=self.end_date),
+                       self._collection(6, schedule_minutes=None, harvest_type=Collection.TWITTER_FILTER)]
+
+        added_jobs, replaced_jobs, removed_job_ids = reconcile_harvests(jobs, collections, now=self.now)
+
+        # Missing jobs
+        self.assertListEqual(["2", "5", "end_5"], sorted(job.id for job in added_jobs))
+        job = next(added_job for added_job in added_jobs if added_job.id == "2")
+        self.assertEqual(collection_harvest, job.func)
+        self.assertEqual(dt.timedelta(minutes=60), job.trigger.interval)
+        self.assertTrue(job.next_run_time > self.now)
+        end_job = next(added_job for added_job in added_jobs if added_job.id == "end_5")
+        self.assertEqual(self.end_date, end_job.next_run_time)
+        # Changed interval
+        self.assertListEqual(["3"], [replaced_job.id for replaced_job in replaced_jobs])
+        self.assertEqual(dt.timedelta(minutes=60), replaced_jobs[0].trigger.interval)
+        # Orphaned
+        self.assertListEqual(["4", "end_4"], sorted(removed_job_ids))
+
+    def test_reconcile_end_date(self):
+        jobs = [_interval_job(1, 60, self.now)]
+
+        added_jobs, replaced_jobs, removed_job_ids = reconcile_harvests(
+            jobs, [self._collection(1, end_date=self.end_date)], now=self.now)
+        self.assertListEqual(["end_1"], [job.id for job in added_jobs])
+        self.assertListEqual(["1"], [job.id for job in replaced_jobs])
+        self.assertEqual(self.end_date, replaced_jobs[0].trigger.end_date)
+        self.assertListEqual([], removed_job_ids)
+
+    @override_settings(ADAPTIVE_SCHEDULE=True, ADAPTIVE_SCHEDULE_MIN_FACTOR=0.5, ADAPTIVE_SCHEDULE_MAX_FACTOR=4)
+    def test_reconcile_adaptive_interval(self):
+        jobs = [_interval_job(1, 120, self.now), _interval_job(2, 480, self.now)]
+
+        added_jobs, replaced_jobs, removed_job_ids = reconcile_harvests(
+            jobs, [self._collection(1), self._collection(2)], now=self.now)
+        # Within the adaptive bounds
+        self.assertListEqual([], added_jobs)
+        self.assertListEqual(["2"], [job.id for job in replaced_jobs])
+
+
+class JobIndexTests(TestCase):
+    def test_next_run_time(self):
+        now = datetime(2016, 1, 1, 12, tzinfo=pytz.utc)
+        job_index = JobIndex()
+        job_index.load([_interval_job(1, 60, now)])
+        job_index.update(_interval_job(2, 30, now + dt.timedelta(minutes=5)))
+
+        self.assertEqual(now, job_index.next_run_time("1", now))
+        self.assertEqual(now + dt.timedelta(minutes=5), job_index.next_run_time("2", now))
+        # Advanced past runs
+        self.assertEqual(now + dt.timedelta(minutes=120),
+                         job_index.next_run_time("1", now + dt.timedelta(minutes=90)))
+        self.assertIsNone(job_index.next_run_time("3", now))
+
+        job_index.remove("1")
+        self.assertIsNone(job_index.next_run_time("1", now))
+
+    def test_next_run_times(self):
+        now = datetime.now(pytz.utc) + dt.timedelta(minutes=5)
+        job_index = JobIndex()
+        job_index.load([_interval_job(1, 60, now), _interval_job(2, 30, now)])
+        with patch("ui.sched.job_index", job_index):
+            self.assertDictEqual({1: now, 2: now, 3: None}, next_run_times([1, 2, 3]))
+
+
+class ExecutorTests(TestCase):
+    @override_settings(SCHEDULER_METRICS_INTERVAL=0)
+    def test_scheduler_metrics(self):
+        now = datetime(2016, 1, 1, 12, tzinfo=pytz.utc)
+        metrics = SchedulerMetrics()
+        metrics.job_submitted()
+        metrics.job_submitted()
+        metrics.job_finished()
+        metrics.job_run(now - dt.timedelta(seconds=2), now=now)
+        metrics.job_run(now - dt.timedelta(seconds=4), now=now)
+        metrics.job_missed()
+
+        self.assertDictEqual({"queue_depth": 1, "max_queue_depth": 2, "runs": 2, "missed": 1,
+                              "average_latency": 3.0, "max_latency": 4.0}, metrics.snapshot(reset=True))
+        self.assertDictEqual({"queue_depth": 1, "max_queue_depth": 1, "runs": 0, "missed": 0,
+                              "average_latency": 0.0, "max_latency": 0.0}, metrics.snapshot())
+
+    @override_settings(SCHEDULER_COALESCE=True, SCHEDULER_MISFIRE_GRACE_TIME=900)
+    def test_apply_job_defaults(self):
+        now = datetime(2016, 1, 1, 12, tzinfo=pytz.utc)
+        jobs = [_interval_job(1, 60, now), _interval_job(2, 60, now)]
+        jobs[1]._modify(misfire_grace_time=900)
+
+        changed_jobs = apply_job_defaults(jobs)
+        self.assertListEqual([jobs[0]], changed_jobs)
+        self.assertEqual(900, jobs[0].misfire_grace_time)
+        self.assertTrue(jobs[0].coalesce)
+
+    def test_create_executor(self):
+        with override_settings(SCHEDULER_EXECUTOR="thread", SCHEDULER_MAX_WORKERS=5):
+            executor = _create_executor()
+            self.assertIsInstance(executor, InstrumentedThreadPoolExecutor)
+            self.assertEqual(5, executor._pool._max_workers)
+            executor.shutdown()
+        with override_settings(SCHEDULER_EXECUTOR="process", SCHEDULER_MAX_WORKERS=2):
+            executor = _create_executor()
+            self.assertIsInstance(executor, InstrumentedProcessPoolExecutor)
+            executor.shutdown()
+
+
+class LeaderTests(TestCase):
+    @override_settings(SCHEDULER_LEADER_ELECTION=True, SCHEDULER_LEADER_INTERVAL=5)
+    @patch("ui.sched.job_index")
+    @patch("ui.sched.BackgroundScheduler._process_jobs")
+    def test_process_jobs(self, mock_process_jobs, mock_job_index):
+        mock_process_jobs.return_value = 60
+        scheduler = LeaderScheduler()
+        scheduler.is_leader = False
+
+        # Not leader, so jobs not run.
+        self.assertIsNone(scheduler._process_jobs())
+        mock_process_jobs.assert_not_called()
+
+        # Leader, so jobs are run. Checks again before the next job for jobs from other nodes.
+        scheduler.is_leader = True
+        with patch.object(scheduler, "get_jobs", return_value=["test_job"]):
+            self.assertEqual(5, scheduler._process_jobs())
+        mock_process_jobs.assert_called_once_with(scheduler)
+        # Job index is reloaded.
+        mock_job_index.load.assert_called_once_with(["test_job"])
+
+    @override_settings(SCHEDULER_LEADER_ELECTION=False, SCHEDULER_EXECUTOR="process", SCHEDULER_LEADER_INTERVAL=5)
+    @patch("ui.sched.job_index")
+    @patch("ui.sched.BackgroundScheduler._process_jobs")
+    def test_process_jobs_process_executor(self, mock_process_jobs, mock_job_index):
+        mock_process_jobs.return_value = None
+        scheduler = LeaderScheduler()
+
+        # Jobs may be changed by worker processes, so job index is reloaded and checked again.
+        with patch.object(scheduler, "get_jobs", return_value=["test_job"]):
+            self.assertEqual(5, scheduler._process_jobs())
+        mock_job_index.load.assert_called_once_with(["test_job"])
+
+        # Not reloaded with the thread executor.
+        with override_settings(SCHEDULER_EXECUTOR="thread"):
+            self.assertIsNone(scheduler._process_jobs())
+        self.assertEqual(1, mock_job_index.load.call_count)
+
+    @patch("ui.sched.create_engine")
+    def test_elect(self, mock_create_engine):
+        mock_connection = mock_create_engine.return_value.connect.return_value
+        scheduler = MagicMock(spec=LeaderScheduler)
+        scheduler.is_leader = False
+        election = LeaderElection(scheduler)
+
+        # Another node has the lock.
+        mock_connection.execute.return_value.scalar.return_value = False
+        election.elect()
+        self.assertFalse(scheduler.is_leader)
+
+        # Lock taken
+        mock_connection.execute.return_value.scalar.return_value = True
+        election.elect()
+        self.assertTrue(scheduler.is_leader)
+        scheduler.wakeup.assert_called_once_with()
+
+        # Connection lost
+        election.resign()
+        self.assertFalse(scheduler.is_leader)
+        mock_connection.close.assert_called_once_with()
+        self.assertIsNone(election.connection)
+
+
+def _interval_job(collection_pk, schedule_minutes, start_date):
+    trigger = IntervalTrigger(minutes=schedule_minutes, start_date=start_date, timezone=pytz.utc)
+    return Job(sched, id=str(collection_pk), func=collection_harvest, args=[collection_pk], kwargs={},
+               trigger=trigger, executor="default", name="Harvest", misfire_grace_time=1, coalesce=True,
+               max_instances=1, next_run_time=trigger.get_next_fire_time(None, start_date))